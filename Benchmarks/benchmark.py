@@ -0,0 +1,195 @@
+"""
+Benchmarks of the analysis pipeline on synthetic data, compared to stored baselines.
+
+Usage (from the main folder):
+    python Benchmarks/benchmark.py                      run the small and medium scales and compare to baseline.json
+    python Benchmarks/benchmark.py --scales large       run other scales
+    python Benchmarks/benchmark.py --update             save the results as the new baseline
+
+A case is a regression if it is more than --tolerance times slower than its baseline, or if its result (e.g. the
+number of sweeps found, or a checksum of the decoded data) changed. The exit code is 1 if there are regressions.
+Timings depend on the machine, so update the baseline when changing machines.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+
+benchmark_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.abspath(os.path.join(benchmark_folder,os.pardir)))
+import generate
+import Modules.decodeOVF as decodeOVF
+import Modules.convert_ovf_to_npy as cotn
+import Modules.hysteresis as hys
+import Modules.Plotting.magplot as mp
+import Modules.Plotting.flux as flx
+
+default_baseline = os.path.join(benchmark_folder,'baseline.json')
+noise = 1e-3 #Slowdowns of less than a millisecond are not regressions, however large the ratio
+
+#grid: device cells (Nx,Ny,Nz); frames: number of ovf files converted; steps: field steps per sweep direction
+scales = {
+    'small':  {'grid': (64,32,4),    'empty': 4,  'frames': 5,  'steps': 50,   'sweeps': 2},
+    'medium': {'grid': (200,100,10), 'empty': 10, 'frames': 10, 'steps': 500,  'sweeps': 4},
+    'large':  {'grid': (400,200,13), 'empty': 10, 'frames': 20, 'steps': 2500, 'sweeps': 8},
+    }
+
+def checksum(data):
+    ''' Rounded sum that identifies decoded data without depending on the last bits. '''
+    return round(float(np.sum(np.abs(data))),2)
+
+#Cases~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#Every case gets the scale and a scratch folder, prepares its input and returns a function that does the
+#timed work and returns a result that is compared to the baseline.
+
+def decode_float32(scale,folder):
+    file = generate.write_ovf_series(folder,scale['grid'],1,precision=4)[0]
+    return lambda: checksum(decodeOVF.unpackFile(file)[0])
+
+def decode_float64(scale,folder):
+    file = generate.write_ovf_series(folder,scale['grid'],1,precision=8)[0]
+    return lambda: checksum(decodeOVF.unpackFile(file)[0])
+
+def convert(scale,folder):
+    files = generate.write_ovf_series(folder,scale['grid'],scale['frames'],empty_layers=scale['empty'])
+    def run():
+        cotn.convert_ovf_to_npy(files)
+        return len([file for file in os.listdir(folder) if file.endswith('.npy')])
+    return run
+
+def table_loading(scale,folder):
+    table = os.path.join(folder,'table.txt')
+    generate.sweep_table(table,steps=scale['steps'],sweeps=scale['sweeps'])
+    return lambda: len(pd.read_csv(table,sep='\t'))
+
+def sweep_segmentation(scale,folder):
+    table = os.path.join(folder,'table.txt')
+    generate.sweep_table(table,steps=scale['steps'],sweeps=scale['sweeps'])
+    df = pd.read_csv(table,sep='\t')
+    return lambda: len(hys.analyse(df)[2])
+
+def magplot(scale,folder):
+    file = os.path.join(folder,'m_full000000.npy')
+    np.save(file,generate.vortex(scale['grid'],scale['empty']))
+    def run():
+        mp.magplot(file,zslice=0,pyramid=False)
+        return os.path.exists(file[:-4]+'.pdf')
+    return run
+
+def flux(scale,folder):
+    grid = scale['grid']
+    magfile = os.path.join(folder,'m_full000000.npy')
+    strayfile = os.path.join(folder,'B_demag000000.npy')
+    np.save(magfile,generate.vortex(grid,scale['empty']))
+    np.save(strayfile,generate.stray((grid[0],grid[1],grid[2]+scale['empty'])))
+    def run():
+        #A short penetration depth, so that the trench fits many times in the small grids
+        flx.flux(magfile,{'Zero Vortex': strayfile},penetration_depth=20,filename=os.path.join(folder,'flux'))
+        return os.path.exists(os.path.join(folder,'flux.pdf'))
+    return run
+
+cases = {'decode float32': decode_float32, 'decode float64': decode_float64, 'convert': convert,
+         'table loading': table_loading, 'sweep segmentation': sweep_segmentation, 'magplot': magplot,
+         'flux': flux}
+
+#Running and comparing~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def machine():
+    return {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'processor': platform.processor() or platform.machine()}
+
+def run(scale_names=('small','medium'),repeat=3,names=None):
+    '''
+    Goal: Run the benchmark cases at the given scales.
+    Inputs:
+        -scale_names([str]): keys of 'scales'.
+        -repeat(int): repetitions per case. The fastest one is reported.
+        -names([str]): cases to run. Default is all of them.
+    Returns a dictionary {'<case> @ <scale>': {'seconds': ..., 'result': ...}}.
+    '''
+    results = {}
+    cwd = os.getcwd()
+    for scale_name in scale_names:
+        scale = scales[scale_name]
+        for name,case in cases.items():
+            if names and name not in names:
+                continue
+            folder = tempfile.mkdtemp(prefix='mumax_benchmark_')
+            try:
+                #Some plots are saved in the working directory
+                os.chdir(folder)
+                work = case(scale,folder)
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    result = work()
+                    times.append(time.perf_counter() - start)
+            finally:
+                os.chdir(cwd)
+                shutil.rmtree(folder,ignore_errors=True)
+            results[f'{name} @ {scale_name}'] = {'seconds': min(times), 'result': result}
+            print(f'{name} @ {scale_name}: {min(times)*1e3:.1f} ms')
+    return results
+
+def compare(results,baseline,tolerance=1.5):
+    '''
+    Goal: Compare results to a baseline.
+    Returns a DataFrame with the time of every case, its baseline, the ratio and whether it is a regression.
+    '''
+    rows = []
+    for key,result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            rows.append([key,result['seconds'],None,None,'new'])
+            continue
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] > 0 else float('inf')
+        if result['result'] != base['result']:
+            status = f'REGRESSION: result {result["result"]} instead of {base["result"]}'
+        elif ratio > tolerance and result['seconds'] - base['seconds'] > noise:
+            status = 'REGRESSION: slower'
+        else:
+            status = 'ok'
+        rows.append([key,result['seconds'],base['seconds'],ratio,status])
+    return pd.DataFrame(rows,columns=['case','seconds','baseline (s)','ratio','status'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the analysis pipeline on synthetic data.')
+    parser.add_argument('--scales',nargs='+',default=['small','medium'],choices=list(scales))
+    parser.add_argument('--cases',nargs='+',default=None,choices=list(cases))
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--tolerance',type=float,default=1.5,help='largest allowed slowdown relative to the baseline')
+    parser.add_argument('--baseline',default=default_baseline)
+    parser.add_argument('--update',action='store_true',help='save the results as the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.scales,args.repeat,args.cases)
+    baseline = {'machine': {}, 'results': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    if args.update:
+        baseline['machine'] = machine()
+        baseline['results'].update(results)
+        with open(args.baseline,'w') as file:
+            json.dump(baseline,file,indent=1)
+        print(f'Baseline saved as {args.baseline}.')
+        return 0
+
+    if baseline['machine'] and baseline['machine'] != machine():
+        print('WARNING: the baseline was made on another machine. Timings may not be comparable.')
+    report = compare(results,baseline['results'],args.tolerance)
+    with pd.option_context('display.width',200,'display.max_colwidth',80):
+        print(report.to_string(index=False))
+    return int(report['status'].str.startswith('REGRESSION').any())
+
+if __name__ == '__main__':
+    sys.exit(main())
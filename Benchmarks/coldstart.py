@@ -0,0 +1,66 @@
+"""
+Cold-start import time of the entry points, checked against a budget.
+
+Usage (from the main folder):
+    python Benchmarks/coldstart.py
+
+Every entry point is imported in a fresh Python process. Script generation (MumaxScripter) must stay within its
+time budget and must not import the analysis dependencies, because campaigns start it in many worker processes.
+The exit code is 1 if a budget is exceeded or a heavy module is imported where it should not be.
+"""
+import os
+import sys
+import json
+import subprocess
+
+main_folder = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+
+heavy_modules = ['pandas','matplotlib','PIL','imageio','ffmpy','tqdm']
+
+#statement: (budget in seconds, whether heavy modules may be imported)
+entry_points = {
+    'from Master import MumaxScripter': (0.5,False),
+    'from Modules.MumaxScripter import MumaxScripter': (0.5,False),
+    'from Modules.DataAnalysis import DataAnalysis': (0.5,False),
+    'from Master import *': (2.0,True),
+    }
+
+probe = '''
+import time,sys,json
+start = time.perf_counter()
+{statement}
+seconds = time.perf_counter() - start
+#Modules imported with tools.lazy_import are only counted once they are loaded.
+loaded = [name for name in {heavy} if name in sys.modules and type(sys.modules[name]).__name__ == 'module']
+print(json.dumps([seconds,loaded]))
+'''
+
+def measure(statement,repeat=5):
+    '''
+    Goal: Import time of a statement in a fresh Python process, the fastest of 'repeat' runs.
+    Returns (seconds, heavy modules that were imported).
+    '''
+    best = None
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable,'-c',probe.format(statement=statement,heavy=heavy_modules)],
+                                cwd=main_folder,capture_output=True,text=True,check=True).stdout
+        seconds,loaded = json.loads(output.strip().splitlines()[-1])
+        if best is None or seconds < best[0]:
+            best = (seconds,loaded)
+    return best
+
+def main():
+    failures = 0
+    for statement,(budget,heavy_allowed) in entry_points.items():
+        seconds,loaded = measure(statement)
+        problems = []
+        if seconds > budget:
+            problems.append(f'over budget of {budget:g} s')
+        if loaded and not heavy_allowed:
+            problems.append('imports ' + ', '.join(loaded))
+        failures += bool(problems)
+        print(f'{statement:50s} {seconds*1e3:7.1f} ms  ' + ('; '.join(problems) if problems else 'ok'))
+    return int(failures > 0)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""Synthetic mumax3 output (OVF2 files and table.txt sweeps) for the benchmarks."""
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0,os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir)))
+import Modules.decodeOVF as decodeOVF
+
+table_columns = ['# t (s)','mx ()','my ()','mz ()','E_total (J)','E_exch (J)','E_demag (J)','E_Zeeman (J)',
+                 'maxTorque (T)','LastErr ()','PeakErr ()','B_extx (T)','B_exty (T)','B_extz (T)']
+
+def vortex(grid,empty_layers=0,seed=0):
+    '''
+    Goal: Magnetization of an elliptical device with a vortex in its center, like an m_full file.
+    Inputs:
+        -grid((int,int,int)): number of cells (Nx,Ny,Nz) of the device.
+        -empty_layers(int): layers without magnetization above the device, as in simulations with stray fields.
+        -seed(int): seed of the small random tilt that makes every frame different.
+    Returns an array of shape [Nx,Ny,Nz+empty_layers,3] that is zero outside the ellipse.
+    '''
+    Nx,Ny,Nz = grid
+    x = ((np.arange(Nx) + 0.5) / Nx - 0.5)[:,None] * 2
+    y = ((np.arange(Ny) + 0.5) / Ny - 0.5)[None,:] * 2
+    r = np.sqrt(x**2 + y**2)
+    m = np.stack([-y*np.ones_like(x),x*np.ones_like(y),np.exp(-(r/0.1)**2)],axis=-1)
+    m += 0.05 * np.random.default_rng(seed).standard_normal(m.shape)
+    m /= np.linalg.norm(m,axis=-1,keepdims=True)
+    m[x**2 + y**2 > 1] = 0
+    m = np.repeat(m[:,:,None],Nz,axis=2)
+    return np.concatenate([m,np.zeros((Nx,Ny,empty_layers,3))],axis=2)
+
+def stray(grid,seed=0):
+    ''' Smooth field (in T) of shape [Nx,Ny,Nz,3], standing in for a B_demag file. '''
+    Nx,Ny,Nz = grid
+    x = np.linspace(-1,1,Nx)[:,None,None]
+    y = np.linspace(-1,1,Ny)[None,:,None]
+    z = np.linspace(0,1,Nz)[None,None,:]
+    phase = np.random.default_rng(seed).uniform(0,np.pi)
+    B = 0.05 * np.stack([np.sin(3*x + phase)*np.cos(2*y)*np.exp(-z),
+                         np.cos(3*x)*np.sin(2*y + phase)*np.exp(-z),
+                         np.sin(2*x + y + phase)*np.exp(-2*z)],axis=-1)
+    return B
+
+def write_ovf_series(folder,grid,frames,quantity='m_full',empty_layers=0,precision=4,cell_size=5.0):
+    '''
+    Goal: Write a series of OVF2 files '<quantity>000000.ovf', '<quantity>000001.ovf'... with the control
+    number, like mumax3 does with OutputFormat = OVF2_BINARY (precision 4) or in double precision (8).
+    Returns the list of filenames.
+    '''
+    os.makedirs(folder,exist_ok=True)
+    files = []
+    for i in range(frames):
+        data = stray((grid[0],grid[1],grid[2]+empty_layers),seed=i) if quantity.startswith('B_') else vortex(grid,empty_layers,seed=i)
+        filename = os.path.join(folder,f'{quantity}{i:06d}.ovf')
+        decodeOVF.packFile(filename,data,cell_size,title=quantity.split('_')[0],precision=precision)
+        files.append(filename)
+    return files
+
+def sweep_table(filename,steps=50,sweeps=2,axes='xy',amplitude=100,seed=0):
+    '''
+    Goal: Write a table.txt with field sweeps as written by MumaxScripter.add_field_sweep: for every sweep
+    axis, 'sweeps' times a sweep from 0 to amplitude and back, with a hysteretic switch of the magnetization.
+    Inputs:
+        -filename(str): location of the table.
+        -steps(int): field steps per direction of a sweep.
+        -sweeps(int): number of sweeps per axis.
+        -axes(str): axes that are swept, one after the other.
+        -amplitude(float): largest field in mT.
+    Returns the number of sweeps in the table, as segment_sweeps should find them.
+    '''
+    rng = np.random.default_rng(seed)
+    rows = []
+    t = 0.0
+    up = np.linspace(0,amplitude,steps+1)
+    field = np.concatenate([up,up[-2::-1]])
+    for axis in axes:
+        for _ in range(sweeps):
+            for i,B in enumerate(field):
+                rising = i <= steps
+                #The magnetization switches at half the amplitude on the way up, and at a quarter on the way down.
+                m = np.tanh((B - (0.5 if rising else 0.25)*amplitude) / (0.05*amplitude))
+                vector = np.zeros(3)
+                vector['xyz'.index(axis)] = m
+                vector += 0.01 * rng.standard_normal(3)
+                E = np.abs(rng.normal(1e-16,1e-17,3))
+                Bvec = np.zeros(3)
+                Bvec['xyz'.index(axis)] = B * 1e-3
+                rows.append([t,*vector,E.sum(),*E,1e-4,1e-6,1e-6,*Bvec])
+                t += 1e-12
+    pd.DataFrame(rows,columns=table_columns).to_csv(filename,sep='\t',index=False,float_format='%.8e')
+    return len(axes) * sweeps
@@ -11,7 +11,16 @@ collection of tools.
 
 from Modules import tools
 from Modules.MumaxScripter import MumaxScripter
-from Modules.DataAnalysis import DataAnalysis
+
+#DataAnalysis (with pandas, matplotlib and the plotting modules) is only imported when it is used, so
+#scripts that only write and run simulations start fast.
+__all__ = ['tools','MumaxScripter','DataAnalysis']
+
+def __getattr__(name):
+    if name == 'DataAnalysis':
+        from Modules.DataAnalysis import DataAnalysis
+        return DataAnalysis
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 print('\n\
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n\n\n\
@@ -6,20 +6,25 @@ import platform
 import subprocess
 import webbrowser
 import glob
-import pandas as pd
-import matplotlib.pyplot as plt
-import imageio
-import ffmpy
-import Modules.decodeOVF as decodeOVF
-from tqdm import tqdm
-
-#import different plots
-import Modules.convert_ovf_to_npy as cotn
-import Modules.Plotting.static_field_plot as sfp
-import Modules.Plotting.sweepplot as sp
-import Modules.Plotting.makemovie as mm
-import Modules.Plotting.magplot as mp
-import Modules.Plotting.flux as flx
+import Modules.timing as timing
+import Modules.framestore as framestore
+
+#The analysis and plotting modules (and pandas, matplotlib, imageio...) are imported the first time they are used.
+pd = tools.lazy_import('pandas')
+cotn = tools.lazy_import('Modules.convert_ovf_to_npy')
+pyr = tools.lazy_import('Modules.pyramid')
+tp = tools.lazy_import('Modules.topology')
+trk = tools.lazy_import('Modules.tracking')
+rs = tools.lazy_import('Modules.regionstats')
+spc = tools.lazy_import('Modules.spectral')
+sf = tools.lazy_import('Modules.strayfield')
+hys = tools.lazy_import('Modules.hysteresis')
+integrity = tools.lazy_import('Modules.integrity')
+sfp = tools.lazy_import('Modules.Plotting.static_field_plot')
+sp = tools.lazy_import('Modules.Plotting.sweepplot')
+mm = tools.lazy_import('Modules.Plotting.makemovie')
+mp = tools.lazy_import('Modules.Plotting.magplot')
+flx = tools.lazy_import('Modules.Plotting.flux')
 
 class DataAnalysis:
     #Useful variables
@@ -27,7 +32,17 @@ class DataAnalysis:
     main_folder = os.path.join(source_folder,os.pardir)
     backup_folder = os.path.join(main_folder,'Output')
 
-    def __init__(self,data_folder,do_all=True,**kwargs):
+    def __init__(self,data_folder,do_all=True,profile=(),**kwargs):
+        '''
+        Inputs:
+            -data_folder(str): .out folder of a simulation.
+            -do_all(bool): check the files (see check_integrity), run every available analysis step and write the
+                timing report (timing.json).
+            -profile([str]): names of steps (e.g. 'magplot', 'decode ovf') that are run under cProfile. The
+                results are saved next to the timing report.
+        '''
+        timing.reset()
+        timing.profile(*profile)
         #Set project folder~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         try:
             os.chdir(data_folder)
@@ -45,13 +60,17 @@ class DataAnalysis:
         if self.params: self.get_params()
 
         self.print_available_actions()
+        self.problems = {}
         #Perform all data analysis steps
         if do_all:
+            self.check_integrity()
             if self.table_plots:
                 try: self.static_field_plot()
                 except() as e: print(e)
                 try: self.sweepplot()
                 except() as e: print(e)
+                try: self.hysteresis()
+                except() as e: print(e)
             if self.snapshots:
                 try: self.makemovie()
                 except() as e: print(e)
@@ -59,9 +78,21 @@ class DataAnalysis:
                 try: self.convert_ovf_to_npy()
                 except() as e: print(e)
                 self.update_availability()
+            if self.mag and not self.pyramid:
+                try: self.make_pyramid()
+                except() as e: print(e)
             if self.mag:
                 try: self.magplot()
                 except() as e: print(e)
+                try: self.topology()
+                except() as e: print(e)
+                try: self.region_stats()
+                except() as e: print(e)
+            self.timing_report()
+
+    def timing_report(self,filename='timing.json'):
+        ''' Write the duration, bytes and items of every analysis step so far to the data folder. '''
+        return timing.write_report(os.getcwd(),filename)
 
     def print_available_actions(self):
         print('\n'.join((
@@ -70,8 +101,15 @@ class DataAnalysis:
         'convert_ovf_to_npy:                    ' +  (not self.ovf) * 'un' + 'available',
         'static_field_plot:                     ' +  (not self.table_plots) * 'un' + 'available',
         'sweepplot:                             ' +  (not self.table_plots) * 'un' + 'available',
+        'hysteresis:                            ' +  (not self.table_plots) * 'un' + 'available',
+        'make_pyramid:                          ' +  (not self.mag) * 'un' + 'available',
         'magplot:                               ' +  (not self.mag) * 'un' + 'available',
+        'topology:                              ' +  (not self.mag) * 'un' + 'available',
+        'track:                                 ' +  (not self.mag) * 'un' + 'available',
+        'region_stats:                          ' +  (not self.mag) * 'un' + 'available',
+        'spectra:                               ' +  (not self.autosaved) * 'un' + 'available',
         'snapshot_animation:                    ' +  (not self.snapshots) * 'un' + 'available',
+        'stray_fields:                          ' +  (not self.mag) * 'un' + 'available',
         'fluxplot:                              ' +  (not self.demag) * 'un' + 'available, but needs to be called manually. Please see the documentation.',
         ''
         )))
@@ -97,13 +135,24 @@ class DataAnalysis:
         else:
             self.ovf = False
 
-        if len(tools.find('m*npy')) > 0:
+        if len(framestore.find('m*npy')) > 0:
             self.mag = True
             self.ovf = False
         else:
             self.mag = False
 
-        if len(tools.find('B_demag*npy')) > 0:
+        #Frames of AutoSave(m), see add_static_field(autosave_frames=True)
+        if len(framestore.find('m[0-9]*npy')) > 2:
+            self.autosaved = True
+        else:
+            self.autosaved = False
+
+        if len(tools.find(os.path.join(pyr.pyramid_folder,'m*npy'))) > 0:
+            self.pyramid = True
+        else:
+            self.pyramid = False
+
+        if len(framestore.find('B_demag*npy')) + len(framestore.find('B_stray*npy')) > 0:
             self.demag = True
         else:
             self.demag = False
@@ -117,6 +166,7 @@ class DataAnalysis:
             ['Axes_ratio','value'],
             ['cell_size','value'],
             ['alpha','value'],
+            ['auto_save','value'],
             ['geometry','text']
         ]
 
@@ -159,9 +209,20 @@ class DataAnalysis:
         if mode == 'value':
             return None
 
+    @timing.timed()
+    def check_integrity(self,**kwargs):
+        '''
+        Check all ovf, npy and image files in the data folder (see integrity.scan) and write a checksum manifest.
+        Files with problems, e.g. truncated by a killed simulation, are left out of the analysis.
+        '''
+        tools.logprint('Checking output files.')
+        self.problems = integrity.scan('.',**kwargs)
+        return self.problems
+
+    @timing.timed()
     def convert_ovf_to_npy(self,**kwargs):
         tools.logprint('Finding .ovf files to convert.')
-        files = tools.find('*.ovf')
+        files = integrity.good_files(tools.find('*.ovf'),self.problems)
         if files == []:
             tools.logprint(f'No .ovf files found.')
         else:
@@ -169,32 +230,55 @@ class DataAnalysis:
             cotn.convert_ovf_to_npy(files,**kwargs)
             self.mag=True
 
+    @timing.timed()
+    def hysteresis(self,**kwargs):
+        tools.logprint('Extracting hysteresis loops and switching fields.')
+        self.sweeps = hys.hysteresis([self.table],**kwargs)
+
+    @timing.timed()
+    def make_pyramid(self,**kwargs):
+        tools.logprint('Making downsampled levels of magnetization files.')
+        datafiles = framestore.find('m*.npy')
+
+        if datafiles == []:
+            tools.logprint(f'No data files found.')
+        else:
+            pyr.make_pyramid(datafiles,**kwargs)
+            self.pyramid = True
+
+    @timing.timed()
     def static_field_plot(self,**kwargs):
         tools.logprint('Making static field plot.....')
         sfp.static_field_plot(self.table,**kwargs)
 
+    @timing.timed()
     def sweepplot(self,**kwargs):
         tools.logprint('Plotting magnetization and energy figures.')
         sp.sweepplot(self.table,**kwargs)
 
+    @timing.timed()
     def magplot(self, **kwargs):
         tools.logprint('Plotting magnetic spins for all files in folder.')
 
         #Get list of magnetic-spin data files
-        datafiles = tools.find('m_full*.npy')
+        datafiles = framestore.find('m_full*.npy')
 
         if datafiles == []:
-            datafiles = tools.find('m*.npy')
+            datafiles = framestore.find('m*.npy')
 
         if datafiles == []:
             tools.logprint(f'No data files found.')
         else:
+            from tqdm import tqdm
             tools.logprint(f'{len(datafiles)} files found. Starting image creation.')
 
             if self.table:#Get list of external field values
-                df = pd.read_csv(self.table,sep='	')
+                with timing.span('read table',bytes_read=timing.file_size(self.table)):
+                    df = pd.read_csv(self.table,sep='	')
                 B = np.array([df['B_extx (T)'].to_numpy(), df['B_exty (T)'].to_numpy(), df['B_extz (T)'].to_numpy()])
                 B = np.rint( np.transpose(B * 1000) ).astype('int')
+                #With an output policy the files are not one per table row
+                rows = tp.frame_rows(df,datafiles)
 
             try:
                 self.zslice = int(self.Height/self.cell_size/2)
@@ -205,17 +289,102 @@ class DataAnalysis:
                 #Collect variables needed for magplot function
                 relevant_variables = {'zslice','cell_size','B_ext','geometry','filename'}
                 input = {}
-                if self.table:
-                    input['B_ext'] = B[i]
+                if self.table and rows[i] >= 0:
+                    input['B_ext'] = B[rows[i]]
                 input.update((k, v) for k, v in self.__dict__.items() if k in relevant_variables)
                 input.update((k, v) for k, v in kwargs.items() if k in relevant_variables)
 
                 mp.magplot(datafiles[i], **input)
 
 
+    @timing.timed()
+    def topology(self,**kwargs):
+        tools.logprint('Labelling magnetic states by their vortex cores.')
+        datafiles = framestore.find('m_full*.npy')
+
+        if datafiles == []:
+            datafiles = framestore.find('m*.npy')
+
+        if datafiles == []:
+            tools.logprint(f'No data files found.')
+        else:
+            input = {k: v for k, v in self.__dict__.items() if k in {'zslice','cell_size'}}
+            if self.table_plots:
+                input['table'] = self.table
+            input.update(kwargs)
+            self.states = tp.topology(datafiles,**input)
+
+    @timing.timed()
+    def track(self,batch_size=50,**kwargs):
+        tools.logprint('Tracking vortex cores and domain walls.')
+        datafiles = framestore.find('m_full*.npy')
+
+        if datafiles == []:
+            datafiles = framestore.find('m*.npy')
+
+        if datafiles == []:
+            tools.logprint(f'No data files found.')
+        else:
+            #Frames that were tracked in an earlier call are skipped.
+            input = {k: v for k, v in self.__dict__.items() if k in {'zslice','cell_size'}}
+            if self.table_plots:
+                input['table'] = self.table
+            input.update(kwargs)
+            tracker = trk.Tracker(**input)
+            return tracker.update(datafiles,batch_size=batch_size)
+
+    @timing.timed()
+    def region_stats(self,regions=None,**kwargs):
+        '''
+        Averages, variances and in-plane angle histograms of every region for every frame (see
+        regionstats.region_stats). Without 'regions', the regions saved by mumax3 (regions*.ovf) are used,
+        or else the device and its layers as found in the first frame.
+        '''
+        tools.logprint('Calculating statistics per region.')
+        datafiles = framestore.find('m_full*.npy')
+
+        if datafiles == []:
+            datafiles = framestore.find('m*.npy')
+
+        if datafiles == []:
+            tools.logprint(f'No data files found.')
+        else:
+            if regions is None:
+                saved = framestore.find('regions*.npy')
+                regions = rs.mumax_regions(saved[0]) if saved else rs.device_regions(framestore.load(datafiles[0]))
+            if self.table_plots:
+                kwargs.setdefault('table',self.table)
+            self.regions = rs.region_stats(datafiles,regions,**kwargs)
+            return self.regions
+
+    @timing.timed()
+    def spectra(self,frequencies=None,**kwargs):
+        '''
+        Power spectra of the average magnetization in the table and of every cell of the autosaved m*.npy
+        frames, with maps of the modes at 'frequencies' (GHz) or at the largest peaks (see spectral.mode_maps).
+        The time between frames is read from the log (auto_save) or given as dt (s).
+        '''
+        tools.logprint('Calculating spectra.')
+        if self.table_plots:
+            try: self.table_spectrum = spc.table_spectrum(self.table)
+            except ValueError as e: tools.logprint(f'No spectrum of the table: {e}')
+
+        datafiles = framestore.find('m[0-9]*.npy')
+        dt = kwargs.pop('dt',getattr(self,'auto_save',None))
+        if len(datafiles) < 3:
+            tools.logprint(f'No autosaved frames found.')
+        elif dt is None:
+            tools.logprint('Time between the frames unknown. Please give dt.')
+        else:
+            input = {k: v for k, v in self.__dict__.items() if k in {'zslice'}}
+            input.update(kwargs)
+            self.spectrum,self.modes = spc.mode_maps(datafiles,dt,frequencies=frequencies,**input)
+            return self.spectrum
+
+    @timing.timed()
     def makemovie(self,query='m*.jpg',**kwargs):
         tools.logprint('Finding images for movie.')
-        images = tools.find(query)
+        images = integrity.good_files(tools.find(query),self.problems)
 
         if images == []:
             tools.logprint(f'No images found with query \'{query}\'')
@@ -223,8 +392,32 @@ class DataAnalysis:
             tools.logprint(f'{len(images)} images found. Starting movie creation.')
             mm.makemovie(images,**kwargs)
 
+    @timing.timed()
+    def stray_fields(self,**kwargs):
+        tools.logprint('Calculating stray fields from magnetization files.')
+        datafiles = framestore.find('m_full*.npy')
+
+        if datafiles == []:
+            tools.logprint(f'No m_full files found.')
+        else:
+            if hasattr(self, 'cell_size'): kwargs.setdefault('cell_size',self.cell_size)
+            sf.convert_stray_fields(datafiles,**kwargs)
+            self.demag = True
+
+    @timing.timed()
     def flux(self,**kwargs):
-        reference_file = tools.find('m_full*.npy')[1]
+        reference_file = framestore.find('m_full*.npy')[1]
+        if 'strayfile' not in kwargs:
+            #Use the first stray field file of every state found by topology()
+            if not hasattr(self, 'states'): self.topology()
+            first = self.states.drop_duplicates('state')
+            kwargs['strayfile'] = {state: file.replace('m_full','B_demag') for state,file in zip(first['state'],first['file'])}
+            if framestore.find(list(kwargs['strayfile'].values())[0]) == []:
+                #B_demag saved as a single layer is called B_demag_zrange<layer>_<number>.npy by mumax3
+                cropped = {state: framestore.find(file.replace('m_full','B_demag_zrange*_')) for state,file in kwargs['strayfile'].items()}
+                kwargs['strayfile'] = {state: files[0] for state,files in cropped.items() if files} or kwargs['strayfile']
+            if framestore.find(list(kwargs['strayfile'].values())[0]) == []:
+                kwargs['strayfile'] = {state: sf.stray_file(file) for state,file in zip(first['state'],first['file'])}
         tools.logprint('Plotting stray fields.')
         if hasattr(self, 'cell_size'):
             flx.flux(magfile=reference_file,cell_size=self.cell_size,**kwargs)
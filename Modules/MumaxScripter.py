@@ -1,10 +1,18 @@
 import numpy as np
 import Modules.tools as tools
 import os
-import time
 import platform
-import subprocess
 import webbrowser
+from Modules.runner import JobRunner
+from Modules.workqueue import WorkQueue
+from Modules.monitor import stage_plan
+from Modules.cache import ResultCache, base_script, warm_start_mark
+import Modules.mx3script as mx3
+import Modules.estimate as est
+import Modules.gridsize as gs
+from Modules.splitting import SplitSimulation
+from Modules.statelibrary import StateLibrary, write_state
+import Modules.decodeOVF as decodeOVF
 
 #Physical constants
 nm = 1e-9
@@ -15,7 +23,7 @@ class MumaxScripter:
     main_folder = os.path.abspath(os.path.join(source_folder,os.pardir))
     backup_folder = os.path.join(main_folder,'Output')
 
-    def __init__(self,project_folder=None,**kwargs):
+    def __init__(self,project_folder=None,change_dir=True,verbose=True,**kwargs):
         '''
         This function initializes the class by creating variables with all parameters needed to run a
         simulation.
@@ -23,31 +31,39 @@ class MumaxScripter:
         elliptical cylinder of dimensions 800x400x65 nm.
         If 'contacts' is set to True but no mask file has been given through 'custom_mask', then a default
         mask is applied (Masks\Co(h60,d800,cx).png).
+        If 'change_dir' is False, the working directory is left alone and all files are written to and read
+        from the project folder directly. 'verbose' turns the log messages on or off.
         '''
-        tools.logprint('\n\nStarting new simulation.\n\n')
+        self.verbose = verbose
+        self.logprint('\n\nStarting new simulation.\n\n')
         #Set project folder~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         if project_folder == None:
-            tools.logprint('No project folder defined. Using backup output folder.')
+            self.logprint('No project folder defined. Using backup output folder.')
             project_folder = self.backup_folder
 
-        elif not os.path.exists(project_folder):
-            tools.logprint('Project folder does not exist. If you are on Windows, make sure to use double backslashes. This is what you gave as input: \n\n' + project_folder+'\n')
-            tools.logprint('Using backup output folder.')
+        elif not os.path.exists(project_folder) and change_dir:
+            self.logprint('Project folder does not exist. If you are on Windows, make sure to use double backslashes. This is what you gave as input: \n\n' + project_folder+'\n')
+            self.logprint('Using backup output folder.')
             project_folder = self.backup_folder
 
-        try:
-            os.chdir(project_folder)
-            tools.logprint('Working directory changed to: ' + os.getcwd())
-        except OSError:
-            tools.logprint("Can't change the current working directory for some reason. Changing to backup folder.")
-            project_folder = self.backup_folder
+        if not change_dir:
+            #The folder is made by write_out if it does not exist yet.
+            self.project_folder = os.path.abspath(project_folder)
+        else:
             try:
                 os.chdir(project_folder)
-                tools.logprint('Working directory changed to: ' + os.getcwd())
+                self.logprint('Working directory changed to: ' + os.getcwd())
             except OSError:
-                tools.logprint("Still can't change working directory. Exiting program. Better investigate what's going on!")
-                tools.logprint('Exiting.')
-                exit()
+                self.logprint("Can't change the current working directory for some reason. Changing to backup folder.")
+                project_folder = self.backup_folder
+                try:
+                    os.chdir(project_folder)
+                    self.logprint('Working directory changed to: ' + os.getcwd())
+                except OSError:
+                    self.logprint("Still can't change working directory. Exiting program. Better investigate what's going on!")
+                    self.logprint('Exiting.')
+                    exit()
+            self.project_folder = os.getcwd()
 
         #Load simulation parameters~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         default_parameters = {
@@ -60,11 +76,17 @@ class MumaxScripter:
             'axes_ratio' : 2.0,    #Ratio between long and short axes
             'cell_size' : 5.0,     #"Resolution" of the simulation
             'contacts': False,     #Whether or not to run with contacts
-            'stray_fields': False   #Whether to save B_demag files or not. Significantly changes simulation script!
+            'stray_fields': False,  #Whether to save B_demag files or not. Significantly changes simulation script!
+            'output_policy': {},    #Per quantity (m_full, B_demag, snapshot) which output to save. See outputs().
+            'smooth_grid': False,   #False, 'cell_size' or 'pad': make the grid 7-smooth for fast FFTs. See smooth().
+            'cell_tolerance': 0.05, #Largest relative change of the cell size for smooth_grid='cell_size'
+            'warm_start': False,    #Start from a relaxed state of the state library instead of RandomMag(). See warm_start_condition().
+            'collect_state': False  #Save the relaxed starting state and add it to the state library after run().
             }
 
         #Update the parameters by what the user has set as parameter values
         default_parameters.update(kwargs)
+        self.parameters = default_parameters
         #Convert parameter dictionarty to variables
         for key in default_parameters: self.__setattr__(key, default_parameters[key])
 
@@ -73,7 +95,7 @@ class MumaxScripter:
             self.custom_name = False
             self.name = f'Co(h{self.h},d{self.D},contacts,ratio{self.axes_ratio})'
         else: self.custom_name = True
-        tools.logprint('Simulation name: ' + self.name)
+        self.logprint('Simulation name: ' + self.name)
 
         #Load contacts~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         #Set contacts to true if custom mask is provided
@@ -83,11 +105,11 @@ class MumaxScripter:
         if self.contacts:
             if hasattr(self, 'custom_mask'):
                 self.name_maskfile = kwargs['custom_mask']
-                x,y = tools.get_resolution(self.name_maskfile)
-                tools.logprint('Loaded custom mask file: ' + self.name_maskfile)
+                x,y = tools.get_resolution(os.path.join(self.project_folder,self.name_maskfile))
+                self.logprint('Loaded custom mask file: ' + self.name_maskfile)
 
             else:
-                tools.logprint('No mask file given. Using default mask file.')
+                self.logprint('No mask file given. Using default mask file.')
                 self.name_maskfile = os.path.join(self.main_folder,'Masks','Co(h60,d800,cx).png')
 
                 #Scale standard mask to current parameters
@@ -104,24 +126,78 @@ class MumaxScripter:
         self.Nx = int(round(x / self.cell_size))
         self.Ny = int(round(y / self.cell_size))
         self.Nz = int(round(self.h / self.cell_size))
+        self.Nz_empty = int(50/self.cell_size) if self.stray_fields else 0 #empty space above device
+        self.mask_scale = None
+        if self.smooth_grid: self.smooth(x,y)
 
-        tools.logprint('Chosen parameters: \n')
-        print('\n'.join("%s: %s" % item for item in default_parameters.items())+'\n')
+        self.logprint('Chosen parameters: \n')
+        if self.verbose: print('\n'.join("%s: %s" % item for item in default_parameters.items())+'\n')
 
         if self.Nx*self.Ny*self.Nz > 1e6:
-            tools.logprint(f'WARNING: The simulation contains more than a million pixels ({str(self.Nx*self.Ny*self.Nz)}). This will take a while.')
+            self.logprint(f'WARNING: The simulation contains more than a million pixels ({str(self.Nx*self.Ny*self.Nz)}). This will take a while.')
 
 
         self.new_config()
 
+    def logprint(self,string):
+        if self.verbose: tools.logprint(string)
+
+    def smooth(self,x,y):
+        '''
+        Goal: change the grid so that every dimension only has prime factors 2, 3, 5 and 7, which makes the FFTs
+        of the demag convolution in mumax3 much faster.
+            - smooth_grid='cell_size': change the cell size by at most cell_tolerance so that the device fits a
+                smooth grid. Falls back to padding if no such cell size exists.
+            - smooth_grid='pad': add empty cells around the device. A custom mask is scaled back to its
+                physical size, so it no longer fills the whole grid. Without stray fields, the height can not
+                be padded (the geometry fills the whole grid in z).
+        Inputs:
+            - x,y(float): physical size of the device in nm.
+        '''
+        old = (self.Nx,self.Ny,self.Nz+self.Nz_empty)
+        fit = None
+        if self.smooth_grid in ('cell_size',True):
+            fit = gs.fit_cell_size((x,y,self.h),self.cell_size,self.cell_tolerance,self.Nz_empty)
+            if fit is None: self.logprint(f'No cell size within {self.cell_tolerance:.0%} of {self.cell_size} nm gives a smooth grid. Padding instead.')
+        if fit is not None:
+            self.cell_size,(self.Nx,self.Ny,self.Nz),self.Nz_empty = fit
+        else:
+            Nx,Ny = gs.next_smooth(self.Nx),gs.next_smooth(self.Ny)
+            if self.contacts: self.mask_scale = (self.Nx/Nx,self.Ny/Ny)
+            self.Nx,self.Ny = Nx,Ny
+            if self.stray_fields:
+                self.Nz_empty = gs.next_smooth(self.Nz+self.Nz_empty) - self.Nz
+
+        new = (self.Nx,self.Ny,self.Nz+self.Nz_empty)
+        speedup = gs.convolution_cost(old) / gs.convolution_cost(new)
+        self.logprint(f'Grid {old[0]}x{old[1]}x{old[2]} changed to {new[0]}x{new[1]}x{new[2]} with cell size {self.cell_size:g} nm. Expected demag speedup: {speedup:.1f}x.')
+        if not self.stray_fields and not gs.is_smooth(self.Nz):
+            self.logprint(f'Nz = {self.Nz} is not smooth, but can not be padded without stray field layers.')
+
+    @property
+    def mumaxscript(self):
+        ''' Text of the .mx3 file, rendered from self.script. '''
+        return self.script.render()
+
+    @mumaxscript.setter
+    def mumaxscript(self,text):
+        #Text appended to the script (self.mumaxscript += ...) is kept as it is, after the stages so far.
+        current = self.script.render()
+        if text.startswith(current):
+            self.script.add_raw(text[len(current):])
+        else:
+            self.script = mx3.Script()
+            self.script.add_raw(text)
+
     def new_config(self):
         '''
-        This function creates a string variable self.mumaxscript, which will contain the entire text for the
-        .mx3 file. This is done by appending new lines to the variable. Make sure to only append to this
-        variable and not reset it! The only way to reset self.mumaxscript is to call this function.
+        This function creates self.script, the structured form of the .mx3 file, with the setup, device,
+        geometry, material and starting condition sections. Stages are appended to it by add_static_field and
+        add_field_sweep; self.mumaxscript gives the text. The only way to reset the script is to call this
+        function.
         '''
-        self.mumaxscript = '\n'.join((
-        '\n/* Simulation setup */',
+        self.script = mx3.Script()
+        self.script.section('Simulation setup',(
         'TableAdd(E_total)',
         'TableAdd(E_exch)',
         'Tableadd(E_demag)',
@@ -132,51 +208,82 @@ class MumaxScripter:
         'TableAdd(B_ext)',
         'FixDt = 5e-13',
         'OutputFormat = OVF2_BINARY',
-        'EdgeSmooth = 0',
-        '\n/* Device properties */',
+        'EdgeSmooth = 0'
+        ))
+        self.script.section('Device properties',(
         f'Height := {self.h}',
         f'Diameter := {self.D}',
         f'Axes_ratio := {self.axes_ratio}',
         f'Nx := {self.Nx}',
         f'Ny := {self.Ny}',
-        f'Nz := {self.Nz + int(50/self.cell_size)} //add 100nm of empty space above device' * self.stray_fields,
-        f'Nz := {self.Nz}' * (not self.stray_fields),
+        f'Nz := {self.Nz + self.Nz_empty} //add {self.Nz_empty*self.cell_size:.3g}nm of empty space above device' if self.stray_fields else f'Nz := {self.Nz}',
         'SetGridsize(Nx,Ny,Nz)',
         f'cell_size := {self.cell_size}',
         'nm := 1e-9',
-        'SetCellsize(cell_size*nm,cell_size*nm,cell_size*nm)\n'
-        '\n/* Geometry */'
+        'SetCellsize(cell_size*nm,cell_size*nm,cell_size*nm)'
         ))
         if self.contacts:
-            self.mumaxscript += f'\ngeometry := ImageShape("{self.name_maskfile}")\n'
+            geometry = f'geometry := ImageShape("{self.name_maskfile}")'
+            #Keep the mask at its physical size in a padded grid
+            if self.mask_scale: geometry += f'.Scale({self.mask_scale[0]:.6g},{self.mask_scale[1]:.6g},1)'
         else:
-            self.mumaxscript += f'\ngeometry := Ellipse({self.D}*nm,{int(self.D/self.axes_ratio)}*nm)\n'
+            geometry = f'geometry := Ellipse({self.D}*nm,{int(self.D/self.axes_ratio)}*nm)'
 
         if self.stray_fields:
-            self.mumaxscript += '\n'.join((
+            self.script.section('Geometry',(
+            geometry,
             'DefRegion(1,geometry)',
-            f'DefRegion(2,Layers({self.Nz+1},{self.Nz + int(50/self.cell_size) + 1})) //empty space',
-            '\n/* Physical properties of material */',
+            f'DefRegion(2,Layers({self.Nz+1},{self.Nz + self.Nz_empty + 1})) //empty space',
+            'save(regions) //for statistics per region in the analysis'
+            ))
+            self.script.section('Physical properties of material',(
             f'Msat.SetRegion(1, {self.Msat}) // saturasation magnetisation',
             f'Aex.SetRegion(1, {self.Aex}) // exchange stiffness',
-            f'alpha.SetRegion(1,{self.alpha})',
-            '\n/* Starting Condition */',
-            'm.setRegion(1,RandomMag()) ',
-            'B := 0.0\n'
+            f'alpha.SetRegion(1,{self.alpha})'
+            ))
+            self.script.section('Starting Condition',(
+            'm.setRegion(1,RandomMag())',
+            'B := 0.0'
             ))
         else:
-            self.mumaxscript += '\n'.join((
+            self.script.section('Geometry',(
+            geometry,
             'SetGeom(geometry)'
-            '\n/* Physical properties of material */',
+            ))
+            self.script.section('Physical properties of material',(
             f'Msat = {self.Msat}// saturasation magnetisation',
             f'Aex = {self.Aex} // exchange stiffness',
-            f'alpha = {self.alpha}',
-            '\n/* Starting Condition */',
+            f'alpha = {self.alpha}'
+            ))
+            self.script.section('Starting Condition',(
             'm = RandomMag()',
-            'B := 0.0\n'
+            'B := 0.0'
             ))
 
-    def add_static_field(self,field,relax=False,runtime=2.0,autosave=0.05,remove_afterwards=True,snapshots=True):
+    def outputs(self,snapshots=True,table=True):
+        '''
+        Nodes that save the state after every step. The output_policy parameter limits what is saved per
+        quantity ('snapshot', 'm_full', 'B_demag'), e.g.
+            output_policy = {'m_full': {'every': 5}, 'snapshot': {'threshold': 0.01}, 'B_demag': {'crop': 'interface'}}
+            - every(int): save every Nth step.
+            - threshold(float): save only if an average magnetization component changed more than this.
+            - crop(int, (x1,x2,y1,y2,z1,z2) or 'interface'): save one z layer or a block of cells. 'interface'
+                is the first layer above the device, which is the layer used for stray field plots.
+        The table is always saved every step, so with 'every' or 'threshold' the files are no longer one per
+        table row.
+        '''
+        def save(kind,quantity):
+            policy = dict(self.output_policy.get('snapshot' if kind == 'snapshot' else quantity,{}))
+            if policy.get('crop') == 'interface': policy['crop'] = self.Nz
+            return mx3.Save(kind,quantity,**policy)
+
+        nodes = [save('snapshot','m')] if snapshots else []
+        nodes.append(save('save','m_full'))
+        if self.stray_fields: nodes.append(save('save','B_demag'))
+        if table: nodes.append(mx3.Save('table'))
+        return nodes
+
+    def add_static_field(self,field,relax=False,runtime=2.0,autosave=0.05,remove_afterwards=True,snapshots=True,autosave_frames=False):
         '''
         Goal: set a static field until device has relaxed and optionally remove it afterwards.
         Inputs:
@@ -186,6 +293,8 @@ class MumaxScripter:
             - remove_afterwards(bool): whether to set the field back to [0,0,0] and relax.
             - autosave(float): how often to save data in nanoseconds. 0 means off. disabled if relax==True
             - snapshots(bool): save snapshots of magnetization after every step
+            - autosave_frames(bool): also save the magnetization (m*.ovf) at every autosave, for the spectra of
+                every cell (DataAnalysis.spectra). Needs autosave.
         '''
 
         if len(field) != 3:
@@ -194,53 +303,17 @@ class MumaxScripter:
 
         #If you use the relax function in mumax, no time information is saved, making autosave functions
         #useless.
-        if autosave != 0.0 and not relax:
-            if 'auto_save :=' not in self.mumaxscript:
-                self.mumaxscript += '\n'.join((
-                f'auto_save := {autosave}e-9',
-                'TableAutoSave(auto_save)',
-                'AutoSnapshot(m,auto_save)'
-                ))
-
-        self.mumaxscript += '\n'.join((
-        '\n\n/*Static field */',
-        f'B_ext = vector({field[0]}/1000,{field[1]}/1000,{field[2]}/1000)'
-        ))
-
-        if relax:
-            self.mumaxscript += '\n'.join((
-            '\nrelax()',
-            'snapshot(m)' * snapshots,
-            'save(m_full)',
-            'save(B_demag)' * self.stray_fields,
-            'tablesave()\n'
-            ))
-        else:
-            self.mumaxscript += '\n'.join((
-            f'\nrun({runtime}e-9)',
-            'snapshot(m)' * snapshots,
-            'save(m_full)',
-            'save(B_demag)\n' * self.stray_fields
-            ))
-
+        if autosave != 0.0 and not relax and self.script.autosave is None:
+            self.script.autosave = autosave
+        if autosave_frames and self.script.autosave is not None and 'm' not in self.script.autosave_quantities:
+            self.script.autosave_quantities.append('m')
+
+        #Only relaxed states are written to the table by hand; during a run the table is saved automatically.
+        evolve = lambda: [mx3.Relax()] + self.outputs(snapshots) if relax else [mx3.Run(runtime)] + self.outputs(snapshots,table=False)
+        nodes = [mx3.SetField(tuple(field))] + evolve()
         if remove_afterwards:
-            self.mumaxscript += '\nB_ext = vector(0,0,0)'
-
-            if relax:
-                self.mumaxscript += '\n'.join((
-                '\nrelax()',
-                'snapshot(m)' * snapshots,
-                'save(m_full)',
-                'save(B_demag)' * self.stray_fields,
-                'tablesave()\n'
-                ))
-            else:
-                self.mumaxscript += '\n'.join((
-                f'\nrun({runtime}e-9)',
-                'snapshot(m)' * snapshots,
-                'save(m_full)',
-                'save(B_demag)\n' * self.stray_fields
-                ))
+            nodes += [mx3.SetField((0,0,0))] + evolve()
+        self.script.add_stage('Static field',nodes)
 
     def add_field_sweep(self,sweep_dir,start_mag=None,start=0,end=50,step_size=5,snapshots=True,sweep_back=True,relax_zero=False):
         '''
@@ -258,134 +331,275 @@ class MumaxScripter:
               if relax_zero == True, sweep_back is set to False
         '''
         #Set initial magnetization~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+        directions = {'x':'1,0,0', 'y':'0,1,0', 'z':'0,0,1', '-x':'-1,0,0', '-y':'0,-1,0', '-z':'0,0,-1'}
         if start_mag != None:
-            self.mumaxscript += f'\n/*starting condition: fully magnetized in {start_mag}-direction */\n'
-            if start_mag == 'x':
-                self.mumaxscript += f'm.SetRegion(1, uniform(1,0,0))\n'
-            elif start_mag == 'y':
-                self.mumaxscript += f'm.SetRegion(1, uniform(0,1,0))\n'
-            elif start_mag == 'z':
-                self.mumaxscript += f'm.SetRegion(1, uniform(0,0,1))\n'
-            elif start_mag == '-x':
-                self.mumaxscript += f'm.SetRegion(1, uniform(-1,0,0))\n'
-            elif start_mag == '-y':
-                self.mumaxscript += f'm.SetRegion(1, uniform(0,-1,0))\n'
-            elif start_mag == '-z':
-                self.mumaxscript += f'm.SetRegion(1, uniform(0,0,-1))\n'
-
-            self.mumaxscript += '\n'.join((
-            'relax()',
-            'snapshot(m)' * snapshots,
-            'save(m_full)',
-            'save(B_demag)' * self.stray_fields,
-            'tablesave()\n'))
+            nodes = [mx3.SetMagnetization(f'uniform({directions[start_mag]})',region=1)] if start_mag in directions else []
+            self.script.add_stage(f'starting condition: fully magnetized in {start_mag}-direction',
+                                  nodes + [mx3.Relax()] + self.outputs(snapshots))
 
         #Set field sweep~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        self.mumaxscript += f'\n/* Field Sweep in {sweep_dir}-direction */\n'
-
-        if end > start:
-            sweep_direction = 1
-            self.mumaxscript += 'for B='+str(start)+'e-3; B<='+str(end)+'e-3; B+='+str(step_size)+'e-3{'
-        elif start > end:
-            sweep_direction = -1
-            self.mumaxscript += 'for B='+str(start)+'e-3; B>='+str(end)+'e-3; B-='+str(step_size)+'e-3{'
-
-        if sweep_dir == 'x':
-            self.mumaxscript += '\n    B_ext = vector(B,0,0)\n'
-        elif sweep_dir == 'y':
-            self.mumaxscript += '\n    B_ext = vector(0,B,0)\n'
-        elif sweep_dir == 'z':
-            self.mumaxscript += '\n    B_ext = vector(0,0,B)\n'
-
-        self.mumaxscript += '\n'.join((
-        '    relax()',
-        '    snapshot(m)'* snapshots,
-        '    save(m_full)',
-        '    save(B_demag)' * self.stray_fields,
-        '    tablesave()\n'
-        ))
-
+        step = step_size if end >= start else -step_size
+        body = [mx3.SetField(sweep_dir),mx3.Relax()] + self.outputs(snapshots)
         if relax_zero:
-            self.mumaxscript += '\n'.join((
-            '    B_ext = vector(0,0,0)',
-            '    relax()',
-            '    snapshot(m)'* snapshots,
-            '    save(m_full)',
-            '    save(B_demag)' * self.stray_fields,
-            '    tablesave()',
-            '    m = uniform(1,0,0)',
-            '    relax()',
-            '    snapshot(m)'* snapshots,
-            '    save(m_full)',
-            '    save(B_demag)' * self.stray_fields,
-            '    tablesave()\n'))
-
-        self.mumaxscript += '\n}\n'
-
-        if sweep_back and not relax_zero:
-            if end > start:
-                sweep_direction = 1
-                self.mumaxscript += '\nfor B='+str(step_size)+'e-3; B<='+str(end-start)+'e-3; B+='+str(step_size)+'e-3{'
-            elif start > end:
-                sweep_direction = -1
-                self.mumaxscript += '\nfor B='+str(step_size)+'e-3; B>='+str(end-start)+'e-3; B-='+str(step_size)+'e-3{'
-
-            if sweep_dir == 'x':
-                self.mumaxscript += f'\n    B_ext = vector({end}e-3-B,0,0)\n'
-            elif sweep_dir == 'y':
-                self.mumaxscript += f'\n    B_ext = vector(0,{end}e-3-B,0)\n'
-            elif sweep_dir == 'z':
-                self.mumaxscript += f'\n    B_ext = vector(0,0,{end}e-3-B)\n'
-
-            self.mumaxscript += '\n'.join((
-            '    relax()',
-            '    snapshot(m)'* snapshots,
-            '    save(m_full)',
-            '    save(B_demag)' * self.stray_fields,
-            '    tablesave()',
-            '}\n'
-            ))
+            body += [mx3.SetField((0,0,0)),mx3.Relax()] + self.outputs(snapshots)
+            body += [mx3.SetMagnetization('uniform(1,0,0)'),mx3.Relax()] + self.outputs(snapshots)
+        loops = [mx3.FieldLoop(sweep_dir,start,end,step,body)]
+
+        if sweep_back and not relax_zero and end != start:
+            loops.append(mx3.FieldLoop(sweep_dir,end-step,start,-step,list(body)))
+        self.script.add_stage(f'Field Sweep in {sweep_dir}-direction',loops)
+
+    def load_magnetization(self,file):
+        '''
+        Goal: continue the simulation from a magnetization saved earlier.
+        Inputs:
+            - file(str): .ovf file, e.g. saved by mumax3 with save(m) or saveas(m,"name"). Relative paths are
+                relative to the project folder. The grid is resampled by mumax3 if it differs.
+        '''
+        path = os.path.abspath(os.path.join(self.project_folder,file)).replace('\\','/')
+        self.script.add_stage('Load magnetization',[mx3.Statement(f'm.LoadFile("{path}")')])
+
+    def split(self,chunk_size=1,write=True,optimize=False):
+        '''
+        Goal: divide the first sweep with independent field points (add_field_sweep with relax_zero=True)
+        over separate scripts that can run at the same time, e.g. on several GPUs or machines.
+        Inputs:
+            - chunk_size(int): number of field values per script.
+            - write(bool): write the scripts right away.
+            - optimize(bool): optimize the script before splitting it (see write_out).
+        Returns a SplitSimulation. Run it with .run(concurrency,gpus=...) to simulate all parts and merge
+        the output into <name>.out.
+        '''
+        if optimize:
+            for message in self.script.optimize():
+                self.logprint(message)
+        split = SplitSimulation(self,chunk_size=chunk_size)
+        if write: split.write()
+        return split
+
+    def warm_start_condition(self):
+        '''
+        Goal: replace the random starting magnetization by the closest compatible relaxed state in the state
+        library (same geometry, height and material, closest cell size), resampled to this grid. The loaded
+        state is relaxed, saved as ground_state.ovf and added to the library after run(). With collect_state the
+        random start is relaxed and saved as well, so the library fills up for the next simulations of this
+        device.
+        Nothing changes without warm_start and collect_state, if the library has no compatible state, or if the
+        first stage sets or loads the magnetization anyway. The added lines are marked (see cache.base_script),
+        so a warm start does not change the cache key of the script.
+        '''
+        for node in (self.script.stages[0].nodes if self.script.stages else []):
+            if isinstance(node,mx3.SetMagnetization) or (isinstance(node,mx3.Statement) and 'LoadFile' in node.text):
+                return
+            if not isinstance(node,(mx3.SetField,mx3.Comment)):
+                break
+
+        titles = [title for title,_ in self.script.sections]
+        if not (self.warm_start or self.collect_state) or 'Starting Condition' not in titles:
+            return
+        i = titles.index('Starting Condition')
+        #The lines of an earlier call are taken back first.
+        lines = base_script('\n'.join(self.script.sections[i][1])).split('\n')
+        lines = [line for line in lines if 'ground_state' not in line and line != 'relax()']
+
+        #A starting state that was set on purpose (see coarse_start) is kept.
+        library = StateLibrary()
+        key = None
+        if self.warm_start and not any('LoadFile' in line for line in lines):
+            key = library.lookup(self)
+        if key is not None:
+            filename = os.path.join(self.project_folder,f'start_{key}_{self.Nx}x{self.Ny}x{self.Nz+self.Nz_empty}.ovf')
+            if not os.path.exists(filename):
+                os.makedirs(self.project_folder,exist_ok=True)
+                library.initial_state(self,filename)
+            load = f'm.LoadFile("{filename}")'.replace('\\','/')
+            lines = [f'{load}{warm_start_mark}: {line}' if 'RandomMag' in line else line for line in lines]
+            lines += ['relax()'+warm_start_mark,'saveas(m,"ground_state")'+warm_start_mark]
+            self.logprint(f'Starting from relaxed state {key} of the state library.')
+        elif self.collect_state:
+            lines += ['relax()','saveas(m,"ground_state")']
+        self.script.sections[i] = ('Starting Condition',lines)
+
+    def coarse_start(self,factor=2,timeout=None,mumax=None):
+        '''
+        Goal: relax the same device with a coarser cell size first and start this simulation from the result.
+        The coarse state is upsampled to this grid, normalized and masked by the geometry, and written to
+        '<name>_coarse_start.ovf', which is loaded as the starting condition. The fine simulation starts close
+        to equilibrium, so its first relax() takes much less time.
+        Inputs:
+            - factor(float): coarse cell size divided by the cell size of this simulation.
+            - timeout(float): seconds after which the coarse simulation is killed.
+            - mumax(str): mumax3 executable. Default is $MUMAX3 or 'mumax3'.
+        Returns True if the starting condition was set. Otherwise the simulation keeps its starting condition.
+        '''
+        parameters = dict(self.parameters,name=self.name+'_coarse',cell_size=self.parameters['cell_size']*factor,warm_start=False,collect_state=False)
+        coarse = MumaxScripter(project_folder=self.project_folder,change_dir=False,verbose=self.verbose,**parameters)
+        if coarse.Nz < 1:
+            #Coarser cells than the device is high leave no layer to simulate
+            self.logprint(f'Cell size {coarse.cell_size:g} nm is too coarse for a height of {self.h} nm. Not starting from a coarse state.')
+            return False
+        coarse.script.add_stage('Relaxed state',[mx3.Relax(),mx3.Statement('saveas(m,"ground_state")')])
+        coarse.write_out(overwrite=True)
+        self.logprint(f'Relaxing with cell size {coarse.cell_size:g} nm ({coarse.Nx}x{coarse.Ny}x{coarse.Nz} cells).')
+        if not coarse.run(timeout=timeout,mumax=mumax,gui=False):
+            return False
+
+        ground_state = os.path.join(coarse.path_mumaxscript[:-4]+'.out','ground_state.ovf')
+        if self.warm_start or self.collect_state: StateLibrary().add(coarse,ground_state)
+        m,_ = decodeOVF.unpackFile(ground_state)
+        filename = os.path.join(self.project_folder,self.name+'_coarse_start.ovf')
+        write_state(self,m[:,:,:coarse.Nz],filename)
+
+        i = [title for title,_ in self.script.sections].index('Starting Condition')
+        load = f'm.LoadFile("{filename}")'.replace('\\','/')
+        self.script.sections[i] = ('Starting Condition',[load if 'RandomMag' in line or 'LoadFile' in line else line
+                                                         for line in self.script.sections[i][1]])
+        self.logprint(f'Starting from the coarse state in {os.path.basename(filename)}.')
+        return True
+
+    def prepare(self, optimize=False):
+        '''
+        Goal: apply the changes that write_out makes to the script (warm start and optimization) without
+        writing it, e.g. to compare the final scripts of several simulations.
+        Inputs:
+            - optimize(bool): see write_out.
+        Returns the text of the script as write_out writes it.
+        '''
+        self.warm_start_condition()
+        if optimize:
+            for message in self.script.optimize():
+                self.logprint(message)
+        return self.mumaxscript
+
+    def write_out(self, overwrite=False, optimize=False):
+        '''
+        Goal: write the script to '<name>.mx3' in the project folder.
+        Inputs:
+            - overwrite(bool): overwrite a script with the same name. Otherwise a number is added to the name,
+                unless the existing script is identical.
+            - optimize(bool): remove relax/save steps and field assignments that cannot change the result and
+                merge sweeps that continue each other (see mx3script.Script.optimize). Off by default: the
+                first value of a sweep that repeats the previous state is removed, and sweepplot uses these
+                rows to tell the sweeps apart.
+        '''
+        self.prepare(optimize)
+        counts = self.script.count_outputs()
+        self.logprint(f'Expected output: {counts["table"]} table rows, {counts.get("m_full",0)} m_full files, '
+                      f'{counts["snapshot"]} snapshots, {counts["relax"]} relax() calls and {counts["run"]:g} ns of run time.')
 
-    def write_out(self, overwrite=False):
         self.name_mumaxscript = self.name+'.mx3'
-        #If the name of this simulation already exists, add number to name so we don't overwrite anything
-        if not overwrite and os.path.exists(self.name_mumaxscript):
+        #If the name of this simulation already exists, add number to name so we don't overwrite anything.
+        #A script with exactly the same content is the same simulation, so its name is used again. The lines of
+        #a warm start do not count, as they change whenever the state library gets a new state.
+        if not overwrite and os.path.exists(os.path.join(self.project_folder,self.name_mumaxscript)):
             i = 2
-            while os.path.exists(self.name + str(i) + '.mx3'):
+            candidate = self.name_mumaxscript
+            while os.path.exists(os.path.join(self.project_folder,candidate)):
+                with open(os.path.join(self.project_folder,candidate)) as file:
+                    if base_script(file.read()) == base_script(self.mumaxscript):
+                        break
+                candidate = self.name + str(i) + '.mx3'
                 i+=1
-            self.name = self.name + str(i)
-            self.name_mumaxscript = self.name+'.mx3'
+            self.name = candidate[:-4]
+            self.name_mumaxscript = candidate
+        self.path_mumaxscript = os.path.join(self.project_folder,self.name_mumaxscript)
+        os.makedirs(self.project_folder,exist_ok=True)
 
-        mumaxfile = open(self.name_mumaxscript,'w+')
+        mumaxfile = open(self.path_mumaxscript,'w+')
         mumaxfile.write(self.mumaxscript)
         mumaxfile.close()
-        tools.logprint(f'File \'{self.name_mumaxscript}\' generated.')
+        self.logprint(f'File \'{self.name_mumaxscript}\' generated.')
 
-    def run(self,filename=None):
+    def estimate(self,model=None,scratch=None,max_days=7.0):
+        '''
+        Goal: predict the number of steps and output files, the disk use and the wall time of the script and
+        report anything that makes it unwise to run. See estimate.estimate for the inputs.
+        Returns the estimate as a dictionary.
+        '''
+        result = est.estimate(self,model=model,scratch=scratch,max_days=max_days)
+        self.logprint(f'Estimate for {self.name}: {result["relax"]} relax() calls, {result["run"]:g} ns of run time, '
+                      f'{result["ovf"]} ovf files, {result["snapshot"]} snapshots, {result["bytes"]/1e6:.1f} MB, '
+                      f'about {result["seconds"]/3600:.1f} hours.')
+        for flag in result['flags']:
+            tools.logprint(f'WARNING: {self.name} {flag}.')
+        return result
+
+    def run(self,filename=None,timeout=None,retries=0,mumax=None,gui=None,use_cache=True,monitor=True):
+        '''
+        Goal: run the simulation with mumax3 and wait until it is finished. Works on any platform that has a
+        mumax3 executable. The output of mumax3 is written to a .log file next to the script.
+        Inputs:
+            - filename(str): script to run. Default is the script made by write_out.
+            - timeout(float): seconds after which the simulation is killed. None means no limit.
+            - retries(int): how often a failed simulation is started again.
+            - mumax(str): mumax3 executable. Default is $MUMAX3 or 'mumax3'.
+            - gui(bool): open the mumax3 web interface in a browser. Default is only on Windows.
+            - use_cache(bool): if the same script (with the same mask) finished before, link its output
+                instead of running it again.
+            - monitor(bool,dict): log the progress, throughput and ETA while the simulation runs and write them
+                to '<name>.metrics.jsonl' (see monitor.RunMonitor for the options).
+        Returns True if mumax3 finished without errors.
+        '''
         if filename == None:
             try:
-                filename = self.name_mumaxscript
+                filename = self.path_mumaxscript
             except AttributeError:
                 tools.logprint('No script to run! Exiting.')
                 return False
-
-        if platform.system() != 'Windows':
-            tools.logprint('This is not Windows! How am I supposed to run this!?')
-            return False
+            self.estimate()
         else:
-            tools.logprint(f'Starting mumax3 simulation of {self.name_mumaxscript}.')
+            filename = os.path.join(self.project_folder,filename)
 
-        start_time = time.time()
-        webbrowser.open('http://127.0.0.1:35367', new=0, autoraise=True)
-        simulation = subprocess.run(['mumax3',self.name_mumaxscript], capture_output=True, text=True)
-        elapsed_time = time.time() - start_time
+        if gui == None: gui = platform.system() == 'Windows'
+        if gui: webbrowser.open('http://127.0.0.1:35367', new=0, autoraise=True)
 
-        if elapsed_time < 30:
-            tools.logprint('Simulation took less than 30 seconds. Something probably went wrong. Here is the simulation output.')
-            print('Non-error output:\n' + simulation.stdout)
-            print('Error output:\n' + simulation.stderr)
+        cache = ResultCache() if use_cache else None
+        runner = JobRunner(mumax=mumax,timeout=timeout,retries=retries,verbose=self.verbose,cache=cache,monitor=monitor)
+        #The stages are only known for the script made by write_out.
+        job = runner.submit(filename,plan=stage_plan(self.script) if filename == getattr(self,'path_mumaxscript',None) else None)
+        runner.run()
+
+        if job.status != 'done':
+            tools.logprint(f'Something went wrong ({job.reason}). Here is the end of the simulation output.')
+            with open(job.log) as log:
+                print(''.join(log.readlines()[-20:]))
             return False
+        elif job.reason == 'cached':
+            self.logprint('Reused the output of an identical simulation.')
+            return True
         else:
-            tools.logprint('Simulation run succesfully.')
-            tools.logprint(f'The simulation took {np.int(np.floor(elapsed_time/3600))} hours, {np.int(np.floor(elapsed_time%3600/60))} minutes, and {np.int(np.floor(elapsed_time%3600%60))} seconds.')
+            self.logprint('Simulation run succesfully.')
+            self.logprint(f'The simulation took {int(job.elapsed//3600)} hours, {int(job.elapsed%3600//60)} minutes, and {int(job.elapsed%60)} seconds.')
+            if job.metrics is not None:
+                self.logprint(f'Wrote {job.metrics["rows"]} table rows ({job.metrics["rows/s"]*60:.2f} per minute) and simulated {job.metrics["t (ns)"]:.3g} ns.')
+            ground_state = os.path.join(job.output,'ground_state.ovf')
+            if (self.warm_start or self.collect_state) and filename == getattr(self,'path_mumaxscript',None) and os.path.exists(ground_state):
+                StateLibrary().add(self,ground_state)
             return True
+
+    def submit(self,queue,filename=None,timeout=None,retries=0):
+        '''
+        Goal: put the simulation in a work queue in a shared folder instead of running it here. Workers on any
+        machine that mounts the folder run it (see workqueue.py); the record of the job is written to done/ or
+        failed/ in the queue folder.
+        Inputs:
+            - queue(str): queue folder. It must be on storage that the workers share, like the script.
+            - filename(str): script to submit. Default is the script made by write_out.
+            - timeout(float): seconds after which the simulation is killed. None means no limit.
+            - retries(int): how often a failed simulation is started again by its worker.
+        Returns the name of the job.
+        '''
+        if filename == None:
+            try:
+                filename = self.path_mumaxscript
+            except AttributeError:
+                tools.logprint('No script to submit! Exiting.')
+                return None
+            self.estimate()
+        else:
+            filename = os.path.join(self.project_folder,filename)
+
+        plan = stage_plan(self.script) if filename == getattr(self,'path_mumaxscript',None) else None
+        job_id = WorkQueue(queue).submit(filename,timeout=timeout,retries=retries,plan=plan)
+        self.logprint(f'Submitted {os.path.basename(filename)} to the queue in {queue} as {job_id}.')
+        return job_id
@@ -3,7 +3,10 @@ import matplotlib.pyplot as plt
 import matplotlib
 import os
 from PIL import Image
+import Modules.framestore as framestore
+import Modules.timing as timing
 
+@timing.timed()
 def flux(magfile,strayfile,device_height=None,device_start_x=0,cell_size=5.0,trench_width=15,
     penetration_depth=150,mask_image=None,trench_location=None,filename=None):
     '''
@@ -39,7 +42,7 @@ def flux(magfile,strayfile,device_height=None,device_start_x=0,cell_size=5.0,tre
     total_trench_width = trench_width + 2 * penetration_depth
 
     #Infer proportions of device of reference mag file.
-    mag = np.load(magfile)
+    mag = framestore.load(magfile)
     shape = np.shape(mag)
 
     plot_start = - 20 * cell_size
@@ -53,7 +56,10 @@ def flux(magfile,strayfile,device_height=None,device_start_x=0,cell_size=5.0,tre
     else:
         #Go to the middle in xy and check where is de first occurence in de z-direction of the spin becoming
         #zero. This is the first pixel-row above the device (i.e. where you want to know the B_demag field.)
-        interface = np.argmin( np.abs( mag[ int(shape[0]/2), int(shape[1]/2), :, 2] ) )#in pixels
+        #If the magnetization file has no empty layers (e.g. for B_stray files from strayfield.py), the
+        #first layer above the device is the first layer after the grid.
+        column = np.abs( mag[ int(shape[0]/2), int(shape[1]/2), :, 2] )
+        interface = np.argmin(column) if np.any(column == 0) else shape[2] #in pixels
 
     #Create mask to leave out all points where m=0 (points outside device in xy plane)
     if mask_image != None:
@@ -68,7 +74,9 @@ def flux(magfile,strayfile,device_height=None,device_start_x=0,cell_size=5.0,tre
     extraticks = []
     max = 0
     for state in strayfile.keys():
-        stray = np.load(strayfile[state])[:,:,interface,2]
+        stray = framestore.load(strayfile[state])
+        #Files saved with CropLayer (output_policy crop='interface') only contain the interface layer.
+        stray = stray[:,:,interface if np.shape(stray)[2] > 1 else 0,2]
 
         field = [] #List of Demag_field in trenches
         domain = [] #List of centers of trenches
@@ -93,7 +101,7 @@ def flux(magfile,strayfile,device_height=None,device_start_x=0,cell_size=5.0,tre
             domain.append((x-device_start_x) * cell_size)
 
         max = np.max([max, np.max(field)])
-        plt.plot(domain,field,label=state,c=colors[state])
+        plt.plot(domain,field,label=state,c=colors.get(state))
 
         #if trench_location != None:
             #trench_loc = np.argmin( np.abs( np.array(domain) - trench_location ) )
@@ -123,6 +131,7 @@ def flux(magfile,strayfile,device_height=None,device_start_x=0,cell_size=5.0,tre
     if filename==None: filename = 'flux.pdf'
     else: filename += '.pdf'
     plt.savefig(filename)
+    timing.add(bytes_written=timing.file_size(filename))
     if __name__ == '__main__':
         plt.show()
     plt.clf()
@@ -3,8 +3,35 @@ import numpy as np
 import matplotlib.pyplot as plt
 import os
 from PIL import Image
+import Modules.pyramid as pyr
+import Modules.framestore as framestore
+import Modules.timing as timing
 
-def magplot(datafile,zslice=0,cell_size=5.0,B_ext=None,geometry=None,filename=None):
+def quiver_arrows(datafile,data,mask,skip,zslice=0,pyramid=True):
+    '''
+    Goal: Pick one arrow every 'skip' cells in x and y. A downsampled level averages over cells instead of
+    picking one of them; only a level whose factor divides 'skip' is used, so the arrows stay 'skip' cells
+    apart. The arrow is then the block that contains the cell, at the center of that block.
+    Returns the x and y positions in cells, the arrows [nx,ny,3] and a mask of arrows outside the device.
+    '''
+    shape = np.shape(data)[:2]
+    #Largest power of two that divides skip
+    level,factor = pyr.load_level(datafile,skip & -skip,mmap_mode='r') if pyramid else (None,1)
+    ix = np.arange(0,shape[0],skip)//factor
+    iy = np.arange(0,shape[1],skip)//factor
+    if level is None:
+        arrows = data[np.ix_(ix,iy)]
+    else:
+        arrows = np.array(level[np.ix_(ix,iy,[zslice])][:,:,0])
+        timing.add(bytes_read=arrows.nbytes)
+    offset = (factor-1)/2
+    xx,yy = np.meshgrid(ix*factor+offset,iy*factor+offset,indexing='ij')
+    centers = np.ix_(np.minimum(ix*factor+factor//2,shape[0]-1),np.minimum(iy*factor+factor//2,shape[1]-1))
+    arrow_mask = mask[centers] | (np.sum(np.abs(arrows),axis=2) == 0)
+    return xx,yy,arrows,arrow_mask
+
+@timing.timed()
+def magplot(datafile,zslice=0,cell_size=5.0,B_ext=None,geometry=None,filename=None,pyramid=True):
     '''
     Goal: Make a plot of magnetic spins in xy plane of device. The plot consists of two parts:
         - a vector field plot of the xy plane magnetization, handled by plt.quiver()
@@ -18,52 +45,43 @@ def magplot(datafile,zslice=0,cell_size=5.0,B_ext=None,geometry=None,filename=No
         -B_ext(float): Value of externally applied field. Is put in title of image.
         -mask_image(str): location of png image used as device mask in mumax.
         -filename(str): custom filename.
+        -pyramid(bool): take the arrows from a downsampled level made by pyramid.make_pyramid if available.
     '''
     cell_size = float(cell_size) #somehow this doesn't always work automatically so just in case
-    data = np.load(datafile)[:,:,zslice]
-    original_shape = np.shape(data)
+    #Memory mapped, so only the plotted layer is read
+    frame = framestore.load(datafile,mmap_mode='r')
+    original_shape = np.shape(frame)[:2]
     #Create slicing mask for quiver plot later. This is to make the number of arrows managable.
     #The idea is: roughly 30 arrows in each direction.
-    skip = int(np.shape(data)[0]/30)
-    slicer = (slice(None,None,skip),slice(None,None,skip))
+    skip = max(int(original_shape[0]/30),1)
 
-    norm = np.max(data)
-    data = data/norm
-
-    #Select relevant vector components
-    mx = data[:,:,0]
-    my = data[:,:,1]
-    mz = data[:,:,2]
+    data = np.array(frame[:,:,zslice])
+    timing.add(items=1,bytes_read=data.nbytes)
 
     #Create mask to leave out all points where m=0 (points outside device)
     if geometry != None:
         if __name__ == '__main__':
             print('Setting all spins outside device to zero')
         geometry = '../' + geometry
-        shape = np.shape(mx)
+        shape = np.shape(data)
         im = np.array(Image.open(geometry).resize((shape[0],shape[1])))
         im = np.swapaxes(im,0,1)
         mask = np.where((np.sum(im,axis=2) == 0),True,False)
     else:
         mask = np.where(np.sum(data,axis=2)==0,True,False)
 
-    mx[mask] = np.nan
-    my[mask] = np.nan
-    mz[mask] = np.nan
-
     #Vector field part~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    #Trim data
-    mx = mx[slicer]
-    my = my[slicer]
+    xx,yy,arrows,arrow_mask = quiver_arrows(datafile,data,mask,skip,zslice,pyramid)
 
-    #Create grid
-    shape = np.shape(mx)
-    xx,yy = np.mgrid[0:shape[0],0:shape[1]]
+    norm = np.max(data)
+    mx = np.where(arrow_mask,np.nan,arrows[:,:,0]/norm)
+    my = np.where(arrow_mask,np.nan,arrows[:,:,1]/norm)
+    mz = np.where(mask,np.nan,data[:,:,2]/norm)
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
-    ax.quiver(xx*cell_size*skip,
-        yy*cell_size*skip,
+    ax.quiver(xx*cell_size,
+        yy*cell_size,
         mx,
         my,
         width=0.015,headwidth=3,headlength=3,headaxislength=3,
@@ -85,6 +103,7 @@ def magplot(datafile,zslice=0,cell_size=5.0,B_ext=None,geometry=None,filename=No
     if filename==None: filename = datafile[:-4]+'.pdf'
     else: filename += '.pdf'
     fig.savefig(filename)
+    timing.add(bytes_written=timing.file_size(filename))
     if __name__ == '__main__':
         plt.show()
     plt.close(fig)
@@ -1,4 +1,5 @@
 import Modules.tools as tools
+import Modules.timing as timing
 import imageio
 import ffmpy
 from tqdm import tqdm
@@ -16,8 +17,11 @@ def makemovie(images, fps=10, delete=False):
     images = tools.corruption_check(images)
 
     tools.logprint('Making gif...')
-    source = [imageio.imread(str(image)) for image in images]
-    imageio.mimwrite('movie.gif', source, fps=fps)
+    with timing.span('read images',items=len(images),bytes_read=sum(map(timing.file_size,images))):
+        source = [imageio.imread(str(image)) for image in images]
+    with timing.span('write gif') as s:
+        imageio.mimwrite('movie.gif', source, fps=fps)
+        s.add(bytes_written=timing.file_size('movie.gif'))
     tools.logprint('Gif saved')
 
     tools.logprint('Making mp4...')
@@ -27,7 +31,9 @@ def makemovie(images, fps=10, delete=False):
       outputs={'movie.mp4': None})
 
     try:
-      ff.run()
+      with timing.span('encode mp4',bytes_read=timing.file_size('movie.gif')) as s:
+        ff.run()
+        s.add(bytes_written=timing.file_size('movie.mp4'))
       tools.logprint('mp4 saved')
     except ffmpy.FFExecutableNotFoundError:
       tools.logprint('Executable ffmpeg not found.')
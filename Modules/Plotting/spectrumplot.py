@@ -0,0 +1,50 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import Modules.timing as timing
+
+@timing.timed()
+def spectrumplot(spectrum,maps,frequencies,filename=None):
+    '''
+    Goal: Plot a power spectrum and the mode maps at the selected frequencies.
+    The plot consists of:
+        - the power spectral density of mx, my and mz on a log scale, with the selected frequencies marked.
+        - one row per mode with the amplitude of mx, my and mz in every cell.
+    Inputs:
+        -spectrum(pd.DataFrame): spectrum as written by spectral.mode_maps ('f (GHz)' and one column per component).
+        -maps(np.array): complex mode maps of shape [modes,Nx,Ny,3]. Maps of all layers are averaged over z.
+        -frequencies([float]): frequency of every mode in GHz.
+        -filename(str): custom filename.
+    '''
+    if np.ndim(maps) == 5: maps = np.mean(np.abs(maps),axis=3)
+    fig = plt.figure(figsize=(12,3 + 3*len(maps)))
+    grid = fig.add_gridspec(1 + len(maps),3)
+
+    #Spectrum
+    splot = fig.add_subplot(grid[0,:])
+    f = spectrum['f (GHz)']
+    for key in spectrum.keys()[1:]:
+        splot.plot(f,spectrum[key],label=key)
+    for frequency in frequencies:
+        splot.axvline(frequency,color='grey',linestyle='--',linewidth=0.8)
+    splot.set_yscale('log')
+    splot.set_xlabel('Frequency (GHz)')
+    splot.set_ylabel('Power spectral density (1/GHz)')
+    splot.legend(loc=1)
+
+    #Mode maps
+    for i,frequency in enumerate(frequencies):
+        for c,label in enumerate(('mx','my','mz')):
+            ax = fig.add_subplot(grid[1+i,c])
+            image = ax.imshow(np.abs(maps[i,:,:,c]).T,origin='lower',cmap='inferno')
+            ax.set_title(f'{label} at {frequency:.3g} GHz')
+            ax.set_xticks([])
+            ax.set_yticks([])
+            fig.colorbar(image,ax=ax,shrink=0.8)
+
+    fig.tight_layout()
+    if filename==None: filename = 'spectrum.pdf'
+    else: filename += '.pdf'
+    fig.savefig(filename)
+    timing.add(bytes_written=timing.file_size(filename))
+    print(f'Figure saved as \'{filename}\'.')
+    plt.close(fig)
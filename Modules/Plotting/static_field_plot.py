@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import Modules.timing as timing
 
 color_dict = {'x': 'blue', 'y': 'orange', 'z': 'green',
               '-x': 'blue','-y': 'orange', '-z': 'green'}
@@ -10,6 +11,7 @@ def region_mask(len,start,end):
     x = np.arange(len)
     return (x>=start) & (x<=end)
 
+@timing.timed()
 def static_field_plot(data,filename=None):
     '''
     Goal: Create a plot with magnetization and energy as function of simulation time.
@@ -21,7 +23,8 @@ def static_field_plot(data,filename=None):
         -data: location of datafile from mumax simulation.
         -filename(str): custom filename.
     '''
-    df = pd.read_csv(data,sep='	')
+    with timing.span('read table',bytes_read=timing.file_size(data)):
+        df = pd.read_csv(data,sep='	')
     data_keys = df.keys()
 
     #Plot setup
@@ -115,6 +118,7 @@ def static_field_plot(data,filename=None):
     if filename==None: filename = 'static_field_plot.pdf'
     else: filename += '.pdf'
     fig.savefig(filename)
+    timing.add(bytes_written=timing.file_size(filename))
     print(f'Figure saved as \'{filename}\'.')
     if __name__ == '__main__':
         plt.show()
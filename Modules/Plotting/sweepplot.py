@@ -2,7 +2,9 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import Modules.timing as timing
 
+@timing.timed()
 def sweepplot(data,filename=None,subplots=False):
     '''
     Goal: Create a plot of total energy vs applied magnetic field.
@@ -13,7 +15,8 @@ def sweepplot(data,filename=None,subplots=False):
         -subplots(bool): whether to plot every sweep in a different subplot
     '''
     #Load data
-    df = pd.read_csv(data,sep='	')
+    with timing.span('read table',bytes_read=timing.file_size(data)):
+        df = pd.read_csv(data,sep='	')
     data_keys = df.keys()
     Bx,By,Bz = df['B_extx (T)'].to_numpy(), df['B_exty (T)'].to_numpy(), df['B_extz (T)'].to_numpy()
     mx,my,mz = df['mx ()'].to_numpy(), df['my ()'].to_numpy(), df['mz ()'].to_numpy()
@@ -110,6 +113,7 @@ def sweepplot(data,filename=None,subplots=False):
     if filename==None: filename = 'sweepplot.pdf'
     else: filename += '.pdf'
     fig.savefig(filename)
+    timing.add(bytes_written=timing.file_size(filename))
     print(f'Figure saved as \'{filename}\'.')
     if __name__ == '__main__':
         plt.show()
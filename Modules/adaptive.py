@@ -0,0 +1,147 @@
+"""Field sweeps that are refined with small steps around the switching events of a coarse sweep."""
+import Modules.tools as tools
+import Modules.hysteresis as hys
+import Modules.mx3script as mx3
+from Modules.MumaxScripter import MumaxScripter
+from Modules.splitting import merge_outputs
+from Modules.runner import JobRunner
+import pandas as pd
+import json
+import os
+
+class AdaptiveSweep:
+    '''
+    Runs a field sweep with a coarse step, finds the switching events in its table and runs the steps around
+    every event again with a fine step, starting from the state saved just before the event. The result is
+    merged into one ordered output folder (<name>.out) with the coarse steps away from the events and the fine
+    steps around them.
+    '''
+    def __init__(self,project_folder,name,sweep_dir,start=0,end=100,coarse_step=10,fine_step=1,start_mag=None,
+                 sweep_back=True,threshold=0.1,energy_threshold=None,**params):
+        '''
+        Inputs:
+            -project_folder(str): folder the scripts and output are written to.
+            -name(str): name of the sweep. Scripts are called <name>_coarse.mx3 and <name>_refineNN.mx3.
+            -sweep_dir,start,end,start_mag,sweep_back: as in MumaxScripter.add_field_sweep.
+            -coarse_step,fine_step(float): step size in mT of the coarse sweep and of the refinements.
+            -threshold(float): smallest jump in magnetization along the field that is refined.
+            -energy_threshold(float): jumps in total energy (fJ) that are refined as well.
+            -params: MumaxScripter parameters (D, h, cell_size, custom_mask, stray_fields...). An output_policy
+                is not allowed: the refinements restart from the m_full file of a table row and the merge
+                takes the files of the same rows, so every row needs all of its files.
+        '''
+        if params.get('output_policy'):
+            raise ValueError('AdaptiveSweep needs the output of every step; output_policy is not supported.')
+        self.folder = os.path.abspath(project_folder)
+        self.name = name
+        self.sweep = {'sweep_dir': sweep_dir, 'start': start, 'end': end, 'start_mag': start_mag, 'sweep_back': sweep_back}
+        self.coarse_step = coarse_step
+        self.fine_step = fine_step
+        self.threshold = threshold
+        self.energy_threshold = energy_threshold
+        self.params = params
+        self.refinements = []
+
+    def simulation(self,suffix):
+        return MumaxScripter(project_folder=self.folder,change_dir=False,verbose=False,name=f'{self.name}_{suffix}',**self.params)
+
+    def output(self,suffix):
+        return os.path.join(self.folder,f'{self.name}_{suffix}.out')
+
+    def write_coarse(self):
+        ''' Write the coarse sweep. Every row of its table has an m_full file to restart from. '''
+        simulation = self.simulation('coarse')
+        simulation.add_field_sweep(step_size=self.coarse_step,**self.sweep)
+        simulation.write_out(overwrite=True)
+        return simulation.path_mumaxscript
+
+    def find_events(self):
+        '''
+        Goal: Find the switching events in the table of the coarse sweep.
+        Returns a DataFrame with the events; 'row' is the first table row after the jump.
+        '''
+        df = pd.read_csv(os.path.join(self.output('coarse'),'table.txt'),sep='\t')
+        _,events,_ = hys.analyse(df,threshold=self.threshold,energy_threshold=self.energy_threshold)
+        return events.drop_duplicates('row').sort_values('row')
+
+    def write_refinements(self,events):
+        '''
+        Goal: Write one script per event that starts from the state of the row before the event and steps
+        through the interval to the row of the event with the fine step.
+        '''
+        df = pd.read_csv(os.path.join(self.output('coarse'),'table.txt'),sep='\t')
+        B = df[['B_extx (T)','B_exty (T)','B_extz (T)']].to_numpy() * 1e3
+        axis = 'xyz'.index(self.sweep['sweep_dir'])
+
+        self.refinements = []
+        scripts = []
+        for i,row in enumerate(events['row']):
+            before,after = B[row-1,axis],B[row,axis]
+            step = self.fine_step if after > before else -self.fine_step
+            if abs(after - before) <= self.fine_step:
+                continue
+            simulation = self.simulation(f'refine{i:02d}')
+            simulation.load_magnetization(os.path.join(self.output('coarse'),f'm_full{row-1:06d}.ovf'))
+            body = [mx3.SetField(self.sweep['sweep_dir']),mx3.Relax()] + simulation.outputs()
+            simulation.script.add_stage(f'Refinement of {mx3.fmt(before)} to {mx3.fmt(after)} mT',
+                                        [mx3.FieldLoop(self.sweep['sweep_dir'],before+step,after,step,body)])
+            simulation.write_out(overwrite=True)
+            self.refinements.append({'row': int(row), 'from (mT)': float(before), 'to (mT)': float(after),
+                                     'script': simulation.path_mumaxscript})
+            scripts.append(simulation.path_mumaxscript)
+        return scripts
+
+    def run(self,concurrency=1,overwrite=True,**kwargs):
+        '''
+        Goal: Run the coarse sweep, then all refinements at the same time (at most 'concurrency'), and merge
+        the result. kwargs (mumax, gpus, timeout, retries...) are passed to JobRunner.
+        Returns the hysteresis summary of the merged sweep, or None if a simulation failed.
+        '''
+        runner = JobRunner(concurrency=concurrency,**kwargs)
+        runner.submit(self.write_coarse())
+        if runner.run()[0].status != 'done':
+            tools.logprint('The coarse sweep failed.')
+            return None
+
+        events = self.find_events()
+        scripts = self.write_refinements(events)
+        tools.logprint(f'Found {len(events)} switching events. Refining {len(scripts)} of them with {self.fine_step} mT steps.')
+        if scripts:
+            runner = JobRunner(concurrency=concurrency,**kwargs)
+            for script in scripts:
+                runner.submit(script)
+            if any(job.status != 'done' for job in runner.run()):
+                tools.logprint('Not all refinements finished. Output is not merged.')
+                return None
+        return self.merge(overwrite=overwrite)
+
+    def merge(self,overwrite=True):
+        '''
+        Goal: Merge coarse sweep and refinements into <name>.out, ordered as they were simulated: the coarse
+        rows up to the row before an event, the fine steps up to and including the field of the event, and the
+        coarse rows after it. Rows after an event continue from the coarse state.
+        Returns the hysteresis summary of the merged sweep.
+        '''
+        rows = len(pd.read_csv(os.path.join(self.output('coarse'),'table.txt'),sep='\t'))
+        folders,selection = [],[]
+        first = 0
+        for refinement in self.refinements:
+            folders += [self.output('coarse'),refinement['script'][:-4]+'.out']
+            #The fine sweep replaces the coarse row of the event itself.
+            selection += [range(first,refinement['row']),None]
+            first = refinement['row'] + 1
+        folders.append(self.output('coarse'))
+        selection.append(range(first,rows))
+
+        target = merge_outputs(folders,os.path.join(self.folder,self.name+'.out'),overwrite=overwrite,
+                               rows=[list(s) if s is not None else None for s in selection])
+        if target is None:
+            return None
+        _,_,summary = hys.analyse(pd.read_csv(os.path.join(target,'table.txt'),sep='\t'),threshold=self.threshold,
+                                  energy_threshold=self.energy_threshold)
+        with open(os.path.join(self.folder,self.name+'_adaptive.json'),'w') as file:
+            json.dump({'sweep': self.sweep, 'coarse_step': self.coarse_step, 'fine_step': self.fine_step,
+                       'refinements': self.refinements},file,indent=1)
+        summary.to_csv(os.path.join(self.folder,self.name+'_summary.txt'),sep='\t',index=False)
+        tools.logprint(f'Merged the coarse sweep and {len(self.refinements)} refinements into {target}.')
+        return summary
@@ -0,0 +1,135 @@
+"""Cache of finished simulations, keyed by the content of their script and input files."""
+import Modules.tools as tools
+import hashlib
+import shutil
+import json
+import uuid
+import re
+import os
+
+main_folder = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+default_index = os.path.join(main_folder,'Output','result_cache.json')
+
+#Script commands that read files. The contents of these files are part of the cache key.
+input_file = re.compile(r'(?:ImageShape|LoadFile)\("([^"]+)"\)')
+
+#MumaxScripter.warm_start_condition marks the lines it adds with this comment, followed by ': <line>' if they
+#replace a line. They only change where the starting state comes from, so they are not part of the cache key.
+warm_start_mark = ' //warm start'
+
+def base_script(script):
+    ''' Text of a script without the lines of a warm start: marked lines are removed or replaced by the line they replace. '''
+    lines = []
+    for line in script.split('\n'):
+        if warm_start_mark in line:
+            line = line.split(warm_start_mark,1)[1]
+            if not line.startswith(': '):
+                continue
+            line = line[2:]
+        lines.append(line)
+    return '\n'.join(lines)
+
+def script_key(script,folder=None):
+    '''
+    Goal: Hash a mumax script together with the contents of the files it reads (mask images, loaded
+    magnetization). The lines of a warm start are left out (see base_script), so the key does not change
+    when the state library gets a new state.
+    Inputs:
+        -script(str): text of the script, or the location of a .mx3 file.
+        -folder(str): folder relative to which the input files are found. Default is the folder of the
+            script file, or the working directory.
+    '''
+    if script.endswith('.mx3') and os.path.exists(script):
+        folder = folder or os.path.dirname(os.path.abspath(script))
+        with open(script) as file:
+            script = file.read()
+    folder = folder or os.getcwd()
+    script = base_script(script)
+
+    key = hashlib.sha256(script.encode())
+    for name in input_file.findall(script):
+        path = os.path.join(folder,name.replace('\\\\','\\'))
+        if os.path.exists(path):
+            with open(path,'rb') as file:
+                key.update(hashlib.sha256(file.read()).digest())
+        else:
+            key.update(b'missing:' + name.encode())
+    return key.hexdigest()
+
+class ResultCache:
+    '''
+    Index of simulation outputs by script key. An entry is only a hit after the simulation that made it has
+    finished successfully, so outputs of killed or still running simulations are never reused.
+    '''
+    def __init__(self,index=None):
+        '''
+        Inputs:
+            -index(str): location of the json index. Default is Output/result_cache.json.
+        '''
+        self.index = index or default_index
+
+    def read(self):
+        if not os.path.exists(self.index):
+            return {}
+        with open(self.index) as file:
+            return json.load(file)
+
+    def update(self,key,**entry):
+        '''
+        Change the entry of 'key'. Simulations that finish at the same time update the index one at a time
+        (see tools.file_lock), and the index is replaced in one step, so readers never see half of it.
+        '''
+        os.makedirs(os.path.dirname(self.index),exist_ok=True)
+        with tools.file_lock(self.index):
+            index = self.read()
+            index[key] = dict(index.get(key,{}),**entry)
+            temporary = f'{self.index}.{uuid.uuid4().hex}.tmp'
+            with open(temporary,'w') as file:
+                json.dump(index,file,indent=1)
+            os.replace(temporary,self.index)
+
+    def start(self,key,output):
+        self.update(key,status='running',output=os.path.abspath(output))
+
+    def complete(self,key,output):
+        self.update(key,status='complete',output=os.path.abspath(output))
+
+    def fail(self,key):
+        self.update(key,status='failed')
+
+    def lookup(self,key):
+        ''' Output folder of a finished simulation with this key, or None. '''
+        entry = self.read().get(key)
+        if entry is None or entry.get('status') != 'complete':
+            return None
+        if not os.path.exists(os.path.join(entry['output'],'table.txt')):
+            return None
+        return entry['output']
+
+    def reuse(self,key,output,mode='link'):
+        '''
+        Goal: Make the output of an earlier identical simulation available as 'output'.
+        Inputs:
+            -key(str): script key.
+            -output(str): .out folder that the simulation would have written to.
+            -mode('link','copy'): make a symbolic link to the cached folder or copy it. Links fall back
+                to copies on systems that do not allow them.
+        Returns True if the output is available.
+        '''
+        cached = self.lookup(key)
+        if cached is None:
+            return False
+        if os.path.abspath(output) == cached:
+            return True
+        if os.path.lexists(output):
+            tools.logprint(f'{output} already exists. Not replacing it with the cached result.')
+            return False
+
+        if mode == 'link':
+            try:
+                os.symlink(cached,output,target_is_directory=True)
+                return True
+            except OSError:
+                pass
+        shutil.copytree(cached,output)
+        return True
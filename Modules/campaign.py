@@ -0,0 +1,90 @@
+"""Generate mumax3 scripts for every combination of a grid of simulation parameters."""
+import Modules.tools as tools
+from Modules.MumaxScripter import MumaxScripter
+import itertools
+import hashlib
+import json
+import os
+
+def parameter_grid(grid):
+    '''
+    Goal: List all combinations of a grid of parameters.
+    Inputs:
+        -grid(dict): parameter name with a list of values. Single values are used for every combination.
+    Returns a list of dictionaries, one per combination, in the order of the grid.
+    '''
+    grid = {key: value if isinstance(value,(list,tuple)) else [value] for key,value in grid.items()}
+    return [dict(zip(grid.keys(),values)) for values in itertools.product(*grid.values())]
+
+def script_hash(script):
+    ''' Hash of the text of a mumax script. '''
+    return hashlib.sha256(script.encode()).hexdigest()
+
+def config_path(params,varied):
+    ''' Folder (relative to the campaign folder) for one combination: one level per varied parameter. '''
+    label = lambda key,value: os.path.splitext(os.path.basename(value))[0] if key == 'custom_mask' else value
+    return os.path.join(*[f'{key}={label(key,params[key])}' for key in varied]) if varied else '.'
+
+def generate_campaign(folder,name,grid,stages,overwrite=False,verbose=False):
+    '''
+    Goal: Write a mumax3 script for every combination of parameters in 'grid' into a directory tree.
+    Inputs:
+        -folder(str): folder in which the campaign folder is made.
+        -name(str): name of the campaign (and its folder).
+        -grid(dict): MumaxScripter parameters (e.g. D, h, axes_ratio, cell_size, alpha, custom_mask) with a
+            list of values to scan.
+        -stages(list): simulation stages that are added to every script, as a list of
+            (method name, kwargs) tuples, e.g. [('add_field_sweep', {'sweep_dir':'y','end':100})].
+            To scan sweep settings, give a list of such lists; every alternative is combined with the grid.
+        -overwrite(bool): overwrite scripts that already exist.
+        -verbose(bool): print the log of every MumaxScripter.
+    Scripts with exactly the same content as an earlier combination are not written again. The manifest
+    (manifest.json in the campaign folder) lists every combination, its script and its hash.
+    '''
+    campaign_folder = os.path.abspath(os.path.join(folder,name))
+    os.makedirs(campaign_folder,exist_ok=True)
+
+    #A list of stage lists means the stages are scanned as well.
+    if stages and isinstance(stages[0],list):
+        grid = dict(grid,stages=list(range(len(stages))))
+        alternatives = stages
+    else:
+        alternatives = [stages]
+
+    #Masks are written into the scripts with their full path, so every script can find them.
+    if 'custom_mask' in grid:
+        masks = grid['custom_mask'] if isinstance(grid['custom_mask'],(list,tuple)) else [grid['custom_mask']]
+        grid = dict(grid,custom_mask=[os.path.abspath(mask) for mask in masks])
+
+    configs = parameter_grid(grid)
+    varied = [key for key,value in grid.items() if isinstance(value,(list,tuple)) and len(value) > 1]
+    tools.logprint(f'Generating {len(configs)} configurations for campaign \'{name}\'.')
+
+    manifest = []
+    hashes = {}
+    for i,params in enumerate(configs):
+        params = dict(params)
+        path = config_path(params,varied)
+        config_name = '_'.join(path.split(os.sep)) if varied else name
+        stage_list = alternatives[params.pop('stages',0)]
+
+        simulation = MumaxScripter(project_folder=os.path.join(campaign_folder,path),change_dir=False,
+                                   verbose=verbose,name=config_name,**params)
+        for method,kwargs in stage_list:
+            getattr(simulation,method)(**kwargs)
+
+        #The hash is taken of the script as it is written, after the warm start.
+        entry = {'id': i, 'name': config_name, 'params': configs[i], 'hash': script_hash(simulation.prepare())}
+        if entry['hash'] in hashes:
+            entry['duplicate_of'] = hashes[entry['hash']]
+        else:
+            hashes[entry['hash']] = i
+            simulation.write_out(overwrite=overwrite)
+            entry['script'] = os.path.relpath(simulation.path_mumaxscript,campaign_folder)
+        manifest.append(entry)
+
+    with open(os.path.join(campaign_folder,'manifest.json'),'w') as file:
+        json.dump({'name': name, 'grid': grid, 'stages': alternatives, 'configurations': manifest},file,indent=1)
+
+    tools.logprint(f'{len(hashes)} scripts written, {len(configs)-len(hashes)} duplicates skipped. Manifest saved in {campaign_folder}.')
+    return manifest
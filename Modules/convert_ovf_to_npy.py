@@ -1,32 +1,42 @@
 import Modules.decodeOVF as decodeOVF
 import Modules.tools as tools
+import Modules.framestore as framestore
+import Modules.timing as timing
 from tqdm import tqdm
 import numpy as np
 
-def convert_ovf_to_npy(files,delete=False):
+@timing.timed()
+def convert_ovf_to_npy(files,delete=False,tolerance=None,max_changed=0.1):
     '''
     Goal: Convert .ovf files from mumax3 to .npy data files.
     Inputs:
         -files([str]): list of filenames.
         -delete(bool): whether to delete files after making the animation.
-    Warning: sometimes this method gets stuck on a specific .ovf file. I could not find a way for the code
-    to auto-detect which files would work and which ones to skip. So the only workaround is to delete/move
-    ovf files that can't be converted.
+        -tolerance(float): if set, frames that are nearly the same as the last full frame are stored as the
+            cells that differ by more than tolerance*(largest vector length). Load them with framestore.load.
+        -max_changed(float): fraction of changed cells above which a frame is always stored in full.
+    Files that can not be read (incomplete or corrupted) are skipped and never deleted.
     '''
     tools.logprint('Converting ovf files to npy files.'+' Will delete files after.'*delete)
+    writer = framestore.FrameWriter(tolerance,max_changed)
+    skipped = []
+    timing.add(items=len(files))
 
     for i in tqdm(range(len(files))):
         #load data
         file = files[i]
 
-        data,params = decodeOVF.unpackFile(file)
-
-        data[0,0,0,0] = 0 #Mumax saves the value of the first pixel as 1234567, which has to manually be set to 0
-
-        data[:,:,:,[0,1]] = data[:,:,:,[1,0]] #mumax puts mag vectors in order z,x,y
-        data[:,:,:,[1,2]] = data[:,:,:,[2,1]] #These two lines re-order the vectors to x,y,z
+        try:
+            data,params = decodeOVF.unpackFile(file)
+        except (ValueError,KeyError) as error:
+            tools.logprint(f'Skipping {file}: {error}')
+            skipped.append(file)
+            continue
         #The order of the data arrays is [x,y,z,mvector] = [Nx,Ny,Nz,3]
 
-        np.save(file[:-4],data) # Save np tensor with the same filename as the ovf file.
+        writer.save(file[:-4]+'.npy',data) # Save np tensor with the same filename as the ovf file.
+
+    if tolerance is not None:
+        tools.logprint(f'Near-duplicate frames saved {writer.saved_bytes/1e6:.1f} MB.')
 
-    if delete: tools.delete(files)
+    if delete: tools.delete([file for file in files if file not in skipped])
@@ -1,47 +1,112 @@
-import numpy as np
-import struct
-
-def _binaryDecode(filehandle, byteLength, decoder, targetarray, headers):
-    for k in range(int(headers["znodes"])):
-        for j in range(int(headers["ynodes"])):
-            for i in range(int(headers["xnodes"])):
-                for coord in range(3):  # Slowly populate, coordinate by coordinate
-                    targetarray[i, j, k, coord] = decoder.unpack(filehandle.read(byteLength))[0]
-    #print("Decode complete.")
-    return (targetarray, headers)
-
-
-def unpackFile(filename):
-    headers = {}
-
-    with open(filename, 'rb') as f:
-        a = ""
-
-        while not "Begin: Data" in a:
-            a = str(f.readline().strip())
-
-            for key in ["xbase", "ybase", "zbase", "xstepsize", "ystepsize", "zstepsize", "xnodes", "ynodes", "znodes",
-                        "valuemultiplier"]:
-                if key in a:
-                    headers[key] = a.split(":")[1][:-1]
-        outArray = np.zeros((int(headers["xnodes"]), int(headers["ynodes"]), int(headers["znodes"]),3))
-
-        #decode = a.split(": ")[1][:-1]
-
-        ''' #dedub stuff
-        print("Data indicator: ", decode)
-        print("only working for binary 8 currently ")
-        binary = int(decode.split(" ")[2])
-        endianflag = f.read(binary)
-        print(endianflag)
-        #print(struct.calcsize(endianflag))
-        print(struct.unpack("f", endianflag)[0])
-        '''
-
-        dc = struct.Struct("f")
-        target = _binaryDecode(f, 4, dc, outArray, headers)
-
-
-    #return target, [headers["xstepsize"],headers["ystepsize"],headers["zstepsize"]]
-    #return target[0],target[1] #header seems redundant, all information can be obtained from target[1]
-    return target[0], target[1]
+import numpy as np
+import os
+import Modules.timing as timing
+
+#OVF2 binary data starts with a control number that tells the byte order and precision.
+control_numbers = {4: 1234567.0, 8: 123456789012345.0}
+
+def _readHeader(f):
+    '''
+    Read the text header of an OVF2 file up to the start of the data.
+    Returns the header values (as strings) and the number of bytes per value.
+    '''
+    headers = {}
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError(f'{f.name} ended before the start of the data. The file is probably incomplete.')
+        line = line.decode(errors='replace').strip()
+        if line.startswith('# Begin: Data'):
+            if 'Binary' not in line:
+                raise ValueError(f'{f.name} is not a binary OVF file ({line[2:]}).')
+            return headers, int(line.split()[-1])
+        if ':' in line:
+            key,value = line[1:].split(':',1)
+            headers[key.strip()] = value.strip()
+
+def unpackFile(filename):
+    '''
+    Goal: Read a binary OVF2 file from mumax3.
+    Returns the data as an array of shape [Nx,Ny,Nz,valuedim] and a dictionary with the header values.
+    '''
+    with timing.span('decode ovf',items=1,bytes_read=timing.file_size(filename)), open(filename, 'rb') as f:
+        headers,byteLength = _readHeader(f)
+        dtype = '<f4' if byteLength == 4 else '<f8'
+        shape = [int(headers[f'{axis}nodes']) for axis in 'xyz']
+        valuedim = int(headers.get('valuedim',3))
+
+        control = np.frombuffer(f.read(byteLength),dtype=dtype)
+        if len(control) != 1 or control[0] != control_numbers[byteLength]:
+            raise ValueError(f'{filename} has no valid OVF control number. The file is probably corrupted.')
+
+        count = np.prod(shape) * valuedim
+        payload = f.read(count * byteLength)
+        data = np.frombuffer(payload[:len(payload) - len(payload) % byteLength],dtype=dtype)
+        if len(data) != count:
+            raise ValueError(f'{filename} contains {len(data)} of {count} values. The file is probably incomplete.')
+
+    #The file is ordered with x fastest, then y, then z, with the components of every cell together.
+    data = data.reshape(shape[2],shape[1],shape[0],valuedim).transpose(2,1,0,3)
+    return data.astype('float64'), headers
+
+def checkFile(filename):
+    '''
+    Goal: Check that an OVF2 file is complete without decoding its data: a full header, the control number,
+    all values and the end of data marker.
+    Returns a description of the problem, or None if the file is fine.
+    '''
+    try:
+        with open(filename, 'rb') as f:
+            headers,byteLength = _readHeader(f)
+            missing = [f'{axis}nodes' for axis in 'xyz' if f'{axis}nodes' not in headers]
+            if missing:
+                return 'header misses ' + ', '.join(missing)
+            if byteLength not in control_numbers:
+                return f'unknown data type Binary {byteLength}'
+            control = np.frombuffer(f.read(byteLength),dtype='<f4' if byteLength == 4 else '<f8')
+            if len(control) != 1 or control[0] != control_numbers[byteLength]:
+                return 'no valid control number'
+
+            count = np.prod([int(headers[f'{axis}nodes']) for axis in 'xyz']) * int(headers.get('valuedim',3))
+            start = f.tell()
+            size = os.path.getsize(filename)
+            if size < start + count*byteLength:
+                return f'contains {(size - start)//byteLength} of {count} values'
+            f.seek(start + count*byteLength)
+            if b'End: Data' not in f.read(64):
+                return 'no end of data marker'
+    except ValueError as error:
+        return str(error)
+    return None
+
+def packFile(filename, data, cell_size=5.0, title='m', precision=4):
+    '''
+    Goal: Write an array as a binary OVF2 file that mumax3 can load (e.g. with m.LoadFile).
+    Inputs:
+        -filename(str): location of the .ovf file.
+        -data(np.array): array of shape [Nx,Ny,Nz,valuedim].
+        -cell_size(float): width of one cell in nm.
+        -title(str): name of the quantity.
+        -precision(4,8): bytes per value (Binary 4 or Binary 8).
+    '''
+    Nx,Ny,Nz,valuedim = np.shape(data)
+    c = cell_size * 1e-9
+    header = [
+        'OOMMF OVF 2.0', 'Segment count: 1', 'Begin: Segment', 'Begin: Header',
+        f'Title: {title}', 'meshtype: rectangular', 'meshunit: m',
+        'xmin: 0', 'ymin: 0', 'zmin: 0', f'xmax: {Nx*c:g}', f'ymax: {Ny*c:g}', f'zmax: {Nz*c:g}',
+        f'valuedim: {valuedim}',
+        'valuelabels: ' + ' '.join(f'{title}_{axis}' for axis in 'xyz'[:valuedim]) if valuedim <= 3 else f'valuelabels: {title}',
+        'valueunits: ' + ' '.join(['1']*valuedim),
+        'Desc: Total simulation time:  0  s',
+        f'xbase: {c/2:g}', f'ybase: {c/2:g}', f'zbase: {c/2:g}',
+        f'xnodes: {Nx}', f'ynodes: {Ny}', f'znodes: {Nz}',
+        f'xstepsize: {c:g}', f'ystepsize: {c:g}', f'zstepsize: {c:g}',
+        'End: Header', f'Begin: Data Binary {precision}']
+    with timing.span('write ovf',items=1) as s, open(filename, 'wb') as f:
+        f.write(''.join(f'# {line}\n' for line in header).encode())
+        dtype = '<f4' if precision == 4 else '<f8'
+        f.write(np.array([control_numbers[precision]],dtype=dtype).tobytes())
+        f.write(np.ascontiguousarray(np.transpose(data,(2,1,0,3)),dtype=dtype).tobytes())
+        f.write(f'\n# End: Data Binary {precision}\n# End: Segment\n'.encode())
+        s.add(bytes_written=f.tell())
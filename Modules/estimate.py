@@ -0,0 +1,135 @@
+"""Predict the output, disk use and wall time of a mumax3 script before it is run."""
+import Modules.tools as tools
+import numpy as np
+import shutil
+import json
+import glob
+import re
+import os
+
+main_folder = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+default_model = os.path.join(main_folder,'Output','cost_model.json')
+
+#Seconds per cell per relax() and per cell per simulated ns, used as long as no runs have been fitted.
+default_coefficients = {'relax': 2.5e-5, 'run': 2e-5, 'offset': 10.0}
+
+#Approximate file sizes in bytes
+ovf_header = 1000        #text header and footer of an OVF2 file
+table_row = 14*13        #14 columns of about 13 characters
+jpg_per_pixel = 0.4      #compressed snapshot of one z layer
+
+def plan(simulation):
+    '''
+    Goal: Count what the script of a MumaxScripter will produce and how many bytes it will write.
+    Inputs:
+        -simulation(MumaxScripter): simulation with its stages added.
+    Returns a dictionary with the output counts of Script.count_outputs(), the number of cells and the
+    expected number of bytes ('bytes').
+    '''
+    #With stray fields, empty space is simulated above the device.
+    Nz = simulation.Nz + simulation.Nz_empty
+    cells = simulation.Nx * simulation.Ny * Nz
+    counts = simulation.script.count_outputs(grid=(simulation.Nx,simulation.Ny,Nz))
+
+    ovf_files = sum(n for key,n in counts.items() if key not in ('relax','run','table','snapshot','ovf_cells'))
+    #Binary 4 data: 3 floats per cell plus the control number
+    counts['bytes'] = int(ovf_files * (ovf_header + 4) + counts['ovf_cells']*3*4
+                          + counts['snapshot'] * (2000 + jpg_per_pixel*simulation.Nx*simulation.Ny)
+                          + counts['table'] * table_row)
+    counts['ovf'] = ovf_files
+    counts['cells'] = cells
+    return counts
+
+def run_features(record):
+    '''
+    Goal: Get the size and amount of work of a finished simulation from its .job.json record.
+    Returns (cells, relax steps, simulated ns, elapsed seconds), or None if the run can not be used.
+    '''
+    import pandas as pd
+    with open(record) as file:
+        job = json.load(file)
+    table = os.path.join(job.get('output',''),'table.txt')
+    if job.get('status') != 'done' or job.get('reason') == 'cached' or not os.path.exists(table) or not os.path.exists(job['script']):
+        return None
+
+    with open(job['script']) as file:
+        script = file.read()
+    size = [re.search(rf'{n}\s*:=\s*(\d+)',script) for n in ('Nx','Ny','Nz')]
+    if None in size:
+        return None
+    cells = np.prod([int(s.group(1)) for s in size])
+
+    #relax() does not advance the time, so rows with the same time as the row before are relaxed states.
+    t = pd.read_csv(table,sep='\t',usecols=[0]).iloc[:,0].to_numpy()
+    if len(t) == 0:
+        return None
+    relax = 1 + np.sum(np.diff(t) == 0)
+    return cells, relax, t[-1]*1e9, job['elapsed']
+
+def fit_cost_model(folders,filename=None):
+    '''
+    Goal: Fit the wall time of finished simulations to
+        elapsed = cells*(relax*N_relax + run*simulated_ns) + offset
+    Inputs:
+        -folders([str]): folders that are searched (recursively) for .job.json records of the job runner.
+        -filename(str): where the coefficients are saved. Default is Output/cost_model.json.
+    Returns the coefficients. Falls back to the defaults if fewer than 3 runs are usable.
+    '''
+    records = [r for folder in folders for r in glob.glob(os.path.join(folder,'**','*.job.json'),recursive=True)]
+    runs = np.array([f for f in map(run_features,records) if f is not None],dtype='float').reshape(-1,4)
+    tools.logprint(f'Fitting cost model to {len(runs)} finished runs.')
+    if len(runs) < 3:
+        tools.logprint('Not enough runs to fit. Using default coefficients.')
+        return dict(default_coefficients)
+
+    cells,relax,run,elapsed = runs.T
+    A = np.stack([cells*relax,cells*run,np.ones(len(runs))],axis=1)
+    solution = np.linalg.lstsq(A,elapsed,rcond=None)[0]
+    #Negative costs mean the runs did not contain enough of that kind of work to fit it.
+    coefficients = {key: float(value) if value > 0 else default_coefficients[key] for key,value in
+                    zip(['relax','run','offset'],solution)}
+    coefficients['runs'] = len(runs)
+
+    filename = filename or default_model
+    os.makedirs(os.path.dirname(filename),exist_ok=True)
+    with open(filename,'w') as file:
+        json.dump(coefficients,file,indent=1)
+    return coefficients
+
+def load_cost_model(filename=None):
+    filename = filename or default_model
+    if not os.path.exists(filename):
+        return dict(default_coefficients)
+    with open(filename) as file:
+        return json.load(file)
+
+def estimate(simulation,model=None,scratch=None,max_days=7.0,min_free=0.1):
+    '''
+    Goal: Predict output, disk use and wall time of a simulation and flag scripts that should not be run.
+    Inputs:
+        -simulation(MumaxScripter): simulation with its stages added.
+        -model(dict,str): cost coefficients or the file they are saved in. Default is Output/cost_model.json,
+            or the built in defaults if no model was fitted.
+        -scratch(str): disk that the output is written to. Default is the project folder.
+        -max_days(float): flag simulations that are expected to take longer than this.
+        -min_free(float): flag simulations that leave less than this fraction of the disk free.
+    Returns the plan() dictionary with the expected wall time in seconds ('seconds') and a list of
+    warnings ('flags').
+    '''
+    if not isinstance(model,dict):
+        model = load_cost_model(model)
+    result = plan(simulation)
+    result['seconds'] = result['cells'] * (model['relax']*result['relax'] + model['run']*result['run']) + model['offset']
+
+    flags = []
+    if result['seconds'] > max_days*86400:
+        flags.append(f'expected to take {result["seconds"]/86400:.1f} days (more than {max_days:g})')
+
+    scratch = scratch or simulation.project_folder
+    while not os.path.exists(scratch):
+        scratch = os.path.dirname(scratch)
+    disk = shutil.disk_usage(scratch)
+    if disk.free - result['bytes'] < min_free*disk.total:
+        flags.append(f'writes {result["bytes"]/1e9:.1f} GB while only {disk.free/1e9:.1f} GB is free on {scratch}')
+    result['flags'] = flags
+    return result
@@ -0,0 +1,81 @@
+"""Storage of converted frames that keeps near-duplicate frames as sparse differences to a key frame."""
+import Modules.timing as timing
+import numpy as np
+import functools
+import re
+import glob
+import os
+
+def delta_file(file):
+    ''' Location of the difference file that replaces the .npy file 'file'. '''
+    return file[:-4] + '.npz'
+
+class FrameWriter:
+    '''
+    Saves a sequence of frames. A frame that differs from the last full frame (the key frame) in only a few
+    cells is saved as a .npz file with the indices and values of those cells and the name of the key frame.
+    '''
+    def __init__(self,tolerance=None,max_changed=0.1):
+        '''
+        Inputs:
+            -tolerance(float): cells that differ less than tolerance*(largest vector length) from the key
+                frame are taken from the key frame. None saves every frame in full.
+            -max_changed(float): fraction of changed cells above which a frame is saved in full and becomes
+                the new key frame.
+        '''
+        self.tolerance = tolerance
+        self.max_changed = max_changed
+        self.keys = {} #Last key frame of every quantity (m, m_full, B_demag...)
+        self.saved_bytes = 0
+
+    @timing.timed('save frame')
+    def save(self,file,data):
+        ''' Save 'data' under the .npy filename 'file', as a difference to the key frame if possible. '''
+        quantity = re.sub(r'\d*\.npy$','',os.path.basename(file))
+        key,key_file = self.keys.get(quantity,(None,None))
+        if self.tolerance is not None and key is not None and np.shape(data) == np.shape(key):
+            scale = np.max(np.abs(key))
+            changed = np.max(np.abs(data - key),axis=-1) > self.tolerance * scale
+            if np.mean(changed) <= self.max_changed:
+                index = np.flatnonzero(changed)
+                values = data.reshape(-1,np.shape(data)[-1])[index]
+                np.savez(delta_file(file),key=os.path.basename(key_file),index=index,values=values)
+                if os.path.exists(file): os.remove(file)
+                self.saved_bytes += data.nbytes - index.nbytes - values.nbytes
+                timing.add(items=1,bytes_written=timing.file_size(delta_file(file)))
+                return
+
+        np.save(file,data)
+        timing.add(items=1,bytes_written=timing.file_size(file))
+        if os.path.exists(delta_file(file)): os.remove(delta_file(file))
+        self.keys[quantity] = (data,file)
+
+@functools.lru_cache(maxsize=4)
+def _load_key(file,mtime):
+    return np.load(file)
+
+def load(file,mmap_mode=None):
+    '''
+    Goal: Load a .npy frame, whether it was saved in full or as a difference to a key frame.
+    Inputs:
+        -file(str): .npy filename of the frame.
+        -mmap_mode(str): passed to np.load for frames that were saved in full.
+    '''
+    if os.path.exists(file) or not os.path.exists(delta_file(file)):
+        return np.load(file,mmap_mode=mmap_mode)
+
+    with np.load(delta_file(file)) as delta:
+        key = os.path.join(os.path.dirname(file),str(delta['key']))
+        data = _load_key(key,os.path.getmtime(key)).copy()
+        data.reshape(-1,np.shape(data)[-1])[delta['index']] = delta['values']
+    return data
+
+def find(pattern):
+    '''
+    Goal: Find frames in the current directory with a .npy name matching 'pattern', including frames that are
+    stored as differences. Returns the .npy names, sorted.
+    '''
+    files = set(glob.glob(pattern))
+    if pattern.endswith('npy'):
+        files |= {file[:-4]+'.npy' for file in glob.glob(pattern[:-3]+'npz')}
+    return sorted(files)
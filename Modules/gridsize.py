@@ -0,0 +1,115 @@
+"""Grid sizes that are fast for the FFT based demag convolution of mumax3."""
+import Modules.tools as tools
+import numpy as np
+import time
+
+smooth_primes = (2,3,5,7)
+
+def factorize(n):
+    ''' Prime factors of n, smallest first. '''
+    factors = []
+    p = 2
+    while p*p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1: factors.append(n)
+    return factors
+
+def is_smooth(n):
+    ''' True if n has no prime factors larger than 7. '''
+    return n >= 1 and all(p in smooth_primes for p in factorize(n))
+
+def next_smooth(n):
+    ''' Smallest 7-smooth number that is at least n. '''
+    n = max(int(n),1)
+    while not is_smooth(n):
+        n += 1
+    return n
+
+def fft_cost(n):
+    '''
+    Relative cost of a complex FFT of length n. A mixed radix FFT does one pass per prime factor p, each
+    costing about n*p operations. Lengths with a prime factor above 7 are done with Bluestein's algorithm:
+    three FFTs of a power of two of at least 2n-1 points.
+    '''
+    if n <= 1:
+        return 1.0
+    factors = factorize(n)
+    if factors[-1] > 7:
+        m = 2**int(np.ceil(np.log2(2*n-1)))
+        return 3 * m * 2*np.log2(m)
+    return n * sum(factors)
+
+def convolution_cost(grid):
+    '''
+    Relative cost of one demag convolution on a grid of size (Nx,Ny,Nz). mumax3 zero pads every dimension
+    larger than one to twice its size, and does a 3D FFT as 1D FFTs along every axis.
+    '''
+    padded = [2*n if n > 1 else 1 for n in grid]
+    total = np.prod(padded)
+    return sum(total / n * fft_cost(n) for n in padded if n > 1)
+
+def pad_grid(grid):
+    ''' Smallest 7-smooth grid that is at least as large as 'grid' in every dimension. '''
+    return tuple(next_smooth(n) for n in grid)
+
+def fit_cell_size(lengths,cell_size,tolerance=0.05,empty_layers=0):
+    '''
+    Goal: Find a cell size close to 'cell_size' for which all dimensions of the grid are 7-smooth.
+    Inputs:
+        -lengths((float,float,float)): physical size of the device in nm.
+        -cell_size(float): requested cell size in nm.
+        -tolerance(float): largest relative change of the cell size.
+        -empty_layers(int): layers of empty space above the device. Extra empty layers may be added.
+    Returns (cell_size,(Nx,Ny,Nz),Nz_empty) for the cell size closest to the requested one, or None if no cell
+    size within the tolerance gives a 7-smooth grid.
+    '''
+    candidates = set()
+    for length in lengths:
+        for n in range(int(length/(cell_size*(1+tolerance))),int(length/(cell_size*(1-tolerance)))+2):
+            if n > 0 and is_smooth(n): candidates.add(length/n)
+
+    best = None
+    for cell in sorted(candidates):
+        if abs(cell - cell_size) > tolerance*cell_size:
+            continue
+        grid = [max(int(round(length/cell)),1) for length in lengths]
+        if not all(is_smooth(n) for n in grid[:2]):
+            continue
+        Nz_total = next_smooth(grid[2] + (int(round(empty_layers*cell_size/cell)) if empty_layers else 0))
+        if empty_layers == 0 and not is_smooth(grid[2]):
+            continue
+        change = abs(cell - cell_size)
+        if best is None or change < best[0]:
+            best = (change,cell,tuple(grid),Nz_total - grid[2])
+    return None if best is None else best[1:]
+
+def benchmark(sizes=None,repeats=20):
+    '''
+    Goal: Compare the measured time of numpy FFTs with the cost model for a range of lengths.
+    Inputs:
+        -sizes([int]): FFT lengths. Default is every length from 100 to 300.
+        -repeats(int): number of repetitions per length. The fastest one is used.
+    Returns a DataFrame with the length, whether it is 7-smooth, the measured time (s) and the model cost,
+    and logs the correlation between the two.
+    '''
+    import pandas as pd
+    sizes = sizes if sizes is not None else range(100,301)
+    rows = []
+    for n in sizes:
+        #A batch of 256 transforms, like one axis of a grid
+        data = np.random.random((256,n)) + 1j*np.random.random((256,n))
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            np.fft.fft(data,axis=1)
+            times.append(time.perf_counter() - start)
+        rows.append([n,is_smooth(n),min(times),fft_cost(n)])
+    df = pd.DataFrame(rows,columns=['n','smooth','time (s)','model cost'])
+
+    correlation = np.corrcoef(df['time (s)'],df['model cost'])[0,1]
+    ratio = df[~df['smooth']]['time (s)'].mean() / df[df['smooth']]['time (s)'].mean()
+    tools.logprint(f'FFT benchmark: correlation between model and time {correlation:.2f}; lengths with large prime factors are {ratio:.1f}x slower on average.')
+    return df
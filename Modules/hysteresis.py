@@ -0,0 +1,163 @@
+"""Hysteresis loops, coercive and switching fields of the field sweeps in one or many table.txt files."""
+import Modules.tools as tools
+import numpy as np
+import pandas as pd
+import os
+
+axes = np.array(['x','y','z'])
+
+def load_tables(folders):
+    '''
+    Goal: Read the table.txt files of many simulation folders into one DataFrame.
+    Inputs:
+        -folders([str]): list of .out folders or table.txt files.
+    The name of the folder every row came from is stored in the 'run' column.
+    '''
+    tables = []
+    for folder in folders:
+        table = folder if folder.endswith('.txt') else os.path.join(folder,'table.txt')
+        if not os.path.exists(table):
+            tools.logprint(f'No table found in {folder}. Skipping.')
+            continue
+        df = pd.read_csv(table,sep='	')
+        df.insert(0,'run',os.path.basename(os.path.dirname(os.path.abspath(table))))
+        tables.append(df)
+    return pd.concat(tables,ignore_index=True)
+
+def segment_sweeps(B,run=None):
+    '''
+    Goal: Split the rows of one or more tables into separate field sweeps.
+    Inputs:
+        -B(np.array): applied field of shape [rows,3].
+        -run(np.array): optional label per row. A new sweep always starts when the label changes.
+    A sweep ends when the direction of the applied field changes, or when there are two or more consecutive
+    rows without field (the end of a sweep back followed by the start of a new sweep). In that case the first
+    row without field still belongs to the old sweep.
+    Returns the sweep number of every row.
+    '''
+    n = len(B)
+    rows = np.arange(n)
+    nonzero = np.max(np.abs(B),axis=1) > 0
+    axis = np.where(nonzero,np.argmax(np.abs(B),axis=1),-1)
+
+    run_start = np.zeros(n,dtype=bool)
+    run_start[0] = True
+    if run is not None:
+        run = np.asarray(run)
+        run_start[1:] = run[1:] != run[:-1]
+
+    #Last row with field (or start of a run) at or before every row
+    anchor = np.maximum.accumulate(np.where(nonzero | run_start,rows,0))
+    #Number of rows without field since that row, including the current row
+    zeros = np.where(nonzero,0,rows - anchor + (~nonzero[anchor]))
+
+    previous_axis = np.full(n,-1)
+    previous_axis[1:] = np.where(run_start[1:],-1,axis[anchor[:-1]])
+    zeros_before = np.zeros(n,dtype=int)
+    zeros_before[1:] = np.where(run_start[1:],0,zeros[:-1])
+
+    second_zero = ~nonzero & (zeros == 2) & nonzero[anchor] & ~run_start
+    new_direction = nonzero & (previous_axis != -1) & (axis != previous_axis) & (zeros_before <= 1)
+    boundary = run_start | second_zero | new_direction
+    return np.cumsum(boundary) - 1
+
+def analyse(df,threshold=0.1,energy_threshold=None):
+    '''
+    Goal: Extract hysteresis loops, coercive fields, switching events and remanence of every sweep.
+    Inputs:
+        -df(DataFrame): table rows as returned by load_tables.
+        -threshold(float): smallest jump in normalized magnetization along the field that counts as a
+            switching event.
+        -energy_threshold(float): if set, jumps in total energy larger than this (in fJ) are also switching
+            events, even if the magnetization along the field barely changes.
+    Returns three DataFrames: the loops (one row per table row), the switching events (with the table row
+    after the jump in 'row') and a summary with one row per sweep.
+    '''
+    B = df[['B_extx (T)','B_exty (T)','B_extz (T)']].to_numpy() * 1e3 #convert T to mT
+    m = df[['mx ()','my ()','mz ()']].to_numpy()
+    #Same total energy as in sweepplot: mumax takes the zeeman energy to be negative.
+    E = np.sum(np.abs([df['E_exch (J)'],df['E_demag (J)'],df['E_Zeeman (J)']]),axis=0) * 1e15
+    run = df['run'].to_numpy() if 'run' in df else np.zeros(len(df))
+
+    sweep = segment_sweeps(B,run)
+    #The axis of a sweep is the direction of its largest field
+    strongest = pd.Series(np.max(np.abs(B),axis=1)).groupby(sweep).idxmax().to_numpy()
+    sweep_axis = np.argmax(np.abs(B[strongest]),axis=1)
+    axis = sweep_axis[sweep]
+    rows = np.arange(len(df))
+    Bax,mpar = B[rows,axis],m[rows,axis]
+
+    loops = pd.DataFrame({'run': run, 'sweep': sweep, 'axis': axes[axis], 'B (mT)': Bax, 'm ()': mpar, 'E (fJ)': E})
+
+    #Steps between consecutive rows of the same sweep
+    step = np.nonzero(sweep[1:] == sweep[:-1])[0] + 1
+    dB = Bax[step] - Bax[step-1]
+    branch = np.where(dB > 0,'up',np.where(dB < 0,'down','constant'))
+    loops['branch'] = ''
+    loops.loc[step,'branch'] = branch
+
+    #Switching events: jumps in magnetization along the field
+    jump = np.abs(mpar[step] - mpar[step-1]) > threshold
+    if energy_threshold is not None:
+        jump |= np.abs(E[step] - E[step-1]) > energy_threshold
+    events = pd.DataFrame({
+        'row': step[jump],
+        'run': run[step][jump],
+        'sweep': sweep[step][jump],
+        'axis': axes[axis[step][jump]],
+        'branch': branch[jump],
+        'B (mT)': Bax[step][jump],
+        'dm ()': (mpar[step] - mpar[step-1])[jump],
+        'dE (fJ)': (E[step] - E[step-1])[jump]
+        })
+
+    #Coercive fields: zero crossings of the magnetization along the field, linearly interpolated
+    cross = np.sign(mpar[step]) * np.sign(mpar[step-1]) < 0
+    a,b = mpar[step-1][cross],mpar[step][cross]
+    coercive = pd.DataFrame({
+        'sweep': sweep[step][cross],
+        'branch': branch[cross],
+        'B (mT)': Bax[step-1][cross] + dB[cross] * a/(a-b)
+        })
+
+    #Summary per sweep
+    groups = loops.groupby('sweep')
+    summary = pd.DataFrame({
+        'run': groups['run'].first(),
+        'axis': groups['axis'].first(),
+        'steps': groups.size(),
+        'B_min (mT)': groups['B (mT)'].min(),
+        'B_max (mT)': groups['B (mT)'].max()
+        })
+    for direction in ('up','down'):
+        first = coercive[coercive['branch'] == direction].groupby('sweep')['B (mT)'].first()
+        summary[f'coercive field {direction} (mT)'] = first
+        first = events[events['branch'] == direction].groupby('sweep')['B (mT)'].first()
+        summary[f'switching field {direction} (mT)'] = first
+    summary['switching events'] = events.groupby('sweep').size()
+    summary['switching events'] = summary['switching events'].fillna(0).astype('int')
+    summary['largest dE (fJ)'] = events.assign(magnitude=np.abs(events['dE (fJ)'])).sort_values('magnitude').groupby('sweep')['dE (fJ)'].last()
+    remanent = loops[loops['B (mT)'] == 0].groupby('sweep')['m ()']
+    summary['remanence start ()'] = remanent.first()
+    summary['remanence end ()'] = remanent.last()
+
+    return loops, events, summary.reset_index()
+
+def hysteresis(folders,filename='hysteresis',threshold=0.1):
+    '''
+    Goal: Summarize the field sweeps of many simulations in one table.
+    Inputs:
+        -folders([str]): list of .out folders or table.txt files.
+        -filename(str): custom filename. Writes filename_summary.txt, filename_loops.txt and
+            filename_events.txt.
+        -threshold(float): smallest jump in normalized magnetization along the field that counts as a
+            switching event.
+    '''
+    tools.logprint(f'Extracting hysteresis loops from {len(folders)} tables.')
+    loops,events,summary = analyse(load_tables(folders),threshold=threshold)
+
+    summary.to_csv(filename+'_summary.txt',sep='	',index=False)
+    loops.to_csv(filename+'_loops.txt',sep='	',index=False)
+    events.to_csv(filename+'_events.txt',sep='	',index=False)
+    tools.logprint(f'Found {len(summary)} sweeps with {len(events)} switching events. Summary saved as \'{filename}_summary.txt\'.')
+    return summary
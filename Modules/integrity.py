@@ -0,0 +1,123 @@
+"""Parallel check of the OVF, NPY and image files in simulation output folders, with a checksum manifest."""
+import Modules.tools as tools
+import Modules.decodeOVF as decodeOVF
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import zipfile
+import hashlib
+import os
+
+manifest_name = 'MANIFEST.sha256'
+image_extensions = ('.jpg','.jpeg','.png','.gif')
+
+def check_npy(file):
+    ''' Problem with a .npy file (header and data length), or None. '''
+    try:
+        np.load(file,mmap_mode='r')
+    except (ValueError,OSError,EOFError) as error:
+        return str(error) or 'can not be read'
+    return None
+
+def check_npz(file):
+    ''' Problem with a .npz file (e.g. a difference frame of framestore), or None. '''
+    try:
+        with zipfile.ZipFile(file) as archive:
+            bad = archive.testzip()
+        if bad is not None:
+            return f'{bad} is corrupted'
+    except (zipfile.BadZipFile,OSError,EOFError) as error:
+        return str(error) or 'can not be read'
+    key = os.path.join(os.path.dirname(file),str(np.load(file)['key']))
+    if not os.path.exists(key):
+        return f'key frame {os.path.basename(key)} is missing'
+    return None
+
+def check_image(file):
+    ''' Problem with an image file, or None. '''
+    from PIL import Image
+    try:
+        with Image.open(file) as image:
+            image.verify()
+        #verify() does not decode the pixels, so truncated files are only found by loading them.
+        with Image.open(file) as image:
+            image.load()
+    except (OSError,SyntaxError,ValueError) as error:
+        return str(error) or 'can not be read'
+    return None
+
+def checker(file):
+    ''' Check function for a filename, or None for files that are not checked. '''
+    name = file.lower()
+    if name.endswith('.ovf'):
+        return decodeOVF.checkFile
+    if name.endswith('.npy'):
+        return check_npy
+    if name.endswith('.npz'):
+        return check_npz
+    if name.endswith(image_extensions):
+        return check_image
+    return None
+
+def sha256(file,block=1 << 20):
+    digest = hashlib.sha256()
+    with open(file,'rb') as f:
+        for chunk in iter(lambda: f.read(block),b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_manifest(folder):
+    ''' Checksums of the manifest in a folder as {filename: sha256}. '''
+    manifest = os.path.join(folder,manifest_name)
+    if not os.path.exists(manifest):
+        return {}
+    with open(manifest) as file:
+        return {line[66:].strip(): line[:64] for line in file if len(line) > 66}
+
+def scan(folder,workers=8,checksums=True,write_manifest=True):
+    '''
+    Goal: Check every OVF, NPY, NPZ and image file in an output folder before the analysis starts.
+        - .ovf: complete header, control number, number of values and end of data marker (decodeOVF.checkFile).
+        - .npy/.npz: readable header and data, and the key frame of difference frames.
+        - images: can be opened and decoded.
+    Inputs:
+        -folder(str): .out folder of a simulation. Subfolders (e.g. Pyramid) are included.
+        -workers(int): number of files that are checked at the same time.
+        -checksums(bool): compute the sha256 of every file and compare it to the existing manifest. OVF files
+            that changed since the manifest was written are reported as well.
+        -write_manifest(bool): write the checksums of the files without problems to MANIFEST.sha256 (the format
+            of sha256sum, so 'sha256sum -c MANIFEST.sha256' works too).
+    Returns a dictionary {file: problem} of the files with problems, with paths relative to the folder.
+    '''
+    files = sorted(os.path.relpath(os.path.join(root,name),folder) for root,_,names in os.walk(folder)
+                   for name in names if name != manifest_name)
+    checked = [file for file in files if checker(file) is not None]
+    previous = read_manifest(folder) if checksums else {}
+
+    def check(file):
+        path = os.path.join(folder,file)
+        problem = checker(file)(path)
+        digest = sha256(path) if checksums else None
+        #Output of mumax3 never changes after the run; analysis files (npy, plots) may be made again.
+        if problem is None and file.lower().endswith('.ovf') and previous.get(file,digest) != digest:
+            problem = 'changed since the manifest was written'
+        return file,problem,digest
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(check,checked))
+
+    problems = {file: problem for file,problem,_ in results if problem is not None}
+    if checksums and write_manifest:
+        with open(os.path.join(folder,manifest_name),'w') as manifest:
+            for file,problem,digest in results:
+                if problem is None:
+                    manifest.write(f'{digest}  {file}\n')
+
+    tools.logprint(f'Checked {len(checked)} files in {folder}: ' + (f'{len(problems)} with problems.' if problems else 'all fine.'))
+    for file,problem in problems.items():
+        tools.logprint(f'    {file}: {problem}')
+    return problems
+
+def good_files(files,problems):
+    ''' The files that are not in 'problems' (as returned by scan for the current directory). '''
+    bad = {os.path.normpath(file) for file in problems}
+    return [file for file in files if os.path.normpath(file) not in bad]
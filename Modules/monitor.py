@@ -0,0 +1,183 @@
+"""Progress, throughput and ETA of running mumax3 simulations, from their growing table.txt."""
+import Modules.tools as tools
+import Modules.mx3script as mx3
+import asyncio
+import json
+import time
+import re
+import os
+
+def stage_plan(script):
+    '''
+    Goal: Count the table rows that every stage of a script will write.
+    Inputs:
+        -script(mx3script.Script): structured script, e.g. MumaxScripter.script.
+    Returns a list of (stage title, table rows).
+    '''
+    plan = []
+    for stage in script.stages:
+        part = mx3.Script()
+        part.autosave = script.autosave
+        part.stages = [stage]
+        plan.append((stage.title or 'Custom script',part.count_outputs()['table']))
+    return plan
+
+class RunMonitor:
+    '''
+    Follows one running simulation through its table.txt and the lines it prints. Every poll appends a line
+    with the metrics to '<name>.metrics.jsonl' next to the script:
+        rows: table rows written so far.
+        t (ns): simulation time of the last row.
+        rows/s, ns/s: rows and simulated time per wall second since the start.
+        stage: the stage that is running, if the plan is known.
+        eta (s): expected wall time until all planned rows are written, at the throughput so far.
+        stalled (s): wall time since the last new row or output line.
+    '''
+    def __init__(self,job,plan=None,interval=10.0,report=60.0,stall=600.0,verbose=True):
+        '''
+        Inputs:
+            -job(runner.Job): the job of the simulation.
+            -plan([(str,int)]): table rows per stage, see stage_plan. Without a plan there is no ETA.
+            -interval(float): seconds between polls of table.txt.
+            -report(float): seconds between progress messages in the log. 0 means no messages.
+            -stall(float): seconds without a new row or output line after which the run is reported as stalled.
+        '''
+        self.job = job
+        self.plan = plan or []
+        self.planned = sum(rows for _,rows in self.plan)
+        self.interval = interval
+        self.report = report
+        self.stall = stall
+        self.verbose = verbose
+        self.metrics = os.path.join(job.folder,job.name+'.metrics.jsonl')
+        self.table = os.path.join(job.output,'table.txt')
+        self.reset()
+
+    def reset(self):
+        ''' Start counting from the beginning of the table. '''
+        self.start = time.time()
+        self.offset = 0
+        self.rows = 0
+        self.t = 0.0
+        self.last_change = self.start
+        self.last_report = self.start
+        self.output_lines = 0
+        self.warned = False
+        self.last = None
+
+    def read_table(self):
+        ''' Read the rows that were added to table.txt since the last poll. '''
+        if not os.path.exists(self.table):
+            return
+        if os.path.getsize(self.table) < self.offset:
+            self.offset,self.rows = 0,0
+        with open(self.table,'rb') as file:
+            file.seek(self.offset)
+            new = file.read()
+        #Only complete lines are counted; the rest is read again at the next poll.
+        complete = new[:new.rfind(b'\n') + 1]
+        self.offset += len(complete)
+        lines = [line for line in complete.decode(errors='replace').splitlines() if line and not line.startswith('#')]
+        if lines:
+            self.rows += len(lines)
+            self.t = float(lines[-1].split()[0]) * 1e9
+            self.last_change = time.time()
+
+    def stage(self):
+        ''' (number, title) of the running stage according to the plan, counting from 1. '''
+        done = 0
+        for i,(title,rows) in enumerate(self.plan):
+            done += rows
+            if self.rows < done:
+                return i + 1, title
+        return len(self.plan), self.plan[-1][0] if self.plan else ''
+
+    def poll(self,output=None):
+        '''
+        Goal: Update the metrics and append them to the metrics file.
+        Inputs:
+            -output(runner.Output): output of mumax3 so far. New lines also count as progress.
+        Returns the metrics as a dictionary.
+        '''
+        now = time.time()
+        self.read_table()
+        if output is not None and output.lines > self.output_lines:
+            self.output_lines = output.lines
+            self.last_change = now
+
+        elapsed = now - self.start
+        metrics = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'elapsed (s)': round(elapsed,1), 'rows': self.rows,
+                   't (ns)': self.t, 'rows/s': self.rows / elapsed if elapsed > 0 else 0.0,
+                   'ns/s': self.t / elapsed if elapsed > 0 else 0.0, 'stalled (s)': round(now - self.last_change,1)}
+        if self.plan:
+            number,title = self.stage()
+            metrics.update({'planned': self.planned, 'stage': number, 'stages': len(self.plan), 'stage title': title})
+            metrics['eta (s)'] = round(elapsed * max(self.planned - self.rows,0) / self.rows,1) if self.rows else None
+
+        with open(self.metrics,'a') as file:
+            file.write(json.dumps(dict(metrics,attempt=self.job.attempts)) + '\n')
+
+        if metrics['stalled (s)'] > self.stall and not self.warned:
+            self.warned = True
+            tools.logprint(f'WARNING: {self.job.name} has not written a table row for {metrics["stalled (s)"]/60:.0f} minutes '
+                           f'(t = {self.t:.3g} ns). The relaxation may be stuck.')
+        elif metrics['stalled (s)'] <= self.stall:
+            self.warned = False
+        if self.report and self.verbose and now - self.last_report >= self.report:
+            self.last_report = now
+            tools.logprint(self.describe(metrics))
+        self.last = metrics
+        return metrics
+
+    def describe(self,metrics):
+        ''' One line summary of the metrics. '''
+        text = f'{self.job.name}: {metrics["rows"]} rows'
+        if self.plan:
+            text += f' of {self.planned}, stage {metrics["stage"]}/{metrics["stages"]} ({metrics["stage title"]})'
+        text += f', t = {metrics["t (ns)"]:.3g} ns, {metrics["rows/s"]*60:.2f} rows/min'
+        if metrics.get('eta (s)') is not None:
+            text += f', about {metrics["eta (s)"]/60:.0f} minutes left'
+        return text + '.'
+
+    async def follow(self,output=None):
+        ''' Poll until cancelled. '''
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.poll(output)
+        except asyncio.CancelledError:
+            self.poll(output)
+            raise
+
+def throughput(folders):
+    '''
+    Goal: Compare the throughput of finished runs, e.g. across grid sizes.
+    Inputs:
+        -folders([str]): folders that are searched (recursively) for .metrics.jsonl files.
+    Returns a DataFrame with the last metrics of every run and its number of cells.
+    '''
+    import pandas as pd
+    rows = []
+    for folder in folders:
+        for root,_,files in os.walk(folder):
+            for name in files:
+                if not name.endswith('.metrics.jsonl'):
+                    continue
+                with open(os.path.join(root,name)) as file:
+                    lines = file.read().splitlines()
+                if not lines:
+                    continue
+                metrics = json.loads(lines[-1])
+                metrics['run'] = name[:-len('.metrics.jsonl')]
+                script = os.path.join(root,metrics['run']+'.mx3')
+                if os.path.exists(script):
+                    with open(script) as file:
+                        text = file.read()
+                    size = [re.search(rf'{n}\s*:=\s*(\d+)',text) for n in ('Nx','Ny','Nz')]
+                    if None not in size:
+                        metrics['cells'] = int(size[0].group(1)) * int(size[1].group(1)) * int(size[2].group(1))
+                rows.append(metrics)
+    df = pd.DataFrame(rows)
+    if 'cells' in df:
+        df['cell rows/s'] = df['cells'] * df['rows/s']
+    return df
@@ -0,0 +1,400 @@
+"""Structured representation of a mumax3 script with passes that remove unneeded simulation work."""
+import numpy as np
+
+def fmt(x):
+    ''' Short text form of a number for in the script. '''
+    return '%.10g' % x
+
+class Node:
+    ''' One element of a stage. Nodes that change the simulation state are recognized by their type. '''
+    def lines(self):
+        return []
+
+class Raw(Node):
+    ''' Text that was added to the script directly. Its effect is unknown, so passes never move past it. '''
+    def __init__(self,text):
+        self.text = text
+    def lines(self):
+        return self.text.split('\n')
+
+class Comment(Node):
+    def __init__(self,text):
+        self.text = text
+    def lines(self):
+        return [f'/* {self.text} */']
+
+class Statement(Node):
+    ''' Any other line, e.g. a variable assignment. Treated as a change of state. '''
+    def __init__(self,text):
+        self.text = text
+    def lines(self):
+        return [self.text]
+
+class SetField(Node):
+    '''
+    External field. 'value' is a vector in mT, or the name of an axis if the field follows the loop variable
+    along that axis.
+    '''
+    def __init__(self,value):
+        self.value = value
+    def field(self,loop_value=None):
+        ''' Field vector in mT, with the value of the loop variable if the field depends on it. '''
+        if isinstance(self.value,str):
+            return tuple(float(loop_value) if axis == self.value else 0.0 for axis in 'xyz')
+        return tuple(float(v) for v in self.value)
+    def lines(self):
+        if isinstance(self.value,str):
+            return ['B_ext = vector(' + ','.join('B' if axis == self.value else '0' for axis in 'xyz') + ')']
+        if not any(self.value):
+            return ['B_ext = vector(0,0,0)']
+        return ['B_ext = vector(' + ','.join(f'{v}/1000' for v in self.value) + ')']
+
+class SetMagnetization(Node):
+    def __init__(self,value,region=None):
+        self.value = value
+        self.region = region
+    def lines(self):
+        return [f'm.SetRegion({self.region}, {self.value})' if self.region is not None else f'm = {self.value}']
+
+class Relax(Node):
+    def lines(self):
+        return ['relax()']
+
+class Run(Node):
+    ''' Time evolution for 'time' nanoseconds. '''
+    def __init__(self,time):
+        self.time = time
+    def lines(self):
+        return [f'run({self.time}e-9)']
+
+class Save(Node):
+    '''
+    Output of the current state: kind 'snapshot' (jpg), 'save' (ovf) or 'table' (row in table.txt).
+    Output policy:
+        -every(int): only save every Nth time this quantity comes by (the first time is always saved). The
+            counter is shared by all saves of the same quantity in the script.
+        -threshold(float): only save if an average magnetization component changed by more than this since
+            the last save of this quantity.
+        -crop(int or (x1,x2,y1,y2,z1,z2)): only save one z layer, or a block of cells (mumax3 CropLayer and
+            Crop, ranges exclude the end).
+    With 'every' or 'threshold' the files are no longer one per table row, so the number of saved files is
+    added to the table as 'saved <key> ()' (see topology.frame_rows).
+    '''
+    def __init__(self,kind,quantity=None,every=1,threshold=None,crop=None):
+        self.kind = kind
+        self.quantity = quantity
+        self.every = every
+        self.threshold = threshold
+        self.crop = crop
+    @property
+    def key(self):
+        return {'snapshot': 'snapshot', 'table': 'table'}.get(self.kind,self.quantity)
+
+    def target(self):
+        if self.crop is None:
+            return self.quantity
+        if isinstance(self.crop,int):
+            return f'CropLayer({self.quantity},{self.crop})'
+        return f'Crop({self.quantity},' + ','.join(str(c) for c in self.crop) + ')'
+
+    def cells(self,grid):
+        ''' Number of cells written per save for a grid of size (Nx,Ny,Nz). '''
+        if self.crop is None:
+            return int(np.prod(grid))
+        if isinstance(self.crop,int):
+            return grid[0]*grid[1]
+        x1,x2,y1,y2,z1,z2 = self.crop
+        return (x2-x1)*(y2-y1)*(z2-z1)
+
+    @property
+    def counter(self):
+        ''' Script variable with the number of saved files, or None if every step is saved. '''
+        if self.kind == 'table' or (self.every == 1 and self.threshold is None):
+            return None
+        return f'saved_{self.key}'
+
+    def variables(self):
+        ''' Script variables used by the output policy, with their starting value. '''
+        variables = [(self.counter,0)] if self.counter else []
+        if self.every > 1:
+            variables.append((f'n_{self.key}',self.every-1))
+        if self.threshold is not None:
+            variables += [(f'm{c}_{self.key}',2.0) for c in 'xyz']
+        return variables
+
+    def lines(self):
+        if self.kind == 'table':
+            return ['tablesave()']
+        lines = [f'{self.kind}({self.target()})']
+        if self.counter:
+            lines.append(f'{self.counter} += 1')
+        if self.threshold is not None:
+            changed = ' || '.join(f'abs(m.comp({i}).average()-m{c}_{self.key}) > {self.threshold}' for i,c in enumerate('xyz'))
+            lines = ([f'if {changed} {{'] + ['    ' + line for line in lines]
+                     + [f'    m{c}_{self.key} = m.comp({i}).average()' for i,c in enumerate('xyz')] + ['}'])
+        if self.every > 1:
+            counter = f'n_{self.key}'
+            lines = ([f'{counter} += 1',f'if {counter} >= {self.every} {{'] + ['    ' + line for line in lines]
+                     + [f'    {counter} = 0','}'])
+        return lines
+
+class FieldLoop(Node):
+    '''
+    Field sweep along one axis from 'first' to 'last' mT (both included) in steps of 'step' mT. 'step' is
+    negative for a sweep to lower fields. The body is run once for every field value.
+    '''
+    def __init__(self,axis,first,last,step,body):
+        self.axis = axis
+        self.first = first
+        self.last = last
+        self.step = step
+        self.body = body
+
+    def iterations(self):
+        return max(int(round((self.last - self.first) / self.step)) + 1, 0)
+
+    def value(self,i):
+        ''' Field in mT during iteration i. Negative i counts from the end. '''
+        if i < 0: i += self.iterations()
+        return self.first + i*self.step
+
+    def is_sweep(self):
+        ''' True if the body only sets the field, relaxes and saves. '''
+        body = [node for node in self.body if not isinstance(node,Comment)]
+        return (len(body) >= 2 and isinstance(body[0],SetField) and isinstance(body[0].value,str)
+                and isinstance(body[1],Relax) and all(isinstance(node,Save) for node in body[2:]))
+
+    def lines(self):
+        #Half a step of slack in the bound, so rounding errors in B can never skip the last field value.
+        bound = self.last + self.step/2
+        if self.step > 0:
+            header = f'for B={fmt(self.first)}e-3; B<={fmt(bound)}e-3; B+={fmt(self.step)}e-3{{'
+        else:
+            header = f'for B={fmt(self.first)}e-3; B>={fmt(bound)}e-3; B-={fmt(-self.step)}e-3{{'
+        return [header] + ['    ' + line for node in self.body for line in node.lines()] + ['}']
+
+class Stage:
+    ''' Part of the simulation added by one call (a static field, a field sweep...). '''
+    def __init__(self,title=None,nodes=None):
+        self.title = title
+        self.nodes = nodes or []
+
+    def lines(self):
+        lines = [f'/* {self.title} */'] if self.title else []
+        for i,node in enumerate(self.nodes):
+            if i > 0 and isinstance(node,(SetField,FieldLoop,Comment)): lines.append('')
+            lines += node.lines()
+        return lines
+
+class Script:
+    '''
+    A mumax3 script: fixed sections (setup, device, geometry, materials, starting condition) followed by the
+    simulation stages. render() gives the text of the .mx3 file.
+    '''
+    def __init__(self):
+        self.sections = []
+        self.autosave = None
+        self.autosave_quantities = [] #Quantities saved as ovf at every autosave, e.g. ['m']
+        self.stages = []
+
+    def section(self,title,lines):
+        self.sections.append((title,list(lines)))
+
+    def add_stage(self,title,nodes):
+        stage = Stage(title,nodes)
+        self.stages.append(stage)
+        return stage
+
+    def add_raw(self,text):
+        self.stages.append(Stage(None,[Raw(text)]))
+
+    def saves(self):
+        ''' All Save nodes of the stages, including those in loops. '''
+        def walk(nodes):
+            for node in nodes:
+                if isinstance(node,FieldLoop):
+                    yield from walk(node.body)
+                elif isinstance(node,Save):
+                    yield node
+        return [save for stage in self.stages for save in walk(stage.nodes)]
+
+    def render(self):
+        text = ''
+        for title,lines in self.sections:
+            text += f'\n/* {title} */\n' + '\n'.join(lines) + '\n'
+        variables = dict(variable for save in self.saves() for variable in save.variables())
+        if variables:
+            counters = dict.fromkeys(save.counter for save in self.saves() if save.counter)
+            text += ('\n/* Output policy */\n' + '\n'.join(f'{name} := {value}' for name,value in variables.items()) + '\n'
+                     + ''.join(f'TableAddVar({name}, "saved {name[6:]}", "")\n' for name in counters))
+        if self.autosave is not None:
+            text += '\n' + '\n'.join((f'auto_save := {self.autosave}e-9','TableAutoSave(auto_save)','AutoSnapshot(m,auto_save)')
+                                      + tuple(f'AutoSave({quantity},auto_save)' for quantity in self.autosave_quantities)) + '\n'
+        for stage in self.stages:
+            if stage.title is None and len(stage.nodes) == 1 and isinstance(stage.nodes[0],Raw):
+                text += stage.nodes[0].text
+            else:
+                text += '\n\n' + '\n'.join(stage.lines()) + '\n'
+        return text
+
+    #Optimization passes~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def optimize(self):
+        '''
+        Goal: Remove simulation work that cannot change the result:
+            - field assignments that are overwritten before the next relax or run, or that set the field it
+              already has;
+            - relax() and its saves when nothing changed since the last relax, including the first field value
+              of a sweep that starts where the previous stage ended;
+            - sweeps that continue the previous sweep along the same axis are merged into one loop.
+        Returns a list of messages that describe what was removed.
+        '''
+        report = []
+        state = {'field': (0.0,0.0,0.0), 'settled': False, 'saved': set(), 'pending': None}
+        for stage in self.stages:
+            stage.nodes = self._simplify(stage.nodes,state,report)
+        self._merge_loops(report)
+        self.stages = [stage for stage in self.stages if stage.nodes]
+        return report
+
+    def _simplify(self,nodes,state,report):
+        '''
+        Walk through 'nodes' and keep track of the simulation state: the field, whether the magnetization is
+        relaxed in that field and which outputs were saved since. Removes nodes that do not change anything.
+        '''
+        kept = []
+        for node in nodes:
+            if isinstance(node,SetField):
+                #A field that follows the loop variable is different in every iteration.
+                field = 'loop' if isinstance(node.value,str) else node.field()
+                if field == state['field']:
+                    report.append(f'Removed field assignment without effect ({node.lines()[0]}).')
+                    continue
+                if state['pending'] is not None:
+                    container,pending = state['pending']
+                    container.remove(pending)
+                    report.append(f'Removed field assignment that is overwritten ({pending.lines()[0]}).')
+                state.update(field=field,settled=False,saved=set(),pending=(kept,node))
+            elif isinstance(node,Relax):
+                if state['settled']:
+                    report.append('Removed relax() of a state that was already relaxed.')
+                    continue
+                state.update(settled=True,saved=set(),pending=None)
+            elif isinstance(node,Save):
+                if node.key in state['saved']:
+                    report.append(f'Removed {node.lines()[0]} of a state that was already saved.')
+                    continue
+                #The saved state (e.g. B_ext in the table) shows the field, so it is no longer overwritten unseen
+                state['saved'].add(node.key)
+                state['pending'] = None
+            elif isinstance(node,FieldLoop):
+                if not self._simplify_loop(node,state,report):
+                    continue
+            elif isinstance(node,SetMagnetization):
+                state.update(settled=False,saved=set())
+            elif isinstance(node,Run):
+                state.update(settled=False,saved=set(),pending=None)
+            elif not isinstance(node,Comment):
+                state.update(field=None,settled=False,saved=set(),pending=None)
+            kept.append(node)
+        return kept
+
+    def _simplify_loop(self,loop,state,report):
+        ''' Simplify a loop and set 'state' to the state after it. Returns False if the loop is removed. '''
+        if (loop.iterations() > 0 and loop.is_sweep() and state['settled'] and state['field'] is not None
+                and SetField(loop.axis).field(loop.value(0)) == state['field']
+                and {node.key for node in loop.body if isinstance(node,Save)} <= state['saved']):
+            report.append(f'Removed the first value ({fmt(loop.value(0))} mT) of the {loop.axis} sweep, which repeats the previous state.')
+            loop.first += loop.step
+        if loop.iterations() == 0:
+            report.append(f'Removed empty {loop.axis} sweep.')
+            return False
+
+        #Inside the loop the state at the start of an iteration is not known.
+        inner = {'field': None, 'settled': False, 'saved': set(), 'pending': None}
+        loop.body = self._simplify(loop.body,inner,report)
+
+        body = [node for node in loop.body if not isinstance(node,Comment)]
+        if state['pending'] is not None and body and isinstance(body[0],SetField):
+            container,pending = state['pending']
+            container.remove(pending)
+            report.append(f'Removed field assignment that is overwritten ({pending.lines()[0]}).')
+
+        #State after the last iteration
+        after = {'field': None, 'settled': False, 'saved': set(), 'pending': None}
+        for node in body:
+            if isinstance(node,SetField):
+                after.update(field=node.field(loop.value(-1)),settled=False,saved=set())
+            elif isinstance(node,Relax):
+                after.update(settled=True,saved=set())
+            elif isinstance(node,Save):
+                after['saved'].add(node.key)
+            elif not isinstance(node,Comment):
+                after.update(settled=False,saved=set())
+                if not isinstance(node,(SetMagnetization,Run)): after['field'] = None
+        state.update(after)
+        return True
+
+    def _merge_loops(self,report):
+        ''' Merge a sweep into the sweep before it if it continues it (also across stages). '''
+        previous = None
+        for stage in self.stages:
+            for node in list(stage.nodes):
+                if isinstance(node,Comment):
+                    continue
+                if (isinstance(node,FieldLoop) and isinstance(previous,FieldLoop) and node.axis == previous.axis
+                        and np.isclose(node.step,previous.step) and np.isclose(node.first,previous.last + previous.step)
+                        and [n.lines() for n in node.body] == [n.lines() for n in previous.body]):
+                    report.append(f'Merged the {node.axis} sweep to {fmt(node.last)} mT into the sweep before it.')
+                    previous.last = node.last
+                    stage.nodes.remove(node)
+                    if all(isinstance(n,Comment) for n in stage.nodes): stage.nodes = []
+                    continue
+                previous = node
+
+    #Expected output~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    def count_outputs(self,grid=None):
+        '''
+        Goal: Count what the script will produce.
+        Inputs:
+            -grid((int,int,int)): size of the simulation grid. If given, the number of cells written to ovf files
+                is counted as well ('ovf_cells').
+        Returns a dictionary with the number of relax() calls ('relax'), the total run time in ns ('run'),
+        the number of table rows ('table'), jpg snapshots ('snapshot') and ovf files per quantity (e.g.
+        'm_full'). Saves with a threshold are counted as if the state always changes, so that is an upper
+        bound. Output of text that was added directly to the script is not counted.
+        '''
+        counts = {'relax': 0, 'run': 0.0, 'table': 0, 'snapshot': 0}
+        occurrences = {}
+        def count(nodes,times):
+            for node in nodes:
+                if isinstance(node,FieldLoop):
+                    count(node.body,times*node.iterations())
+                elif isinstance(node,Relax):
+                    counts['relax'] += times
+                elif isinstance(node,Run):
+                    counts['run'] += times*node.time
+                    if self.autosave:
+                        counts['table'] += times*int(node.time / self.autosave)
+                        counts['snapshot'] += times*int(node.time / self.autosave)
+                        for quantity in self.autosave_quantities:
+                            counts[quantity] = counts.get(quantity,0) + times*int(node.time / self.autosave)
+                elif isinstance(node,Save):
+                    occurrences[node] = occurrences.get(node,0) + times
+        for stage in self.stages:
+            count(stage.nodes,1)
+
+        #Saves of the same quantity share one counter for 'every'.
+        total = {}
+        for save,n in occurrences.items():
+            total[save.key] = total.get(save.key,0) + n
+        every = {save.key: save.every for save in occurrences}
+        saved = {key: -(-n // every[key]) for key,n in total.items()}
+        for key,n in saved.items():
+            counts[key] = counts.get(key,0) + n
+
+        if grid is not None:
+            #Every save of a quantity is counted with the fraction that is kept of it.
+            counts['ovf_cells'] = sum(save.cells(grid) * n * saved[save.key] / total[save.key]
+                                      for save,n in occurrences.items() if save.kind == 'save')
+            counts['ovf_cells'] += sum(counts[quantity] - saved.get(quantity,0) for quantity in self.autosave_quantities) * int(np.prod(grid))
+        return counts
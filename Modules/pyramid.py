@@ -0,0 +1,98 @@
+"""Block-averaged multi-resolution levels of converted magnetization frames."""
+import Modules.tools as tools
+import Modules.framestore as framestore
+from tqdm import tqdm
+import numpy as np
+import os
+
+pyramid_folder = 'Pyramid'
+
+def pyramid_file(datafile,factor):
+    ''' location of the level of 'datafile' that is downsampled by 'factor' '''
+    folder,name = os.path.split(datafile)
+    return os.path.join(folder,pyramid_folder,f'{name[:-4]}_{factor}x.npy')
+
+def _accumulate(sums,norms,counts,factor=2):
+    '''
+    Sum blocks of factor x factor cells in the xy plane. The grid is padded with empty (masked) cells when
+    Nx or Ny is not a multiple of factor.
+    '''
+    Nx,Ny = np.shape(counts)[:2]
+    pad = ((0,(-Nx) % factor),(0,(-Ny) % factor),(0,0))
+    sums = np.pad(sums,pad + ((0,0),))
+    norms = np.pad(norms,pad)
+    counts = np.pad(counts,pad)
+
+    Mx,My,Nz = np.shape(counts)[0]//factor, np.shape(counts)[1]//factor, np.shape(counts)[2]
+    sums = sums.reshape(Mx,factor,My,factor,Nz,3).sum(axis=(1,3))
+    norms = norms.reshape(Mx,factor,My,factor,Nz).sum(axis=(1,3))
+    counts = counts.reshape(Mx,factor,My,factor,Nz).sum(axis=(1,3))
+    return sums,norms,counts
+
+def _level(sums,norms,counts):
+    '''
+    Turn block sums into block averages. The averaged vector is rescaled to the mean length of the cells it
+    was made of, so normalized m files stay normalized and m_full files keep their Msat scale. Blocks
+    without any cell inside the device are set to zero.
+    '''
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mean = sums / counts[...,None]
+        length = np.linalg.norm(mean,axis=-1)
+        scale = np.where(length > 0, norms / counts / length, 0)
+    return np.nan_to_num(mean * scale[...,None])
+
+def downsample(data,levels=3,mask=None):
+    '''
+    Goal: Build block-averaged levels of a magnetization array.
+    Inputs:
+        -data(np.array): magnetization of shape [Nx,Ny,Nz,3].
+        -levels(int): number of levels. Level n is downsampled by 2**n in x and y; z is left untouched.
+        -mask(np.array): optional boolean array [Nx,Ny] that is True inside the device. Without mask, all
+            cells with nonzero magnetization count as device.
+    Returns a dictionary with the downsampling factor as key and the level as value.
+    '''
+    norms = np.linalg.norm(data,axis=-1)
+    valid = norms > 0
+    if mask is not None:
+        valid &= mask[:,:,None]
+
+    sums = np.where(valid[...,None],data,0)
+    norms = np.where(valid,norms,0)
+    counts = valid.astype('int')
+
+    pyramid = {}
+    for n in range(1,levels+1):
+        sums,norms,counts = _accumulate(sums,norms,counts)
+        pyramid[2**n] = _level(sums,norms,counts).astype(data.dtype)
+    return pyramid
+
+def make_pyramid(files,levels=3,mask=None):
+    '''
+    Goal: Store 2x, 4x, 8x... downsampled levels of .npy magnetization files in the 'Pyramid' folder next
+    to the data.
+    Inputs:
+        -files([str]): list of m*.npy or m_full*.npy filenames.
+        -levels(int): number of levels to make.
+        -mask(np.array): optional boolean array [Nx,Ny] that is True inside the device.
+    '''
+    tools.logprint(f'Making {levels} downsampled levels for {len(files)} files.')
+
+    for i in tqdm(range(len(files))):
+        file = files[i]
+        os.makedirs(os.path.join(os.path.dirname(file),pyramid_folder),exist_ok=True)
+        for factor,level in downsample(framestore.load(file),levels=levels,mask=mask).items():
+            np.save(pyramid_file(file,factor),level)
+
+def load_level(datafile,skip,mmap_mode=None):
+    '''
+    Goal: Load the coarsest stored level of 'datafile' that is not coarser than 'skip'.
+    mmap_mode is passed to np.load, so that only the cells that are used are read.
+    Returns the level and its downsampling factor, or (None,1) if no level is available.
+    '''
+    factor = 2**int(np.log2(max(skip,1)))
+    while factor > 1:
+        file = pyramid_file(datafile,factor)
+        if os.path.exists(file):
+            return np.load(file,mmap_mode=mmap_mode),factor
+        factor //= 2
+    return None,1
@@ -0,0 +1,232 @@
+"""Averages, variances and angle histograms of the magnetization per region, streamed over all frames."""
+import Modules.tools as tools
+import Modules.framestore as framestore
+import Modules.decodeOVF as decodeOVF
+import Modules.timing as timing
+from tqdm import tqdm
+import numpy as np
+import pandas as pd
+import json
+
+#Names of the regions defined by MumaxScripter.new_config
+region_names = {1: 'device', 2: 'empty space'}
+
+#Region masks~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#Regions are dictionaries {name: boolean array}. Masks of shape [Nx,Ny] apply to every z layer. Regions may
+#overlap, e.g. the device and its layers. The geometry of a simulation (statelibrary.geometry_mask) is a region too.
+
+def device_regions(m,layers=True):
+    '''
+    Goal: Find the regions of a simulation from one of its m_full frames.
+    Inputs:
+        -m(np.array): magnetization of shape [Nx,Ny,Nz,3]. Cells without magnetization are outside the device.
+        -layers(bool): add every z layer of the device as a region 'layer <z>'.
+    Returns {'device': mask, 'layer 0': mask, ...}.
+    '''
+    device = np.any(np.asarray(m) != 0,axis=-1)
+    regions = {'device': device}
+    if layers:
+        for z in range(device.shape[2]):
+            if device[:,:,z].any():
+                layer = np.zeros_like(device)
+                layer[:,:,z] = device[:,:,z]
+                regions[f'layer {z}'] = layer
+    return regions
+
+def mumax_regions(file,names=None):
+    '''
+    Goal: Read the regions defined with DefRegion from a saved 'regions' quantity (save(regions) in the script).
+    Inputs:
+        -file(str): regions*.ovf or the converted regions*.npy file.
+        -names(dict): names of region numbers, e.g. {3: 'left contact'}. The regions of MumaxScripter are
+            called 'device' and 'empty space'; others 'region <number>'.
+    Returns {name: mask} for every region number but 0.
+    '''
+    data = framestore.load(file) if file.endswith('.npy') else decodeOVF.unpackFile(file)[0]
+    numbers = np.rint(np.asarray(data)[...,0]).astype('int')
+    names = {**region_names,**(names or {})}
+    return {names.get(n,f'region {n}'): numbers == n for n in np.unique(numbers) if n != 0}
+
+def components(mask,names=None):
+    '''
+    Goal: Split a mask into its parts that are not connected in the xy plane, e.g. a device and its contacts.
+    Inputs:
+        -mask(np.array): boolean array [Nx,Ny] or [Nx,Ny,Nz]. Cells are connected through their 4 neighbours in
+            the plane; a cell belongs to a part if it is inside in any layer.
+        -names([str]): names of the parts from large to small. Default is 'device' for the largest part and
+            'contact 1', 'contact 2'... for the others.
+    Returns {name: mask} with masks of the shape of 'mask'.
+    '''
+    mask = np.asarray(mask,dtype='bool')
+    plane = mask.any(axis=2) if mask.ndim == 3 else mask
+    #Every cell starts with its own label and takes the largest label of its neighbours until nothing changes.
+    labels = np.where(plane,np.arange(1,plane.size+1).reshape(plane.shape),0)
+    while True:
+        padded = np.pad(labels,1)
+        neighbours = np.max([padded[:-2,1:-1],padded[2:,1:-1],padded[1:-1,:-2],padded[1:-1,2:],labels],axis=0)
+        new = np.where(plane,neighbours,0)
+        if np.array_equal(new,labels):
+            break
+        labels = new
+
+    found,sizes = np.unique(labels[plane],return_counts=True)
+    order = found[np.argsort(-sizes,kind='stable')]
+    if names is None:
+        names = ['device'] + [f'contact {i}' for i in range(1,len(order))]
+    parts = {}
+    for name,label in zip(names,order):
+        part = labels == label
+        parts[name] = mask & part[:,:,None] if mask.ndim == 3 else part
+    return parts
+
+def strip_regions(mask,width,cell_size=5.0,start=0,axis=0,prefix='strip'):
+    '''
+    Goal: Cut a region into strips, e.g. the trenches over which flux() integrates the stray field.
+    Inputs:
+        -mask(np.array): boolean array [Nx,Ny] or [Nx,Ny,Nz] of the region.
+        -width(float): width of a strip in nm.
+        -cell_size(float): width of one cell in nm.
+        -start(float): position in nm where the first strip starts.
+        -axis(int): 0 for strips across x, 1 for strips across y.
+        -prefix(str): regions are called '<prefix> 0', '<prefix> 1'...
+    Returns {name: mask} for every strip that contains part of the region.
+    '''
+    mask = np.asarray(mask,dtype='bool')
+    n = max(int(round(width/cell_size)),1)
+    index = np.arange(mask.shape[axis]) - int(round(start/cell_size))
+    index = np.where(index >= 0,index // n,-1)
+    shape = [1]*mask.ndim
+    shape[axis] = -1
+    index = index.reshape(shape)
+    strips = {}
+    for i in np.unique(index[index >= 0]):
+        strip = mask & (index == i)
+        if strip.any():
+            strips[f'{prefix} {i}'] = strip
+    return strips
+
+def expand(mask,shape):
+    ''' Boolean mask of a region for frames with cells 'shape' (Nx,Ny,Nz). Masks of shape [Nx,Ny] apply to every layer. '''
+    mask = np.asarray(mask,dtype='bool')
+    if mask.ndim == 2:
+        mask = np.repeat(mask[:,:,None],shape[2],axis=2)
+    if mask.shape != tuple(shape):
+        raise ValueError(f'region of shape {mask.shape} does not fit frames of shape {tuple(shape)}')
+    return mask
+
+#Streaming reduction~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class RegionStats:
+    '''
+    Reduces batches of frames to statistics per region: number of cells, mean and variance of every component,
+    length of the mean vector and a histogram of the in-plane angle. Only the indices of the cells in the
+    regions are kept, so the memory does not grow with the number of frames.
+    '''
+    def __init__(self,regions,shape,bins=36,skip_empty=True):
+        '''
+        Inputs:
+            -regions(dict): {name: boolean mask}, see device_regions, mumax_regions, components and strip_regions.
+            -shape((int,int,int)): cells (Nx,Ny,Nz) of the frames.
+            -bins(int): number of bins of the in-plane angle from -180 to 180 degrees.
+            -skip_empty(bool): leave out cells where the vector is zero (outside the geometry). Use False for
+                fields, which can be zero anywhere.
+        '''
+        self.names = list(regions)
+        self.bins = bins
+        self.skip_empty = skip_empty
+        self.edges = np.linspace(-180,180,bins+1)
+        #(region, cell) pairs of all regions; overlapping regions share cells
+        region,cell = [],[]
+        for i,name in enumerate(self.names):
+            index = np.flatnonzero(expand(regions[name],shape))
+            region.append(np.full(len(index),i))
+            cell.append(index)
+        self.region = np.concatenate(region) if region else np.zeros(0,dtype='int')
+        self.cell = np.concatenate(cell) if cell else np.zeros(0,dtype='int')
+
+    def columns(self):
+        ''' Column names of the rows returned by update(). '''
+        columns = []
+        for name in self.names:
+            columns += [f'{name} n', *[f'{name} {c} ()' for c in ('mx','my','mz')],
+                        *[f'{name} var {c} ()' for c in ('mx','my','mz')], f'{name} |m| ()']
+        return columns
+
+    def update(self,data):
+        '''
+        Goal: Reduce a batch of frames.
+        Inputs:
+            -data(np.array): frames of shape [frames,Nx,Ny,Nz,3].
+        Returns the statistics as an array [frames,columns] (see columns()) and the angle histograms as an
+        array [frames,regions,bins] of cell counts.
+        '''
+        frames = len(data)
+        R = len(self.names)
+        values = np.asarray(data,dtype='float').reshape(frames,-1,3)[:,self.cell]
+        weight = np.any(values != 0,axis=-1).astype('float') if self.skip_empty else np.ones(values.shape[:2])
+        key = (np.arange(frames)[:,None] * R + self.region[None,:]).ravel()
+        weight = weight.ravel()
+        values = values.reshape(-1,3)
+
+        count = lambda w: np.bincount(key,weights=w,minlength=frames*R).reshape(frames,R)
+        n = count(weight)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = np.stack([count(weight*values[:,c]) for c in range(3)],axis=-1) / n[...,None]
+            square = np.stack([count(weight*values[:,c]**2) for c in range(3)],axis=-1) / n[...,None]
+        variance = np.maximum(square - mean**2,0)
+        length = np.linalg.norm(mean,axis=-1)
+
+        angle = np.degrees(np.arctan2(values[:,1],values[:,0]))
+        index = np.clip(np.digitize(angle,self.edges) - 1,0,self.bins-1)
+        histogram = np.bincount(key*self.bins + index,weights=weight,minlength=frames*R*self.bins)
+        histogram = histogram.reshape(frames,R,self.bins).astype('uint32')
+
+        rows = np.concatenate([n[...,None],mean,variance,length[...,None]],axis=-1).reshape(frames,-1)
+        return rows,histogram
+
+@timing.timed()
+def region_stats(files,regions,table=None,bins=36,batch_size=50,skip_empty=True,filename='regionstats'):
+    '''
+    Goal: Calculate the statistics of every region for every frame in one pass over the files.
+    Inputs:
+        -files([str]): list of m*.npy, m_full*.npy or B_demag*.npy filenames, all of the same shape.
+        -regions(dict): {name: boolean mask of shape [Nx,Ny,Nz] or [Nx,Ny]}.
+        -table(str): location of table.txt. If given, the results are joined with the table rows.
+        -bins(int): number of bins of the in-plane angle histograms.
+        -batch_size(int): number of frames that are in memory at once.
+        -skip_empty(bool): leave out cells where the vector is zero (see RegionStats).
+        -filename(str): custom filename. The statistics are written to filename.txt, one row per frame, the
+            angle histograms to filename_angles.npy [frames,regions,bins] with the region names and the bin
+            edges in filename_angles.json.
+    Returns a DataFrame with one row per frame.
+    '''
+    if len(files) == 0:
+        raise ValueError('no files given')
+    shape = framestore.load(files[0],mmap_mode='r').shape[:3]
+    stats = RegionStats(regions,shape,bins=bins,skip_empty=skip_empty)
+    tools.logprint(f'Calculating statistics of {len(stats.names)} regions in {len(files)} frames.')
+    timing.add(items=len(files))
+
+    histograms = np.lib.format.open_memmap(filename+'_angles.npy',mode='w+',dtype='uint32',
+                                           shape=(len(files),len(stats.names),bins))
+    with open(filename+'_angles.json','w') as file:
+        json.dump({'regions': stats.names,'angle edges (deg)': stats.edges.tolist()},file,indent=1)
+
+    #Rows are appended per batch, so only one batch of frames is in memory.
+    with open(filename+'.txt','w',newline='') as file:
+        for start in tqdm(range(0,len(files),batch_size)):
+            batch = files[start:start+batch_size]
+            rows,histogram = stats.update(np.stack([framestore.load(f) for f in batch]))
+            histograms[start:start+len(batch)] = histogram
+            pd.DataFrame({'frame': np.arange(start,start+len(batch)),'file': batch}).join(
+                pd.DataFrame(rows,columns=stats.columns())).to_csv(file,sep='\t',index=False,header=start == 0)
+    histograms.flush()
+    del histograms
+
+    frames = pd.read_csv(filename+'.txt',sep='\t')
+    if table is not None:
+        from Modules.topology import join_table
+        frames = join_table(frames,table)
+        frames.to_csv(filename+'.txt',sep='\t',index=False)
+    tools.logprint(f'Region statistics saved as \'{filename}.txt\'.')
+    return frames
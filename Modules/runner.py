@@ -0,0 +1,302 @@
+"""Queue of mumax3 scripts that are run as concurrent subprocesses."""
+import Modules.tools as tools
+from Modules.cache import script_key
+from Modules.monitor import RunMonitor
+import asyncio
+import signal
+import json
+import time
+import sys
+import os
+
+default_mumax = os.environ.get('MUMAX3','mumax3')
+
+if sys.platform.startswith('linux'):
+    import ctypes
+    _prctl = ctypes.CDLL(None,use_errno=True).prctl
+else:
+    _prctl = None
+
+def child_options():
+    '''
+    Options of the mumax3 subprocesses. On POSIX every simulation gets its own process group, so that killing
+    it also kills what it started (e.g. a wrapper script around mumax3). On Linux a simulation is also killed
+    when the process that started it dies, even by SIGKILL; elsewhere it keeps running until it ends.
+    '''
+    if os.name != 'posix':
+        return {}
+    options = {'start_new_session': True}
+    if _prctl is not None:
+        parent = os.getpid()
+        def die_with_parent():
+            _prctl(1,signal.SIGKILL)  #PR_SET_PDEATHSIG
+            #The parent may have died before the signal was set up
+            if os.getppid() != parent:
+                os._exit(1)
+        options['preexec_fn'] = die_with_parent
+    return options
+
+def kill(process):
+    ''' Kill a simulation started with child_options() and everything it started. '''
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid,signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+class Job:
+    '''
+    One mumax3 script in the queue. The output of the simulation is written to a log file next to the
+    script and the result of every run to a .job.json record.
+    '''
+    def __init__(self,script,timeout=None,retries=0,log=None,plan=None):
+        '''
+        Inputs:
+            -script(str): location of the .mx3 file.
+            -timeout(float): seconds after which the simulation is killed. None means no limit.
+            -retries(int): how often a failed or timed out simulation is started again.
+            -log(str): location of the log file. Default is the script name with .log.
+            -plan([(str,int)]): table rows per stage (monitor.stage_plan), used for the progress and ETA.
+        '''
+        self.script = os.path.abspath(script)
+        self.name = os.path.splitext(os.path.basename(self.script))[0]
+        self.folder = os.path.dirname(self.script)
+        self.log = log or os.path.join(self.folder,self.name+'.log')
+        self.record = os.path.join(self.folder,self.name+'.job.json')
+        self.output = os.path.join(self.folder,self.name+'.out')
+        self.timeout = timeout
+        self.retries = retries
+        self.plan = plan
+
+        self.status = 'queued'
+        self.returncode = None
+        self.attempts = 0
+        self.elapsed = 0.0
+        self.reason = ''
+        self.metrics = None
+
+    def write_record(self):
+        with open(self.record,'w') as file:
+            json.dump({key: self.__dict__[key] for key in
+                ['script','status','returncode','attempts','elapsed','reason','log','output']},file,indent=1)
+
+class Output:
+    '''
+    What is kept of the output of one attempt: the number of lines and the first line that reports an error.
+    The full output is only written to the log file, so a long simulation does not fill the memory.
+    '''
+    def __init__(self):
+        self.lines = 0
+        self.error = None
+
+class JobRunner:
+    '''
+    Runs queued mumax3 scripts with at most 'concurrency' simulations at the same time. Works on any
+    platform on which the mumax3 executable (or a stub with the same command line) can be started.
+    '''
+    failure_markers = ('panic:','error:','fatal')
+
+    def __init__(self,concurrency=1,mumax=None,args=(),gpus=None,timeout=None,retries=0,verbose=True,cache=None,monitor=False):
+        '''
+        Inputs:
+            -concurrency(int): largest number of simulations that run at the same time.
+            -mumax(str): mumax3 executable. Default is $MUMAX3 or 'mumax3'.
+            -args([str]): extra command line arguments for mumax3.
+            -gpus([int]): GPUs to divide the simulations over (mumax3 -gpu flag). Each GPU runs at most
+                concurrency/len(gpus) simulations.
+            -timeout(float): default timeout of a job in seconds.
+            -retries(int): default number of retries of a job.
+            -verbose(bool): print log messages.
+            -cache(ResultCache): cache of finished simulations. Scripts that finished before are not run
+                again; their output folder is linked instead.
+            -monitor(bool,dict): follow the table of running simulations and log progress, throughput and
+                stalls (see monitor.RunMonitor). A dictionary sets the options of the monitor, e.g.
+                {'interval': 10, 'report': 60, 'stall': 600}.
+        '''
+        self.concurrency = concurrency
+        self.mumax = mumax or default_mumax
+        self.args = list(args)
+        self.gpus = gpus
+        self.timeout = timeout
+        self.retries = retries
+        self.verbose = verbose
+        self.cache = cache
+        self.monitor = {} if monitor is True else monitor
+        self.jobs = []
+        self.tasks = {}
+        self.loop = None
+
+    def logprint(self,string):
+        if self.verbose: tools.logprint(string)
+
+    def submit(self,script,**kwargs):
+        ''' Add a script to the queue. kwargs (timeout, retries, log, plan) override the defaults of the runner. '''
+        kwargs.setdefault('timeout',self.timeout)
+        kwargs.setdefault('retries',self.retries)
+        job = Job(script,**kwargs)
+        self.jobs.append(job)
+        return job
+
+    def cancel(self,job=None):
+        '''
+        Cancel one job, or all jobs if no job is given. Running simulations are killed. Can be called from any
+        thread, e.g. from a GUI while run() blocks; the jobs are then cancelled in the event loop of run().
+        '''
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if self.loop is not None and not in_loop:
+            try:
+                self.loop.call_soon_threadsafe(self._cancel,job)
+                return
+            except RuntimeError:
+                #The loop was closed in the meantime, so nothing runs any more.
+                pass
+        self._cancel(job)
+
+    def _cancel(self,job):
+        for j in ([job] if job is not None else self.jobs):
+            if j in self.tasks:
+                self.tasks[j].cancel()
+            elif j.status == 'queued':
+                j.status = 'cancelled'
+
+    def succeeded(self,returncode,error=None):
+        '''
+        A simulation succeeded if mumax3 exited normally and did not report an error. 'error' is the first line
+        of its output with one of the failure_markers, or None.
+        '''
+        if returncode != 0:
+            return False, f'exit code {returncode}'
+        if error is not None:
+            return False, f'error in output: {error.strip()}'
+        return True, ''
+
+    async def _stream(self,stream,log,output):
+        ''' Copy lines from the subprocess to the log file as they arrive and look for errors (see Output). '''
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            line = line.decode(errors='replace')
+            log.write(line)
+            log.flush()
+            output.lines += 1
+            if output.error is None and any(marker in line.lower() for marker in self.failure_markers):
+                output.error = line
+
+    async def _attempt(self,job,gpu):
+        command = [self.mumax] + self.args + (['-gpu',str(gpu)] if gpu is not None else []) + [job.script]
+        output = Output()
+        with open(job.log,'a') as log:
+            log.write(f'//{time.strftime("%Y-%m-%d %H:%M:%S")} attempt {job.attempts}: {" ".join(command)}\n')
+            process = await asyncio.create_subprocess_exec(*command,cwd=job.folder,
+                stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE,**child_options())
+            streams = asyncio.gather(self._stream(process.stdout,log,output),self._stream(process.stderr,log,output))
+            monitor = None
+            if self.monitor is not False and self.monitor is not None:
+                monitor = RunMonitor(job,job.plan,verbose=self.verbose,**self.monitor)
+                following = asyncio.ensure_future(monitor.follow(output))
+            try:
+                await asyncio.wait_for(asyncio.shield(streams),job.timeout)
+                await process.wait()
+            except asyncio.TimeoutError:
+                kill(process)
+                await process.wait()
+                await streams
+                return 'timeout', None, f'no result after {job.timeout} seconds'
+            except asyncio.CancelledError:
+                kill(process)
+                await process.wait()
+                await streams
+                raise
+            finally:
+                if monitor is not None:
+                    following.cancel()
+                    await asyncio.gather(following,return_exceptions=True)
+                    job.metrics = monitor.last
+        success,reason = self.succeeded(process.returncode,output.error)
+        return ('done' if success else 'failed'), process.returncode, reason
+
+    def _from_cache(self,job,key):
+        ''' Finish a job with the output of an identical earlier simulation, if there is one. '''
+        if not self.cache.reuse(key,job.output):
+            return False
+        job.status,job.returncode,job.reason = 'done',0,'cached'
+        job.write_record()
+        self.logprint(f'Simulation {job.name} finished before. Using {os.path.realpath(job.output)}.')
+        return True
+
+    async def _run_job(self,job,slots):
+        gpu = 'waiting'
+        key,started = None,False
+        if self.cache is not None:
+            key = script_key(job.script)
+            if self._from_cache(job,key):
+                return
+        try:
+            gpu = await slots.get()
+            #An identical script earlier in the queue may have finished while this one was waiting.
+            if key is not None and self._from_cache(job,key):
+                return
+            if key is not None:
+                self.cache.start(key,job.output)
+                started = True
+            while job.status not in ('done','cancelled') and job.attempts <= job.retries:
+                job.attempts += 1
+                job.status = 'running'
+                self.logprint(f'Starting mumax3 simulation of {job.name}' + (f' on GPU {gpu}' if gpu is not None else '') + f' (attempt {job.attempts}).')
+                start = time.time()
+                job.status,job.returncode,job.reason = await self._attempt(job,gpu)
+                job.elapsed = time.time() - start
+                job.write_record()
+                if job.status == 'done':
+                    self.logprint(f'Simulation {job.name} finished in {job.elapsed/60:.1f} minutes.')
+                else:
+                    self.logprint(f'Simulation {job.name} {job.status}: {job.reason}. See {job.log}.')
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+            job.write_record()
+            self.logprint(f'Simulation {job.name} cancelled.')
+        finally:
+            if started:
+                self.cache.complete(key,job.output) if job.status == 'done' else self.cache.fail(key)
+            if gpu != 'waiting': slots.put_nowait(gpu)
+
+    async def run_async(self):
+        ''' Run all queued jobs. Returns the list of jobs. '''
+        self.loop = asyncio.get_running_loop()
+        slots = asyncio.Queue()
+        gpus = self.gpus or [None]
+        for i in range(self.concurrency):
+            slots.put_nowait(gpus[i % len(gpus)])
+
+        queued = [job for job in self.jobs if job.status == 'queued']
+        self.logprint(f'Running {len(queued)} simulations, {self.concurrency} at a time.')
+        self.tasks = {job: asyncio.ensure_future(self._run_job(job,slots)) for job in queued}
+        try:
+            await asyncio.gather(*self.tasks.values(),return_exceptions=True)
+        finally:
+            self.tasks = {}
+            self.loop = None
+
+        counts = {status: sum(job.status == status for job in queued) for status in ('done','failed','timeout','cancelled')}
+        self.logprint('Finished: ' + ', '.join(f'{n} {status}' for status,n in counts.items() if n))
+        return self.jobs
+
+    def run(self):
+        ''' Run all queued jobs and block until they are finished. Returns the list of jobs. '''
+        return asyncio.run(self.run_async())
+
+def run_scripts(scripts,**kwargs):
+    '''
+    Goal: Run a list of mumax3 scripts. kwargs are passed to JobRunner.
+    Returns the list of jobs with their status.
+    '''
+    runner = JobRunner(**kwargs)
+    for script in scripts:
+        runner.submit(script)
+    return runner.run()
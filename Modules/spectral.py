@@ -0,0 +1,222 @@
+"""Power spectra and spatial mode maps of autosaved time series (ringdown and FMR-like analysis)."""
+import Modules.tools as tools
+import Modules.framestore as framestore
+import Modules.timing as timing
+from tqdm import tqdm
+import numpy as np
+import pandas as pd
+import json
+import os
+
+components = ('mx','my','mz')
+
+def even_segment(t,rtol=1e-3):
+    '''
+    Goal: Find the longest part of a time series with a constant time step, e.g. the rows of table.txt that
+    were saved by TableAutoSave during run(). Rows saved by hand after relax() have the same time and are skipped.
+    Returns a slice of the rows and the time step.
+    '''
+    t = np.asarray(t,dtype='float')
+    if len(t) < 3:
+        raise ValueError('not enough rows for a spectrum')
+    dt = np.diff(t)
+    best,start = (0,0),0
+    for i in range(1,len(dt)+1):
+        #A segment ends where the step changes
+        if i == len(dt) or not np.isclose(dt[i],dt[start],rtol=rtol,atol=0) or dt[i] <= 0:
+            if i - start > best[1] - best[0] and dt[start] > 0:
+                best = (start,i)
+            start = i
+    if best[1] - best[0] < 2:
+        raise ValueError('no evenly spaced rows found')
+    return slice(best[0],best[1]+1), float(np.mean(dt[best[0]:best[1]]))
+
+def detrended(data,detrend='mean'):
+    '''
+    Remove the mean ('mean') or a straight line ('linear') along the first axis, e.g. the slow relaxation
+    under a ringdown. None leaves the data as it is.
+    '''
+    data = np.asarray(data,dtype='float')
+    if detrend is None:
+        return data
+    data = data - data.mean(axis=0)
+    if detrend == 'linear':
+        t = np.arange(len(data)) - (len(data)-1)/2
+        t = t.reshape((-1,) + (1,)*(data.ndim-1))
+        data = data - t * np.sum(t*data,axis=0) / np.sum(t**2)
+    return data
+
+def window(n,kind='hann'):
+    ''' Window that reduces the leakage of a peak into the bins around it; 'hann' or None. '''
+    return np.hanning(n) if kind == 'hann' else np.ones(n)
+
+def power_spectrum(data,dt,detrend='mean',window_kind='hann'):
+    '''
+    Goal: Calculate the one-sided power spectral density of time series along the first axis.
+    Inputs:
+        -data(np.array): array [times,...] of evenly spaced samples.
+        -dt(float): time step in seconds.
+        -detrend(str): see detrended().
+        -window_kind(str): see window().
+    Returns the frequencies in GHz and the power spectral density per GHz, of shape [frequencies,...].
+    '''
+    n = len(data)
+    w = window(n,window_kind).reshape((-1,) + (1,)*(np.ndim(data)-1))
+    spectrum = np.fft.rfft(detrended(data,detrend)*w,axis=0)
+    power = 2 * np.abs(spectrum)**2 * dt*1e9 / np.sum(w**2)
+    return np.fft.rfftfreq(n,dt)/1e9, power
+
+def find_peaks(power,peaks=3):
+    ''' Indices of the 'peaks' largest local maxima of a spectrum, leaving out the zero frequency. '''
+    power = np.asarray(power)
+    inner = np.arange(1,len(power)-1)
+    maxima = inner[(power[inner] > power[inner-1]) & (power[inner] >= power[inner+1])]
+    return np.sort(maxima[np.argsort(-power[maxima],kind='stable')][:peaks])
+
+@timing.timed()
+def table_spectrum(table,columns=('mx ()','my ()','mz ()'),detrend='mean',window_kind='hann',filename='table_spectrum'):
+    '''
+    Goal: Calculate the power spectra of the average magnetization in table.txt.
+    Inputs:
+        -table(str): location of table.txt. The longest part with evenly spaced rows is used (see even_segment).
+        -columns([str]): columns of the table to transform.
+        -detrend(str): see detrended().
+        -window_kind(str): see window().
+        -filename(str): custom filename. The spectra are written to filename.txt.
+    Returns a DataFrame with the frequency ('f (GHz)') and the spectrum of every column.
+    '''
+    with timing.span('read table',bytes_read=timing.file_size(table)):
+        df = pd.read_csv(table,sep='\t')
+    rows,dt = even_segment(df.iloc[:,0].to_numpy())
+    tools.logprint(f'Spectrum of table rows {rows.start} to {rows.stop-1}, {dt*1e9:g} ns apart.')
+    f,power = power_spectrum(df[list(columns)].iloc[rows].to_numpy(),dt,detrend,window_kind)
+    spectrum = pd.DataFrame(power,columns=[f'P {column} (1/GHz)' for column in columns])
+    spectrum.insert(0,'f (GHz)',f)
+    spectrum.to_csv(filename+'.txt',sep='\t',index=False)
+    return spectrum
+
+def stack(files,filename,zslice=0):
+    '''
+    Goal: Write frames one by one into a memory-mapped .npy stack, so that time series of cells can be read
+    without loading all frames at once.
+    Inputs:
+        -files([str]): .npy frames of shape [Nx,Ny,Nz,3] in time order.
+        -filename(str): location of the stack.
+        -zslice(int): z layer to keep. None keeps all layers.
+    Returns the stack as a read-only memmap of shape [frames,Nx,Ny,3] (or [frames,Nx,Ny,Nz,3]), float32.
+    '''
+    first = framestore.load(files[0],mmap_mode='r')
+    shape = first.shape[:2] + first.shape[3:] if zslice is not None else first.shape
+    data = np.lib.format.open_memmap(filename,mode='w+',dtype='float32',shape=(len(files),)+shape)
+    for i,file in enumerate(tqdm(files)):
+        frame = framestore.load(file,mmap_mode='r')
+        data[i] = frame[:,:,zslice] if zslice is not None else frame
+    data.flush()
+    timing.add(items=len(files),bytes_written=timing.file_size(filename))
+    del data
+    return np.load(filename,mmap_mode='r')
+
+class CellSpectra:
+    '''
+    Spectra of every cell of a memory-mapped stack, calculated in batches of cells with an FFT along time.
+    '''
+    def __init__(self,data,dt,detrend='mean',window_kind='hann',memory=256e6):
+        '''
+        Inputs:
+            -data(np.array): stack of shape [frames,...,3], e.g. from stack().
+            -dt(float): time between the frames in seconds.
+            -detrend(str): see detrended().
+            -window_kind(str): see window().
+            -memory(float): bytes used per batch, which sets the number of cells in a batch.
+        '''
+        self.data = data
+        self.shape = data.shape[1:]
+        self.columns = data.reshape(len(data),-1)
+        self.dt = dt
+        self.detrend = detrend
+        self.window = window(len(data),window_kind)[:,None]
+        self.frequencies = np.fft.rfftfreq(len(data),dt)/1e9
+        #Every column is held as float64 and as its complex spectrum
+        self.batch = max(int(memory / (len(data)*(8+16))),3)
+        self.batch -= self.batch % 3
+
+    def batches(self):
+        ''' Complex spectra [frequencies,columns] of one batch of columns at a time, with its column range. '''
+        for start in tqdm(range(0,self.columns.shape[1],self.batch)):
+            block = np.asarray(self.columns[:,start:start+self.batch],dtype='float')
+            timing.add(bytes_read=block.size*self.columns.itemsize)
+            yield start, np.fft.rfft(detrended(block,self.detrend)*self.window,axis=0)
+
+    def total_power(self):
+        ''' Power spectral density per GHz summed over all cells, per component: array [frequencies,3]. '''
+        total = np.zeros((len(self.frequencies),3))
+        for start,spectrum in self.batches():
+            power = np.abs(spectrum)**2
+            for c in range(3):
+                #Columns go x,y,z,x,y,z... and batches start at a multiple of 3
+                total[:,c] += power[:,c::3].sum(axis=1)
+        return 2 * total * self.dt*1e9 / np.sum(self.window**2)
+
+    def modes(self,indices):
+        '''
+        Goal: Find the complex amplitude of every cell at the frequency bins 'indices', in one pass.
+        Returns an array [len(indices),...,3]: the magnitude is the amplitude of the oscillation, the angle
+        its phase.
+        '''
+        maps = np.zeros((len(indices),self.columns.shape[1]),dtype='complex64')
+        for start,spectrum in self.batches():
+            maps[:,start:start+spectrum.shape[1]] = spectrum[indices] * 2 / np.sum(self.window)
+        return maps.reshape((len(indices),) + self.shape)
+
+@timing.timed()
+def mode_maps(files,dt,frequencies=None,peaks=3,zslice=0,detrend='mean',window_kind='hann',memory=256e6,
+    keep_stack=False,filename='spectral'):
+    '''
+    Goal: Calculate the spectrum of every cell of a series of evenly spaced frames (e.g. the m*.ovf files of
+    add_static_field with autosave_frames) and map the modes at selected frequencies.
+    Inputs:
+        -files([str]): m*.npy frames in time order.
+        -dt(float): time between the frames in seconds (the autosave time).
+        -frequencies([float]): frequencies in GHz to map. Default is the 'peaks' largest peaks of the spectrum
+            summed over all cells, which takes a second pass over the stack.
+        -peaks(int): number of peaks to map if no frequencies are given.
+        -zslice(int): z layer to analyse. None analyses all layers.
+        -detrend(str): see detrended(). Use 'linear' for a ringdown on top of a slow relaxation.
+        -window_kind(str): see window().
+        -memory(float): bytes used per batch of cells.
+        -keep_stack(bool): keep the stack of frames (filename_stack.npy) for a new call with other frequencies.
+        -filename(str): custom filename. Writes the summed spectrum to filename.txt, the complex mode maps to
+            filename_modes.npy [modes,Nx,Ny,3] with their frequencies in filename_modes.json, and a plot.
+    Returns the summed spectrum (DataFrame) and the mode maps.
+    '''
+    tools.logprint(f'Stacking {len(files)} frames for the spectra of all cells.')
+    stack_file = filename+'_stack.npy'
+    data = stack(files,stack_file,zslice=zslice)
+    spectra = CellSpectra(data,dt,detrend,window_kind,memory)
+    tools.logprint(f'Frequency resolution {spectra.frequencies[1]:.3g} GHz, up to {spectra.frequencies[-1]:.3g} GHz.')
+
+    with timing.span('total power'):
+        total = spectra.total_power()
+    spectrum = pd.DataFrame(total,columns=[f'P {c} (1/GHz)' for c in components])
+    spectrum.insert(0,'f (GHz)',spectra.frequencies)
+    spectrum.to_csv(filename+'.txt',sep='\t',index=False)
+
+    if frequencies is None:
+        indices = find_peaks(total.sum(axis=1),peaks)
+    else:
+        indices = np.unique([np.argmin(np.abs(spectra.frequencies - f)) for f in frequencies])
+    tools.logprint('Mapping modes at ' + ', '.join(f'{f:.3g}' for f in spectra.frequencies[indices]) + ' GHz.')
+    with timing.span('mode maps'):
+        maps = spectra.modes(indices)
+    selected = spectra.frequencies[indices]
+    np.save(filename+'_modes.npy',maps)
+    with open(filename+'_modes.json','w') as file:
+        json.dump({'f (GHz)': selected.tolist(), 'dt (s)': dt, 'zslice': zslice},file,indent=1)
+
+    #The stack can only be removed once nothing maps it any more
+    del data,spectra
+    if not keep_stack: os.remove(stack_file)
+
+    from Modules.Plotting.spectrumplot import spectrumplot
+    spectrumplot(spectrum,maps,selected,filename=filename)
+    return spectrum,maps
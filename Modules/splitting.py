@@ -0,0 +1,233 @@
+"""Split sweeps with independent field points into separate scripts that can run at the same time."""
+import Modules.tools as tools
+import Modules.mx3script as mx3
+from Modules.runner import JobRunner
+import shutil
+import copy
+import re
+import os
+
+#Numbered output of mumax3, e.g. m_full000012.ovf or m000012.jpg
+frame_file = re.compile(r'^(.*?)(\d{6})\.(ovf|jpg|png)$')
+
+def mumax_path(path):
+    ''' Absolute path as a mumax3 string. mumax3 also accepts forward slashes on Windows. '''
+    return os.path.abspath(path).replace('\\','/')
+
+def reset_state(loop):
+    '''
+    Goal: Find the part of a loop body that makes every iteration independent of the one before it: a
+    magnetization reset followed only by relax() and saves, in a field that does not depend on the loop.
+    Returns the nodes that recreate the state at the end of an iteration (field, reset, relax), or None if the
+    iterations are not independent.
+    '''
+    body = [node for node in loop.body if not isinstance(node,mx3.Comment)]
+    resets = [i for i,node in enumerate(body) if isinstance(node,mx3.SetMagnetization)]
+    if not resets or not all(isinstance(node,(mx3.Relax,mx3.Save)) for node in body[resets[-1]+1:]):
+        return None
+    fields = [node for node in body[:resets[-1]] if isinstance(node,mx3.SetField)]
+    if fields and isinstance(fields[-1].value,str):
+        return None
+    return fields[-1:] + [body[resets[-1]],mx3.Relax()]
+
+def find_independent(script):
+    ''' Returns (stage index, node index) of the first loop with independent iterations, or None. '''
+    for s,stage in enumerate(script.stages):
+        for n,node in enumerate(stage.nodes):
+            if isinstance(node,mx3.FieldLoop) and node.iterations() > 1 and reset_state(node) is not None:
+                return s,n
+    return None
+
+class SplitSimulation:
+    '''
+    A simulation whose first sweep with independent field points (e.g. add_field_sweep with relax_zero=True)
+    is divided over several scripts:
+        - <name>_prep.mx3 runs everything before the sweep and saves the state to start from (start.ovf) and
+          the state every later iteration starts from (reset.ovf);
+        - <name>_partNNN.mx3 loads one of these states and runs a chunk of field values;
+        - <name>_tail.mx3 loads the final state of the last part and runs everything after the sweep.
+    After running, the outputs are merged into <name>.out as if the original script had run.
+    '''
+    def __init__(self,simulation,chunk_size=1):
+        '''
+        Inputs:
+            -simulation(MumaxScripter): simulation with its stages added.
+            -chunk_size(int): number of field values per part.
+        '''
+        self.simulation = simulation
+        self.chunk_size = chunk_size
+        self.folder = simulation.project_folder
+        self.name = simulation.name
+        self.scripts = []
+        self.split = find_independent(simulation.script)
+
+    def path(self,suffix):
+        return os.path.join(self.folder,f'{self.name}_{suffix}.mx3')
+
+    def new_script(self,stages):
+        script = mx3.Script()
+        script.sections = copy.deepcopy(self.simulation.script.sections)
+        script.autosave = self.simulation.script.autosave
+        script.autosave_quantities = self.simulation.script.autosave_quantities
+        script.stages = stages
+        return script
+
+    def write(self):
+        '''
+        Goal: Write the prep, part and tail scripts.
+        Returns the list of [prep], [parts] and [tail] script locations, or False if the simulation has no
+        sweep with independent field points.
+        '''
+        if self.split is None:
+            tools.logprint(f'{self.name} has no sweep with independent field points. Nothing to split.')
+            return False
+        s,n = self.split
+        stages = self.simulation.script.stages
+        loop = stages[s].nodes[n]
+        before = copy.deepcopy(stages[:s]) + [mx3.Stage(stages[s].title,copy.deepcopy(stages[s].nodes[:n]))]
+        after = [mx3.Stage(None,copy.deepcopy(stages[s].nodes[n+1:]))] + copy.deepcopy(stages[s+1:])
+        before = [stage for stage in before if stage.nodes]
+        after = [stage for stage in after if stage.nodes]
+
+        prep_out = self.path('prep')[:-4] + '.out'
+        states = mx3.Stage('States to start the parts from',[mx3.Statement('saveas(m,"start")')] + reset_state(loop)
+                           + [mx3.Statement('saveas(m,"reset")')])
+        self.prep = self.path('prep')
+        self._write(self.prep,self.new_script(before + [states]))
+
+        self.parts = []
+        for i,first in enumerate(range(0,loop.iterations(),self.chunk_size)):
+            last = min(first + self.chunk_size,loop.iterations()) - 1
+            start = os.path.join(prep_out,'start.ovf' if first == 0 else 'reset.ovf')
+            chunk = mx3.FieldLoop(loop.axis,loop.value(first),loop.value(last),loop.step,copy.deepcopy(loop.body))
+            self.parts.append(self.path(f'part{i:03d}'))
+            self._write(self.parts[-1],self.new_script([
+                mx3.Stage('Start state',[mx3.Statement(f'm.LoadFile("{mumax_path(start)}")')]),
+                mx3.Stage(f'Field values {mx3.fmt(chunk.first)} to {mx3.fmt(chunk.last)} mT',[chunk]),
+                mx3.Stage(None,[mx3.Statement('saveas(m,"end")')])]))
+
+        self.tail = None
+        if after:
+            end = os.path.join(self.parts[-1][:-4]+'.out','end.ovf')
+            self.tail = self.path('tail')
+            self._write(self.tail,self.new_script([mx3.Stage('Start state',[mx3.Statement(f'm.LoadFile("{mumax_path(end)}")')])] + after))
+
+        tools.logprint(f'Split {self.name} into a prep script, {len(self.parts)} parts of {self.chunk_size} field values' + ' and a tail script.'*(self.tail is not None))
+        return [self.prep],self.parts,[self.tail] if self.tail else []
+
+    def _write(self,path,script):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'w') as file:
+            file.write(script.render())
+        self.scripts.append(path)
+
+    def run(self,concurrency=1,overwrite=False,**kwargs):
+        '''
+        Goal: Run the prep script, then all parts at the same time (at most 'concurrency'), then the tail, and
+        merge the output. kwargs (mumax, gpus, timeout, retries, cache...) are passed to JobRunner.
+        Returns True if everything finished and was merged.
+        '''
+        if not self.scripts and not self.write():
+            return False
+        phases = [[self.prep],self.parts] + ([[self.tail]] if self.tail else [])
+        for scripts in phases:
+            runner = JobRunner(concurrency=concurrency,**kwargs)
+            for script in scripts:
+                runner.submit(script)
+            jobs = runner.run()
+            if any(job.status != 'done' for job in jobs):
+                tools.logprint(f'Not all parts of {self.name} finished. Output is not merged.')
+                return False
+        return self.merge(overwrite=overwrite) is not None
+
+    def merge(self,target=None,overwrite=False):
+        '''
+        Goal: Merge the output folders of the prep, part and tail scripts into one folder.
+        Inputs:
+            -target(str): merged output folder. Default is <name>.out in the project folder.
+            -overwrite(bool): merge into the target folder if it already exists.
+        Returns the target folder, or None if it already exists.
+        '''
+        folders = [script[:-4]+'.out' for script in [self.prep] + self.parts + ([self.tail] if self.tail else [])]
+        target = target or os.path.join(self.folder,self.name+'.out')
+        return merge_outputs(folders,target,overwrite=overwrite)
+
+def merge_outputs(folders,target,overwrite=False,rows=None):
+    '''
+    Goal: Combine the output of simulations that continue each other into one output folder.
+    Inputs:
+        -folders([str]): .out folders in the order they were simulated.
+        -target(str): folder to merge into.
+        -overwrite(bool): merge into the target folder if it already exists.
+        -rows([[int]]): optional table rows to take from every folder (None for all rows). Numbered files are
+            taken when their number is one of these rows, so every row must have saved the same quantities.
+    Numbered files (m_full000000.ovf, m000000.jpg...) are renumbered per quantity in the order of the folders
+    and hard linked (or copied) into the target. The tables are concatenated; the time of every table is
+    shifted to continue from the table before it. The logs are concatenated as well, so that the parameters
+    of the first folder are found first (see DataAnalysis.get_params). Returns the target folder, or None if it already exists.
+    '''
+    import pandas as pd
+    if os.path.exists(target) and not overwrite:
+        tools.logprint(f'{target} already exists. Not merging.')
+        return None
+    os.makedirs(target,exist_ok=True)
+    #Frames of an earlier merge would otherwise be mixed with the new ones.
+    for file in os.listdir(target):
+        if frame_file.match(file): os.remove(os.path.join(target,file))
+
+    counters = {}
+    tables = []
+    logs = []
+    t0 = 0.0
+    for k,folder in enumerate(folders):
+        keep = None if rows is None or rows[k] is None else sorted(rows[k])
+        before = dict(counters)
+        if not os.path.isdir(folder):
+            tools.logprint(f'{folder} does not exist. Skipping it.')
+            continue
+        for file in sorted(os.listdir(folder)):
+            match = frame_file.match(file)
+            if match is None:
+                continue
+            quantity,number,extension = match.groups()
+            key = (quantity,extension)
+            #Every part saves the regions once, before its first table row
+            if quantity == 'regions':
+                if key in counters: continue
+            elif keep is not None and int(number) not in keep:
+                continue
+            destination = os.path.join(target,f'{quantity}{counters.get(key,0):06d}.{extension}')
+            counters[key] = counters.get(key,0) + 1
+            if os.path.exists(destination): os.remove(destination)
+            try:
+                os.link(os.path.join(folder,file),destination)
+            except OSError:
+                shutil.copy2(os.path.join(folder,file),destination)
+
+        log = os.path.join(folder,'log.txt')
+        if os.path.exists(log):
+            with open(log) as file:
+                logs.append(f'//Log of {os.path.basename(folder)}\n' + file.read())
+
+        table = os.path.join(folder,'table.txt')
+        if os.path.exists(table):
+            df = pd.read_csv(table,sep='\t')
+            if keep is not None:
+                df = df.iloc[[row for row in keep if row < len(df)]]
+            if len(df):
+                df[df.columns[0]] = df.iloc[:,0].astype('float') + t0
+                #Counts of saved files (see topology.frame_rows) continue from the folders before
+                for column in df.columns:
+                    if column.startswith('saved '):
+                        key = ('m','jpg') if column == 'saved snapshot ()' else (column[6:-3],'ovf')
+                        df[column] += before.get(key,0)
+                t0 = df.iloc[-1,0]
+                tables.append(df)
+
+    if tables:
+        pd.concat(tables).to_csv(os.path.join(target,'table.txt'),sep='\t',index=False)
+    if logs:
+        with open(os.path.join(target,'log.txt'),'w') as file:
+            file.write(''.join(log if log.endswith('\n') else log+'\n' for log in logs))
+    tools.logprint(f'Merged {len(folders)} outputs into {target}: ' + ', '.join(f'{n} {q}.{e}' for (q,e),n in counters.items()) + '.')
+    return target
@@ -0,0 +1,192 @@
+"""Library of relaxed magnetization states, used as the starting condition of new simulations."""
+import Modules.tools as tools
+import Modules.decodeOVF as decodeOVF
+import numpy as np
+import hashlib
+import json
+import uuid
+import os
+
+main_folder = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+default_folder = os.path.join(main_folder,'StateLibrary')
+
+def describe(simulation):
+    '''
+    Goal: Describe what a relaxed state of a MumaxScripter depends on, apart from the cell size.
+    Returns a dictionary with the geometry (ellipse dimensions or a hash of the mask file), the height and
+    the material.
+    '''
+    if simulation.contacts:
+        with open(os.path.join(simulation.project_folder,simulation.name_maskfile.replace('\\\\','\\')),'rb') as file:
+            geometry = 'mask ' + hashlib.sha256(file.read()).hexdigest()
+    else:
+        geometry = f'ellipse {simulation.D:g}x{simulation.D/simulation.axes_ratio:g}'
+    return {
+        'geometry': geometry,
+        'h': simulation.h,
+        'Msat': simulation.Msat,
+        'Aex': simulation.Aex
+        }
+
+def geometry_mask(simulation):
+    '''
+    Goal: Find the cells of the device layers that are inside the geometry of a MumaxScripter, the way
+    mumax3 defines them: Ellipse() centered in the grid, or ImageShape() stretched over the grid (scaled by
+    mask_scale) with dark pixels inside.
+    Returns a boolean array of shape [Nx,Ny,Nz].
+    '''
+    from PIL import Image
+    Nx,Ny,Nz = simulation.Nx,simulation.Ny,simulation.Nz
+    #Cell centers relative to the center of the grid, as a fraction of the grid size
+    x = ((np.arange(Nx) + 0.5) / Nx - 0.5)[:,None]
+    y = ((np.arange(Ny) + 0.5) / Ny - 0.5)[None,:]
+    if simulation.contacts:
+        sx,sy = simulation.mask_scale or (1,1)
+        image = np.array(Image.open(os.path.join(simulation.project_folder,simulation.name_maskfile.replace('\\\\','\\'))).convert('RGBA'),dtype='int')
+        #mumax3 takes pixels that are not transparent and darker than half grey
+        image = (image[:,:,3] > 0) & (np.sum(image[:,:,:3],axis=2) < 3*255/2)
+        H,W = image.shape
+        u = np.floor((x/sx + 0.5) * W).astype(int)
+        v = np.floor((y/sy + 0.5) * H).astype(int)
+        valid = (u >= 0) & (u < W) & (v >= 0) & (v < H)
+        #Image rows go from top to bottom, y goes up
+        mask = valid & image[H - 1 - np.clip(v,0,H-1),np.clip(u,0,W-1)]
+    else:
+        a = simulation.D / 2 / (Nx*simulation.cell_size)
+        b = int(simulation.D/simulation.axes_ratio) / 2 / (Ny*simulation.cell_size)
+        mask = (x/a)**2 + (y/b)**2 <= 1
+    return np.repeat(mask[:,:,None],Nz,axis=2)
+
+def _interpolate(m,axis,n):
+    ''' Linear interpolation of the cell centers of m along one axis to n cells. '''
+    old = m.shape[axis]
+    if old == n:
+        return m
+    x = np.clip((np.arange(n) + 0.5) * old / n - 0.5,0,old - 1)
+    i = np.floor(x).astype(int)
+    j = np.minimum(i + 1,old - 1)
+    shape = [1]*m.ndim
+    shape[axis] = n
+    w = (x - i).reshape(shape)
+    return np.take(m,i,axis=axis)*(1 - w) + np.take(m,j,axis=axis)*w
+
+def resample(m,shape,mask=None):
+    '''
+    Goal: Resample a magnetization of shape [Nx,Ny,Nz,3] to another grid with linear interpolation and
+    normalize it again.
+    Inputs:
+        -m(np.array): magnetization, zero outside the geometry.
+        -shape((int,int,int)): new grid size.
+        -mask(np.array): cells inside the geometry of the new grid (see geometry_mask). Cells inside it without
+            magnetization (outside the old geometry) get the average direction, cells outside it are set to zero.
+    '''
+    for axis,n in enumerate(shape):
+        m = _interpolate(m,axis,n)
+
+    average = np.sum(m,axis=(0,1,2))
+    average = average / np.linalg.norm(average) if np.linalg.norm(average) > 0 else np.array([1.0,0,0])
+    length = np.linalg.norm(m,axis=3)
+    m[length < 1e-6] = average
+    m = m / np.linalg.norm(m,axis=3,keepdims=True)
+    if mask is not None:
+        m[~mask] = 0
+    return m
+
+def write_state(simulation,m,filename):
+    '''
+    Goal: Write a relaxed state of the same device as the initial state of a simulation.
+    Inputs:
+        -simulation(MumaxScripter): simulation that loads the file.
+        -m(np.array): magnetization of the device layers, on any grid.
+        -filename(str): .ovf file that is written.
+    The state is resampled to the grid of the simulation and masked by its geometry. With stray fields, the
+    empty layers above the device are set to zero.
+    '''
+    m = resample(m,(simulation.Nx,simulation.Ny,simulation.Nz),geometry_mask(simulation))
+    m = np.concatenate([m,np.zeros((simulation.Nx,simulation.Ny,simulation.Nz_empty,3))],axis=2)
+    decodeOVF.packFile(filename,m,simulation.cell_size)
+
+class StateLibrary:
+    '''
+    Relaxed states (at zero field) of earlier simulations, indexed by geometry, material and cell size. A
+    state can be used for any simulation with the same geometry, height and material; the one with the
+    closest cell size is resampled to the new grid.
+    '''
+    def __init__(self,folder=None):
+        '''
+        Inputs:
+            -folder(str): folder with the states and index.json. Default is StateLibrary in the main folder.
+        '''
+        self.folder = folder or default_folder
+        self.index = os.path.join(self.folder,'index.json')
+
+    def read(self):
+        if not os.path.exists(self.index):
+            return {}
+        with open(self.index) as file:
+            return json.load(file)
+
+    def write(self,index):
+        ''' Replace the index in one step, so readers never see half of it. Call it while holding the lock (see add). '''
+        temporary = f'{self.index}.{uuid.uuid4().hex}.tmp'
+        with open(temporary,'w') as file:
+            json.dump(index,file,indent=1)
+        os.replace(temporary,self.index)
+
+    def add(self,simulation,ovf):
+        '''
+        Goal: Store a relaxed state of a simulation in the library.
+        Inputs:
+            -simulation(MumaxScripter): the simulation the state belongs to.
+            -ovf(str): .ovf file with the relaxed magnetization, e.g. ground_state.ovf in its output folder.
+        Returns the key of the state. A state with the same description and cell size is replaced.
+        '''
+        m,_ = decodeOVF.unpackFile(ovf)
+        #Only the device layers are stored, not the empty space above it.
+        m = m[:,:,:simulation.Nz].astype('float32')
+        entry = dict(describe(simulation),cell_size=simulation.cell_size,shape=list(m.shape[:3]),
+                     size=[simulation.Nx*simulation.cell_size,simulation.Ny*simulation.cell_size])
+        key = hashlib.sha256(json.dumps(entry,sort_keys=True).encode()).hexdigest()[:16]
+
+        os.makedirs(self.folder,exist_ok=True)
+        temporary = os.path.join(self.folder,f'{key}.{uuid.uuid4().hex}.npy')
+        np.save(temporary,m)
+        os.replace(temporary,os.path.join(self.folder,key+'.npy'))
+        #Simulations that finish at the same time add their states one at a time.
+        with tools.file_lock(self.index):
+            index = self.read()
+            index[key] = dict(entry,source=os.path.abspath(ovf))
+            self.write(index)
+        tools.logprint(f'Added the relaxed state of {os.path.basename(os.path.dirname(os.path.abspath(ovf)))} to the state library.')
+        return key
+
+    def lookup(self,simulation):
+        '''
+        Key of the compatible state with the cell size closest to that of the simulation, or None. The grid
+        of a compatible state has the same size, up to rounding to whole cells.
+        '''
+        description = describe(simulation)
+        size = (simulation.Nx*simulation.cell_size,simulation.Ny*simulation.cell_size)
+        best = None
+        for key,entry in self.read().items():
+            if any(entry[name] != value for name,value in description.items()):
+                continue
+            if any(abs(a - b) > max(entry['cell_size'],simulation.cell_size) for a,b in zip(entry.get('size',size),size)):
+                continue
+            if not os.path.exists(os.path.join(self.folder,key+'.npy')):
+                continue
+            difference = abs(np.log(entry['cell_size'] / simulation.cell_size))
+            if best is None or difference < best[0]:
+                best = (difference,key)
+        return None if best is None else best[1]
+
+    def initial_state(self,simulation,filename):
+        '''
+        Goal: Write the closest compatible state as the initial state of the simulation (see write_state).
+        Returns the key of the state that was used, or None if the library has no compatible state.
+        '''
+        key = self.lookup(simulation)
+        if key is None:
+            return None
+        write_state(simulation,np.load(os.path.join(self.folder,key+'.npy')),filename)
+        return key
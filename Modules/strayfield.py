@@ -0,0 +1,117 @@
+"""Stray field above the device calculated from saved magnetization, without running mumax3 again."""
+import Modules.tools as tools
+import Modules.framestore as framestore
+from tqdm import tqdm
+import numpy as np
+import os
+
+mu0 = 4e-7*np.pi
+_kernels = {} #Demag kernels, one per grid shape, cell size and set of heights
+
+def kernel(Nx,Ny,Nz,cell_size,heights,cell_average=True):
+    '''
+    Goal: Make (or get from the cache) the Fourier space kernel that maps the magnetization of Nz layers
+    onto the field at the given heights above the top layer.
+    Every layer is treated as a slab of uniform magnetization in z. Its field above the slab is then exact
+    in Fourier space:
+        H_z(k) = (exp(-k*d_top) - exp(-k*d_bottom))/2 * (M_z(k) - i k.M_xy(k)/|k|)
+        H_xy(k) = -i k/|k| * H_z(k)
+    with d the distance to the top and bottom of the slab. The grid is zero padded to twice its size so
+    that the device does not interact with its periodic images.
+    Inputs:
+        -Nx,Ny,Nz(int): grid size of the magnetization.
+        -cell_size(float): width of one pixel in nm.
+        -heights((float)): heights in nm above the top of the grid.
+        -cell_average(bool): average the field over a cell like mumax3 does, instead of taking its value
+            at the cell center.
+    '''
+    key = (Nx,Ny,Nz,float(cell_size),tuple(heights),cell_average)
+    if key in _kernels:
+        return _kernels[key]
+
+    c = cell_size * 1e-9
+    kx = 2*np.pi*np.fft.fftfreq(2*Nx,d=c)[:,None]
+    ky = 2*np.pi*np.fft.rfftfreq(2*Ny,d=c)[None,:]
+    k = np.sqrt(kx**2 + ky**2)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        kx_hat = np.where(k > 0, kx/k, 0)
+        ky_hat = np.where(k > 0, ky/k, 0)
+
+    z = Nz*c + np.array(heights)[:,None,None,None] * 1e-9    #[height,1,1,1]
+    bottom = np.arange(Nz)[None,:,None,None] * c             #[1,layer,1,1]
+    transfer = (np.exp(-k*(z - bottom - c)) - np.exp(-k*(z - bottom))) / 2
+
+    if cell_average:
+        #Source cells are squares and the field is averaged over the target cell.
+        transfer = transfer * (np.sinc(kx*c/(2*np.pi)) * np.sinc(ky*c/(2*np.pi)))**2
+        with np.errstate(invalid='ignore',divide='ignore'):
+            transfer = transfer * np.where(k > 0, np.sinh(k*c/2)/(k*c/2), 1)
+
+    _kernels[key] = (kx_hat,ky_hat,transfer)
+    return _kernels[key]
+
+def stray_field(data,cell_size,heights,Msat=None,cell_average=True):
+    '''
+    Goal: Calculate the stray field B = mu0*H above the device for one frame or a batch of frames.
+    Inputs:
+        -data(np.array): magnetization of shape [Nx,Ny,Nz,3] or [frames,Nx,Ny,Nz,3] in A/m (m_full files).
+        -cell_size(float): width of one pixel in nm.
+        -heights([float]): heights in nm above the top of the grid.
+        -Msat(float): saturation magnetisation. Needed for normalized m files, which are multiplied by it.
+        -cell_average(bool): average the field over a cell like mumax3 does.
+    Returns the field in Tesla with shape [(frames),Nx,Ny,len(heights),3].
+    '''
+    single = np.ndim(data) == 4
+    if single: data = data[None]
+    if Msat is not None: data = data * Msat
+    frames,Nx,Ny,Nz,_ = np.shape(data)
+    kx_hat,ky_hat,transfer = kernel(Nx,Ny,Nz,cell_size,heights,cell_average)
+
+    #Fourier transform every layer in the xy plane: [frames,Nz,2Nx,Ny+1] per component.
+    M = np.fft.rfft2(np.moveaxis(data,3,1),s=(2*Nx,2*Ny),axes=(2,3))
+    charge = M[...,2] - 1j*(kx_hat*M[...,0] + ky_hat*M[...,1])
+    Hz = np.einsum('hlxy,flxy->fhxy',transfer,charge)
+
+    H = np.stack([-1j*kx_hat*Hz, -1j*ky_hat*Hz, Hz],axis=-1)
+    B = mu0 * np.fft.irfft2(H,s=(2*Nx,2*Ny),axes=(2,3))[:,:,:Nx,:Ny]
+    B = np.moveaxis(B,1,3)
+    return B[0] if single else B
+
+def device_top(data):
+    ''' Number of layers up to and including the highest layer that contains magnetization. '''
+    filled = np.nonzero(np.any(data != 0,axis=(0,1,3)))[0]
+    return filled[-1] + 1 if len(filled) else np.shape(data)[2]
+
+def stray_file(datafile):
+    ''' B_stray*.npy filename that belongs to a m*.npy or m_full*.npy file. '''
+    folder,name = os.path.split(datafile)
+    prefix = 'm_full' if name.startswith('m_full') else 'm'
+    return os.path.join(folder,'B_stray' + name[len(prefix):])
+
+def convert_stray_fields(files,cell_size=5.0,layers=None,batch_size=10,Msat=None):
+    '''
+    Goal: Calculate the stray field of m_full*.npy files and save it as B_stray*.npy files.
+    The output has the same layout as the B_demag files of a simulation with stray_fields=True: the layers
+    of the device (left zero, the field inside is not calculated) followed by 'layers' layers of empty space.
+    Inputs:
+        -files([str]): list of m_full*.npy filenames.
+        -cell_size(float): width of one pixel in nm.
+        -layers(int): number of layers above the device. Default is 50 nm of empty space.
+        -batch_size(int): number of frames that are calculated at once.
+        -Msat(float): saturation magnetisation, only needed for normalized m files.
+    '''
+    if layers == None: layers = int(50/cell_size)
+    heights = (np.arange(layers) + 0.5) * cell_size
+    tools.logprint(f'Calculating stray fields of {len(files)} files up to {layers*cell_size} nm above the device.')
+
+    for start in tqdm(range(0,len(files),batch_size)):
+        batch = files[start:start+batch_size]
+        data = np.stack([framestore.load(file) for file in batch])
+        top = max(device_top(frame) for frame in data)
+        data = data[:,:,:,:top]
+
+        B = stray_field(data,cell_size,heights,Msat=Msat)
+        for file,field in zip(batch,B):
+            output = np.zeros((*np.shape(field)[:2],top+layers,3),dtype='float32')
+            output[:,:,top:] = field
+            np.save(stray_file(file),output)
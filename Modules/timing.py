@@ -0,0 +1,150 @@
+"""Lightweight timing of the analysis pipeline: nested spans with durations, bytes and item counts."""
+import Modules.tools as tools
+import contextlib
+import functools
+import threading
+import cProfile
+import pstats
+import json
+import time
+import io
+import os
+
+_local = threading.local()
+_lock = threading.Lock()
+stats = {}      #Totals per span path, e.g. 'convert_ovf_to_npy/decode ovf'
+profiles = {}   #cProfile results per span path
+profiled = set()
+
+def _stack():
+    if not hasattr(_local,'stack'):
+        _local.stack = []
+    return _local.stack
+
+class Span:
+    ''' One timed stage. Counters are added to it with add() while it is open. '''
+    def __init__(self,name,path):
+        self.name = name
+        self.path = path
+        self.counters = {'bytes_read': 0, 'bytes_written': 0, 'items': 0}
+        self.seconds = 0.0
+
+    def add(self,**counters):
+        for key,value in counters.items():
+            self.counters[key] = self.counters.get(key,0) + value
+
+@contextlib.contextmanager
+def span(name,profile=None,**counters):
+    '''
+    Goal: Time a stage of the pipeline. Spans can be nested; their totals are kept per path of names.
+    Inputs:
+        -name(str): name of the stage.
+        -profile(bool): run the stage under cProfile. Default is only if the name was passed to profile().
+        -counters: initial counters, e.g. items=len(files).
+    Use as
+        with timing.span('decode ovf') as s:
+            s.add(bytes_read=size)
+    '''
+    stack = _stack()
+    current = Span(name,'/'.join([s.name for s in stack] + [name]))
+    current.add(**counters)
+    profile = name in profiled if profile is None else profile
+    #Only one profiler can be active at a time.
+    profiler = cProfile.Profile() if profile and not any(getattr(s,'profiler',None) for s in stack) else None
+    current.profiler = profiler
+
+    stack.append(current)
+    start = time.perf_counter()
+    if profiler: profiler.enable()
+    try:
+        yield current
+    finally:
+        if profiler: profiler.disable()
+        current.seconds = time.perf_counter() - start
+        stack.pop()
+        _record(current)
+
+def _record(current):
+    with _lock:
+        total = stats.setdefault(current.path,{'calls': 0, 'seconds': 0.0, 'min (s)': None, 'max (s)': 0.0})
+        total['calls'] += 1
+        total['seconds'] += current.seconds
+        total['min (s)'] = current.seconds if total['min (s)'] is None else min(total['min (s)'],current.seconds)
+        total['max (s)'] = max(total['max (s)'],current.seconds)
+        for key,value in current.counters.items():
+            total[key] = total.get(key,0) + value
+        if current.profiler is not None:
+            if current.path in profiles:
+                profiles[current.path].add(current.profiler)
+            else:
+                profiles[current.path] = pstats.Stats(current.profiler)
+
+def add(**counters):
+    ''' Add counters (bytes_read, bytes_written, items...) to the innermost open span. Ignored outside spans. '''
+    stack = _stack()
+    if stack:
+        stack[-1].add(**counters)
+
+def file_size(filename):
+    ''' Size of a file in bytes, or 0 if it does not exist. '''
+    return os.path.getsize(filename) if os.path.exists(filename) else 0
+
+def timed(name=None):
+    ''' Decorator that runs a function in a span, named after the function by default. '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            with span(name or function.__name__):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def profile(*names):
+    ''' Run every span with one of these names under cProfile. Without names, profiling is turned off. '''
+    profiled.clear()
+    profiled.update(names)
+
+def reset():
+    ''' Forget all recorded spans and profiles. '''
+    with _lock:
+        stats.clear()
+        profiles.clear()
+
+def report():
+    '''
+    Returns the totals per span path: number of calls, total, shortest and longest duration in seconds,
+    bytes read and written, items, and read/write throughput in MB/s.
+    '''
+    with _lock:
+        result = {}
+        for path,total in stats.items():
+            total = dict(total)
+            if total['seconds'] > 0:
+                total['read (MB/s)'] = total['bytes_read'] / total['seconds'] / 1e6
+                total['write (MB/s)'] = total['bytes_written'] / total['seconds'] / 1e6
+            result[path] = total
+        return result
+
+def write_report(folder='.',filename='timing.json',top=20):
+    '''
+    Goal: Write the report of all spans since the last reset() as json, and the cProfile result of every
+    profiled span as '<filename>_<span>.prof' (readable with pstats or snakeviz).
+    Inputs:
+        -folder(str): folder to write to, e.g. the run folder.
+        -filename(str): name of the json file.
+        -top(int): number of functions with the largest cumulative time listed per profiled span in the json.
+    Returns the location of the report.
+    '''
+    result = {'written': time.strftime('%Y-%m-%d %H:%M:%S'), 'spans': report(), 'profiles': {}}
+    for path,profile_stats in profiles.items():
+        prof = os.path.join(folder,f'{os.path.splitext(filename)[0]}_{path.replace("/","-").replace(" ","_")}.prof')
+        profile_stats.dump_stats(prof)
+        text = io.StringIO()
+        pstats.Stats(prof,stream=text).sort_stats('cumulative').print_stats(top)
+        result['profiles'][path] = {'file': prof, 'top': text.getvalue().strip().splitlines()}
+
+    location = os.path.join(folder,filename)
+    with open(location,'w') as file:
+        json.dump(result,file,indent=1)
+    tools.logprint(f'Timing report saved as \'{location}\'.')
+    return location
@@ -1,9 +1,32 @@
-"""Miscellaneous useful functions."""
+"""Miscellaneous useful functions. PIL and tqdm are imported where they are used, so that importing tools is fast."""
 import numpy as np
 import time
 import glob
-from PIL import Image
 import os
+import functools
+import contextlib
+import importlib.util
+import uuid
+import sys
+
+def lazy_import(name):
+    '''
+    Goal: Import a module on first use. Returns the module object right away, but its code only runs when one
+    of its attributes is used. Used for modules that take long to import (pandas, matplotlib, plotting modules).
+    Inputs:
+        -name(str): full name of the module, e.g. 'Modules.Plotting.sweepplot'.
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'No module named {name!r}',name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
 def logprint(string):
     t = time.localtime()
@@ -11,16 +34,84 @@ def logprint(string):
     print(f'{current_time}  {str(string)}')
     #time.sleep(1)
 
+def storage_time(folder):
+    '''
+    Time of the storage that holds 'folder': the modification time of a file touched there. Comparing
+    modification times with it is not affected by clocks that differ between machines (see WorkQueue.now).
+    '''
+    clock = os.path.join(folder,'.clock')
+    with open(clock,'a'):
+        os.utime(clock)
+    return os.path.getmtime(clock)
+
+@contextlib.contextmanager
+def file_lock(path,timeout=60.0,stale=300.0):
+    '''
+    Goal: Hold the lock file path+'.lock' while a block of code runs, so that processes that share a folder
+    (also on other machines) change 'path' one at a time. The lock file is created with O_EXCL.
+    Inputs:
+        -path(str): file to lock.
+        -timeout(float): seconds to wait for the lock before a TimeoutError is raised.
+        -stale(float): a lock file older than this (in storage time) was left by a killed process and is broken.
+    '''
+    lock = path + '.lock'
+    start = time.time()
+    while True:
+        try:
+            os.close(os.open(lock,os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if storage_time(os.path.dirname(os.path.abspath(lock))) - os.path.getmtime(lock) > stale:
+                    _break_lock(lock,stale)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() - start > timeout:
+                raise TimeoutError(f'{lock} is held by another process.')
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+
+def _break_lock(lock,stale):
+    '''
+    Remove a stale lock. It is first moved to a unique name, so only one waiter breaks it. A waiter that looked
+    at the old lock may move a new lock instead; a lock that turns out to be fresh is put back.
+    '''
+    taken = f'{lock}.{uuid.uuid4().hex}.stale'
+    os.rename(lock,taken)
+    if storage_time(os.path.dirname(os.path.abspath(lock))) - os.path.getmtime(taken) > stale:
+        os.remove(taken)
+        return
+    try:
+        #Linking fails instead of replacing a lock that was made in the meantime
+        os.link(taken,lock)
+    except FileExistsError:
+        pass
+    except OSError:
+        #Storage without hard links
+        os.replace(taken,lock)
+        return
+    os.remove(taken)
+
 def find(pattern):
     ''' find file in current directory with name matching 'pattern' '''
     return sorted(glob.glob(pattern))
 
+@functools.lru_cache(maxsize=None)
 def get_resolution(filename):
+    from PIL import Image
     img = Image.open(filename)
     x,y = img.size
     return x,y
 
 def delete(files):
+    from tqdm import tqdm
     tools.logprint('Deleting files after 30 seconds. Press CTRL+C to cancel.')
     for i in tqdm(range(30)):
         time.sleep(1)
@@ -34,14 +125,17 @@ def delete(files):
     logprint('Done removing files.')
 
 def corruption_check(files):
+    ''' Returns the images in 'files' that can be opened. See integrity.scan for a check of whole folders. '''
+    from PIL import Image
+    good = []
     for file in files:
         try:
             img = Image.open(file) # open the image file
             img.verify() # verify that it is, in fact an image
+            good.append(file)
         except (IOError, SyntaxError) as e:
             print('Bad file:', file)
-            files.remove(file)
-    return files
+    return good
 
 def extract_param(logfile,query,append='',title=None,mode='text'):
     with open (logfile, 'rt') as  file:      #Open log.txt for reading
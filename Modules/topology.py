@@ -0,0 +1,177 @@
+"""Topological charge and vortex core detection for all magnetization frames of a simulation."""
+import Modules.tools as tools
+import Modules.framestore as framestore
+from tqdm import tqdm
+import numpy as np
+import pandas as pd
+import re
+import os
+
+number_words = ['Zero','One','Two','Three','Four','Five','Six','Seven','Eight','Nine','Ten']
+
+def normalize(data):
+    ''' Normalize a stack of vectors [...,3]. Cells without magnetization stay zero. '''
+    norm = np.linalg.norm(data,axis=-1,keepdims=True)
+    return np.divide(data,norm,out=np.zeros_like(data,dtype='float'),where=norm>0)
+
+def charge_density(m):
+    '''
+    Goal: Calculate the topological charge density q = m.(dm/dx x dm/dy)/4pi per cell.
+    Inputs:
+        -m(np.array): normalized magnetization of shape [frames,Nx,Ny,3].
+    Returns an array [frames,Nx,Ny] of which the sum over x and y is the topological charge of each frame.
+    '''
+    dmdx = np.gradient(m,axis=1)
+    dmdy = np.gradient(m,axis=2)
+    return np.sum(m * np.cross(dmdx,dmdy),axis=-1) / (4*np.pi)
+
+def winding(m):
+    '''
+    Goal: Calculate the winding number of the in-plane magnetization around every plaquette of four cells.
+    Inputs:
+        -m(np.array): normalized magnetization of shape [frames,Nx,Ny,3].
+    Returns an integer array [frames,Nx-1,Ny-1]: +1 for a vortex, -1 for an antivortex and 0 elsewhere.
+    Plaquettes with a corner outside the device are set to 0.
+    '''
+    phi = np.arctan2(m[...,1],m[...,0])
+    valid = np.any(m != 0,axis=-1)
+
+    #Walk counterclockwise around the plaquette and sum the wrapped angle differences. Antiparallel
+    #neighbours have no defined direction of rotation, so plaquettes containing them are skipped.
+    corners = [phi[:,:-1,:-1], phi[:,1:,:-1], phi[:,1:,1:], phi[:,:-1,1:]]
+    total = 0
+    inside = valid[:,:-1,:-1] & valid[:,1:,:-1] & valid[:,1:,1:] & valid[:,:-1,1:]
+    for a,b in zip(corners, corners[1:] + corners[:1]):
+        difference = np.mod(b - a + np.pi, 2*np.pi) - np.pi
+        inside &= np.abs(difference) < 0.99*np.pi
+        total = total + difference
+    return np.where(inside, np.rint(total/(2*np.pi)), 0).astype('int')
+
+def find_cores(m,cell_size=5.0,w=None):
+    '''
+    Goal: Find the vortex and antivortex cores in a stack of frames.
+    Inputs:
+        -m(np.array): normalized magnetization of shape [frames,Nx,Ny,3].
+        -cell_size(float): width of one pixel in nm.
+        -w(np.array): winding numbers of m, if they were already calculated.
+    Returns arrays with the frame index, x and y position (nm), winding number and polarity of every core.
+    The core position is the center of its plaquette, the polarity the sign of mz averaged over the corners.
+    '''
+    if w is None: w = winding(m)
+    f,i,j = np.nonzero(w)
+    mz = (m[f,i,j,2] + m[f,i+1,j,2] + m[f,i+1,j+1,2] + m[f,i,j+1,2]) / 4
+    return f, (i + 0.5) * cell_size, (j + 0.5) * cell_size, w[f,i,j], np.sign(mz).astype('int')
+
+def state_label(vortices,antivortices=0):
+    ''' Name a state by its number of vortices, e.g. 'Two Vortex'. '''
+    word = lambda n: number_words[n] if n < len(number_words) else str(n)
+    label = f'{word(vortices)} Vortex'
+    if antivortices > 0:
+        label += f', {word(antivortices)} Antivortex'
+    return label
+
+def analyse_frames(files,zslice=0,cell_size=5.0,batch_size=50,first_frame=0):
+    '''
+    Goal: Find the topological charge and the vortex cores of a list of magnetization files.
+    Inputs:
+        -files([str]): list of m*.npy or m_full*.npy filenames.
+        -zslice(int): slice in the z axis to analyse.
+        -cell_size(float): width of one pixel in nm.
+        -batch_size(int): number of frames that are analysed at once.
+        -first_frame(int): frame number of the first file. Used when only new frames are analysed.
+    Returns two DataFrames: one row per frame and one row per vortex core.
+    '''
+    cell_size = float(cell_size)
+    frames = []
+    cores = []
+
+    for start in tqdm(range(0,len(files),batch_size)):
+        batch = files[start:start+batch_size]
+        m = normalize(np.stack([framestore.load(file)[:,:,zslice] for file in batch]))
+
+        Q = np.sum(charge_density(m),axis=(1,2))
+        w = winding(m)
+
+        f,x,y,w_core,polarity_core = find_cores(m,cell_size,w=w)
+        cores.append(pd.DataFrame({
+            'frame': f + start + first_frame,
+            'file': np.array(batch)[f] if len(f) else np.array([],dtype=str),
+            'x (nm)': x,
+            'y (nm)': y,
+            'winding': w_core,
+            'polarity': polarity_core
+            }))
+
+        vortices = np.sum(w == 1,axis=(1,2))
+        antivortices = np.sum(w == -1,axis=(1,2))
+        polarity = np.zeros(len(batch),dtype='int')
+        np.add.at(polarity,f,polarity_core)
+        frames.append(pd.DataFrame({
+            'frame': np.arange(len(batch)) + start + first_frame,
+            'file': batch,
+            'Q ()': Q,
+            'vortices': vortices,
+            'antivortices': antivortices,
+            'polarity': polarity,
+            'state': [state_label(v,a) for v,a in zip(vortices,antivortices)]
+            }))
+
+    return pd.concat(frames,ignore_index=True), pd.concat(cores,ignore_index=True)
+
+def frame_rows(df,files):
+    '''
+    Goal: Find the row of table.txt that every saved frame belongs to. Every relax/run step in a mumax script
+    saves one table row. Without an output policy it saves one frame of every quantity as well, so frame n
+    belongs to row n. With 'every' or 'threshold' (see MumaxScripter.outputs) the script counts the saved
+    files in the column 'saved <quantity> ()' of the table, and frame n belongs to the first row where that
+    count reaches n+1.
+    Inputs:
+        -df(pd.DataFrame): contents of table.txt.
+        -files([str]): numbered files of one quantity (m_full*.npy, B_demag*.ovf, m*.jpg...).
+    Returns an array with the row of every file, -1 for files without a row in the table.
+    '''
+    names = [os.path.basename(file) for file in files]
+    numbers = np.array([int(re.search(r'(\d+)\.\w+$',name).group(1)) for name in names],dtype='int')
+    if len(names) == 0:
+        return numbers
+    quantity = 'snapshot' if names[0].endswith('.jpg') else re.sub(r'\d+\.\w+$','',names[0])
+    #Cropped quantities are saved as e.g. B_demag_zrange10_
+    counted = [column[6:-3] for column in df.columns if column.startswith('saved ') and quantity.startswith(column[6:-3])]
+    if counted:
+        rows = np.searchsorted(df[f'saved {max(counted,key=len)} ()'].to_numpy(),numbers+1)
+    else:
+        rows = numbers
+    return np.where(rows < len(df),rows,-1)
+
+def join_table(frames,table):
+    '''
+    Goal: Add the per-frame results to the rows of table.txt that the frames were saved with (see frame_rows).
+    Frames without a row are left out.
+    '''
+    df = pd.read_csv(table,sep='	')
+    rows = frame_rows(df,list(frames['file']))
+    if np.any(rows < 0) or (len(df) != len(frames) and not any(column.startswith('saved ') for column in df.columns)):
+        tools.logprint(f'WARNING: table.txt has {len(df)} rows but there are {len(frames)} frames. Only {np.sum(rows >= 0)} frames are matched.')
+    keep = rows >= 0
+    return pd.concat([df.iloc[rows[keep]].reset_index(drop=True), frames[keep].reset_index(drop=True)],axis=1)
+
+def topology(files,table=None,zslice=0,cell_size=5.0,batch_size=50,filename='topology'):
+    '''
+    Goal: Label the magnetic state of every frame by its vortex content.
+    Inputs:
+        -files([str]): list of m*.npy or m_full*.npy filenames.
+        -table(str): location of table.txt. If given, the results are joined with the table rows.
+        -zslice(int): slice in the z axis to analyse.
+        -cell_size(float): width of one pixel in nm.
+        -batch_size(int): number of frames that are analysed at once.
+        -filename(str): custom filename. Frames are written to filename.txt, cores to filename_cores.txt.
+    '''
+    tools.logprint(f'Detecting vortex cores in {len(files)} frames.')
+    frames,cores = analyse_frames(files,zslice=zslice,cell_size=cell_size,batch_size=batch_size)
+    if table is not None:
+        frames = join_table(frames,table)
+
+    frames.to_csv(filename+'.txt',sep='	',index=False)
+    cores.to_csv(filename+'_cores.txt',sep='	',index=False)
+    tools.logprint(f'Found states: ' + ', '.join(f'{state} ({n})' for state,n in frames['state'].value_counts().items()))
+    return frames
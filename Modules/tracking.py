@@ -0,0 +1,199 @@
+"""Link vortex cores and domain walls of consecutive frames into trajectories."""
+import Modules.tools as tools
+import Modules.topology as tp
+import Modules.framestore as framestore
+from tqdm import tqdm
+import numpy as np
+import pandas as pd
+import json
+import os
+
+def wall_positions(m,cell_size=5.0):
+    '''
+    Goal: Find domain walls along the long (x) axis of the device.
+    Inputs:
+        -m(np.array): normalized magnetization of shape [frames,Nx,Ny,3].
+        -cell_size(float): width of one pixel in nm.
+    Returns arrays with the frame index and x position (nm) of every wall. A wall is where mx, averaged over
+    the device cells in each column, changes sign. The position is interpolated between the two columns.
+    '''
+    valid = np.any(m != 0,axis=-1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        mx = np.sum(m[...,0],axis=2) / np.sum(valid,axis=2)
+    columns = np.sum(valid,axis=2) > 0
+    mx = np.where(columns,mx,np.nan)
+
+    f,i = np.nonzero(np.sign(mx[:,:-1]) * np.sign(mx[:,1:]) < 0)
+    a,b = mx[f,i],mx[f,i+1]
+    return f, (i + a/(a-b)) * cell_size
+
+def link(previous,current,max_distance):
+    '''
+    Goal: Match points of the previous frame to points of the current frame, closest pairs first.
+    Inputs:
+        -previous,current(np.array): positions of shape [n,2].
+        -max_distance(float): pairs further apart than this are never matched.
+    Returns a list of (previous index, current index) pairs.
+    '''
+    if len(previous) == 0 or len(current) == 0:
+        return []
+    distance = np.linalg.norm(previous[:,None,:] - current[None,:,:],axis=-1)
+    pairs = []
+    used_previous,used_current = set(),set()
+    for k in np.argsort(distance,axis=None):
+        p,c = np.unravel_index(k,distance.shape)
+        if distance[p,c] > max_distance:
+            break
+        if p in used_previous or c in used_current:
+            continue
+        pairs.append((p,c))
+        used_previous.add(p)
+        used_current.add(c)
+    return pairs
+
+class Tracker:
+    '''
+    Tracks vortices, antivortices and domain walls over the frames of one simulation. The state of all
+    tracks is kept in a json file, so that a new call only analyses frames that were not seen before.
+    '''
+    def __init__(self,zslice=0,cell_size=5.0,max_distance=50.0,table=None,filename='tracking'):
+        '''
+        Inputs:
+            -zslice(int): slice in the z axis to analyse.
+            -cell_size(float): width of one pixel in nm.
+            -max_distance(float): largest distance in nm that a core or wall can move between two frames.
+            -table(str): location of table.txt. Used for the time of every frame if the simulation saved it.
+            -filename(str): custom filename. Writes filename.json (state), filename.txt (trajectories) and
+                filename_events.txt (nucleation and annihilation events).
+        '''
+        self.zslice = zslice
+        self.cell_size = float(cell_size)
+        self.max_distance = max_distance
+        self.table = table
+        self.filename = filename
+
+        if os.path.exists(self.filename+'.json'):
+            with open(self.filename+'.json') as file:
+                self.state = json.load(file)
+        else:
+            self.state = {'frames': [], 'next_id': 0, 'active': []}
+
+    def frame_times(self,files):
+        '''
+        Time of the frames in 'files' in seconds, from the table rows they were saved with (see
+        topology.frame_rows), or None if the table has no time information. During a run the table can lag
+        behind the frames; then only the times of the frames up to the first one without a row are returned.
+        '''
+        if self.table is None or not os.path.exists(self.table):
+            return None
+        df = pd.read_csv(self.table,sep='	')
+        time = df.iloc[:,0].to_numpy()
+        if np.sum(time) == 0:
+            return None
+        rows = tp.frame_rows(df,files)
+        if np.any(rows < 0):
+            rows = rows[:np.argmax(rows < 0)]
+        return time[rows]
+
+    def update(self,files,batch_size=50):
+        '''
+        Goal: Analyse the frames in 'files' that were not tracked before and extend the trajectories.
+        Inputs:
+            -files([str]): ordered list of all m*.npy or m_full*.npy filenames of the simulation.
+            -batch_size(int): number of frames that are loaded at once.
+        Returns the newly added trajectory points and events as two DataFrames.
+        '''
+        first = len(self.state['frames'])
+        new_files = files[first:]
+        if new_files == []:
+            tools.logprint('No new frames to track.')
+            return pd.DataFrame(),pd.DataFrame()
+        times = self.frame_times(new_files)
+        if 'time_unit' not in self.state:
+            self.state['time_unit'] = 's' if times is not None else 'step'
+        if self.state['time_unit'] == 'step':
+            times = np.arange(first,first+len(new_files),dtype='float')
+        elif times is None or len(times) < len(new_files):
+            #Mixing seconds and frame numbers would make the velocities meaningless
+            available = 0 if times is None else len(times)
+            tools.logprint(f'No time in the table for {len(new_files)-available} of the new frames yet. They are tracked in a later call.')
+            new_files = new_files[:available]
+            if new_files == []:
+                return pd.DataFrame(),pd.DataFrame()
+        tools.logprint(f'Tracking {len(new_files)} new frames.')
+        velocity_unit = '(m/s)' if self.state['time_unit'] == 's' else '(nm/step)'
+        scale = 1e-9 if self.state['time_unit'] == 's' else 1.0
+
+        points,events = [],[]
+        for start in tqdm(range(0,len(new_files),batch_size)):
+            batch = new_files[start:start+batch_size]
+            m = tp.normalize(np.stack([framestore.load(file)[:,:,self.zslice] for file in batch]))
+            f_core,x_core,y_core,w_core,_ = tp.find_cores(m,self.cell_size)
+            f_wall,x_wall = wall_positions(m,self.cell_size)
+            kinds = np.concatenate([np.where(w_core > 0,'vortex','antivortex'),np.full(len(f_wall),'wall')])
+            frames = np.concatenate([f_core,f_wall])
+            x = np.concatenate([x_core,x_wall])
+            y = np.concatenate([y_core,np.full(len(f_wall),np.nan)])
+
+            for k in range(len(batch)):
+                frame = first + start + k
+                t = times[start + k]
+                here = np.nonzero(frames == k)[0]
+                self.step(frame,batch[k],t,kinds[here],x[here],y[here],points,events,scale)
+
+        self.state['frames'] += new_files
+        points = pd.DataFrame(points,columns=['track','kind','frame','file','t','x (nm)','y (nm)',f'vx {velocity_unit}',f'vy {velocity_unit}'])
+        events = pd.DataFrame(events,columns=['track','kind','frame','event','x (nm)','y (nm)'])
+        self.write(points,events)
+        tools.logprint(f'{len(points)} trajectory points and {len(events)} events added.')
+        return points,events
+
+    def step(self,frame,file,t,kinds,x,y,points,events,scale):
+        ''' Link the detections of one frame to the active tracks. '''
+        active = self.state['active']
+        continued = []
+        matched = set()
+        for kind in ('vortex','antivortex','wall'):
+            old = [track for track in active if track['kind'] == kind]
+            new = np.nonzero(kinds == kind)[0]
+            #Walls are only tracked along x
+            dims = 1 if kind == 'wall' else 2
+            previous = np.array([[track['x'],track['y']][:dims] for track in old]).reshape(-1,dims)
+            current = np.stack([x[new],y[new]],axis=1)[:,:dims]
+
+            for p,c in link(previous,current,self.max_distance):
+                track = old[p]
+                dt = t - track['t']
+                vx = (x[new[c]] - track['x']) / dt * scale if dt != 0 else np.nan
+                vy = (y[new[c]] - track['y']) / dt * scale if dt != 0 else np.nan
+                track.update({'frame': frame, 't': t, 'x': float(x[new[c]]), 'y': float(y[new[c]])})
+                continued.append(track)
+                matched.add(new[c])
+                points.append([track['id'],kind,frame,file,t,x[new[c]],y[new[c]],vx,vy])
+
+        for track in active:
+            if track not in continued:
+                events.append([track['id'],track['kind'],frame,'annihilation',track['x'],track['y']])
+
+        for n in range(len(kinds)):
+            if n in matched:
+                continue
+            track = {'id': self.state['next_id'], 'kind': str(kinds[n]), 'frame': frame, 't': t,
+                     'x': float(x[n]), 'y': float(y[n])}
+            self.state['next_id'] += 1
+            continued.append(track)
+            points.append([track['id'],track['kind'],frame,file,t,x[n],y[n],np.nan,np.nan])
+            #Everything present in the very first frame is the starting state, not a nucleation.
+            if frame > 0:
+                events.append([track['id'],track['kind'],frame,'nucleation',x[n],y[n]])
+
+        self.state['active'] = continued
+
+    def write(self,points,events):
+        ''' Append new points and events to the output files and save the tracker state. '''
+        for df,name in [(points,self.filename+'.txt'),(events,self.filename+'_events.txt')]:
+            new_file = not os.path.exists(name)
+            df.to_csv(name,sep='	',index=False,mode='w' if new_file else 'a',header=new_file)
+
+        with open(self.filename+'.json','w') as file:
+            json.dump(self.state,file)
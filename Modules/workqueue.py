@@ -0,0 +1,467 @@
+"""
+Queue of mumax3 scripts in a shared folder, run by workers on any number of machines.
+
+A queue is a folder on storage that all machines mount, with a subfolder per state:
+    pending/<job>.json      jobs waiting for a worker, claimed in order of their name (submission time)
+    claimed/<job>.json      jobs that a worker is running
+    done/<job>.json         records of finished jobs (status, exit code, time, worker, output folder)
+    failed/<job>.json       records of jobs that failed, timed out or whose workers kept dying
+    locks/<job>.lock        owner of a claimed job; its modification time is the heartbeat of the worker
+    workers/<worker>.json   last heartbeat and running jobs of every worker
+
+Usage (from the main folder):
+    python -m Modules.workqueue submit <queue> <script.mx3> [--timeout s] [--retries n]
+    python -m Modules.workqueue worker <queue> [--concurrency n] [--gpus 0 1] [--mumax path] [--idle-exit s]
+    python -m Modules.workqueue status <queue>
+    python -m Modules.workqueue requeue <queue> [--failed]
+Scripts must be on the shared storage, as mumax3 writes the output folder next to the script. On Linux a
+simulation is killed when its worker dies, also by SIGKILL; on other systems it keeps running until it ends,
+while its job is requeued to another worker.
+"""
+import Modules.tools as tools
+from Modules.runner import JobRunner
+import argparse
+import asyncio
+import socket
+import json
+import time
+import uuid
+import sys
+import os
+
+states = ('pending','claimed','done','failed')
+
+def _write_json(path,data):
+    ''' Write json so that readers on other machines never see a half written file. '''
+    temporary = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(temporary,'w') as file:
+        json.dump(data,file,indent=1)
+    os.replace(temporary,path)
+
+def _read_json(path):
+    ''' Contents of a json file, or None if it does not exist (any more). '''
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError,ValueError):
+        return None
+
+class WorkQueue:
+    '''
+    Jobs in a shared folder. Every operation is a single atomic step on the file system: a job is claimed by
+    creating its lock file exclusively (O_EXCL) and then moving it from pending to claimed, so two workers can
+    never claim the same job. Workers touch the locks of their jobs as a heartbeat; jobs whose lock is older
+    than 'stale' seconds belonged to a worker that died and are put back in pending by any other worker.
+    '''
+    def __init__(self,folder,stale=None,max_claims=None):
+        '''
+        Inputs:
+            -folder(str): queue folder. It is made if it does not exist.
+            -stale(float): seconds without heartbeat after which a job is requeued. Stored in queue.json when
+                the queue is made, so that all workers agree. Default 300.
+            -max_claims(int): number of times a job may be claimed before it is failed, so a script that
+                crashes its workers does not keep the farm busy. Stored in queue.json. Default 3.
+        '''
+        self.folder = os.path.abspath(folder)
+        for state in states + ('locks','workers'):
+            os.makedirs(os.path.join(self.folder,state),exist_ok=True)
+        config = _read_json(os.path.join(self.folder,'queue.json')) or {}
+        if not config or stale is not None or max_claims is not None:
+            config = {'stale': stale or config.get('stale',300.0), 'max_claims': max_claims or config.get('max_claims',3)}
+            _write_json(os.path.join(self.folder,'queue.json'),config)
+        self.stale = config['stale']
+        self.max_claims = config['max_claims']
+
+    def path(self,state,job_id):
+        return os.path.join(self.folder,state,job_id+'.json')
+
+    def lock(self,job_id):
+        return os.path.join(self.folder,'locks',job_id+'.lock')
+
+    def now(self):
+        '''
+        Time of the shared storage. Heartbeats are modification times set by the storage, so comparing them
+        with this time is not affected by clocks that differ between machines.
+        '''
+        clock = os.path.join(self.folder,'.clock')
+        with open(clock,'a'):
+            os.utime(clock)
+        return os.path.getmtime(clock)
+
+    def jobs(self,state):
+        ''' Names of the jobs in a state, in order of submission. '''
+        return sorted(file[:-5] for file in os.listdir(os.path.join(self.folder,state)) if file.endswith('.json'))
+
+    def submit(self,script,timeout=None,retries=0,plan=None):
+        '''
+        Goal: Add a script to the queue.
+        Inputs:
+            -script(str): location of the .mx3 file on the shared storage.
+            -timeout(float): seconds after which the simulation is killed. None means no limit.
+            -retries(int): how often the worker starts a failed simulation again.
+            -plan([(str,int)]): table rows per stage (monitor.stage_plan), for the progress of the worker.
+        Returns the name of the job.
+        '''
+        script = os.path.abspath(script)
+        name = os.path.splitext(os.path.basename(script))[0]
+        job_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{name}-{uuid.uuid4().hex[:6]}'
+        _write_json(self.path('pending',job_id),{'id': job_id, 'script': script, 'timeout': timeout,
+            'retries': retries, 'plan': plan, 'submitted': time.strftime('%Y-%m-%d %H:%M:%S'), 'claims': 0})
+        return job_id
+
+    def claim(self,worker):
+        ''' Claim the oldest pending job for 'worker'. Returns the job, or None if nothing is pending. '''
+        for job_id in self.jobs('pending'):
+            try:
+                descriptor = os.open(self.lock(job_id),os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(descriptor,'w') as file:
+                json.dump({'worker': worker},file)
+            try:
+                os.rename(self.path('pending',job_id),self.path('claimed',job_id))
+            except FileNotFoundError:
+                #Claimed and finished by another worker between listing and locking
+                os.remove(self.lock(job_id))
+                continue
+            job = _read_json(self.path('claimed',job_id))
+            job['claims'] = job.get('claims',0) + 1
+            job['worker'] = worker
+            _write_json(self.path('claimed',job_id),job)
+            return job
+        return None
+
+    def owner(self,job_id):
+        ''' Worker that holds the lock of a job, or None. '''
+        lock = _read_json(self.lock(job_id))
+        return lock['worker'] if lock else None
+
+    def heartbeat(self,job_id,worker):
+        ''' Renew the lock of a job. Returns False if the worker no longer owns the job. '''
+        if self.owner(job_id) != worker:
+            return False
+        try:
+            os.utime(self.lock(job_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def take(self,job_id,worker):
+        '''
+        Move the lock of a job owned by 'worker' out of the way, like requeue_stale does, so that this worker
+        alone handles the job from then on. Returns the moved lock, or None if the worker does not own the job.
+        '''
+        if self.owner(job_id) != worker:
+            return None
+        taken = f'{self.lock(job_id)}.{uuid.uuid4().hex}.taken'
+        try:
+            os.rename(self.lock(job_id),taken)
+        except FileNotFoundError:
+            return None
+        if (_read_json(taken) or {}).get('worker') != worker:
+            #Requeued and claimed by another worker since the check above
+            os.rename(taken,self.lock(job_id))
+            return None
+        return taken
+
+    def finish(self,job,record,worker):
+        '''
+        Goal: Write the record of a job to done or failed and remove its claim.
+        Returns False (and writes nothing) if the job was requeued to another worker in the meantime.
+        '''
+        taken = self.take(job['id'],worker)
+        if taken is None:
+            return False
+        state = 'done' if record['status'] == 'done' else 'failed'
+        _write_json(self.path(state,job['id']),record)
+        try:
+            os.remove(self.path('claimed',job['id']))
+        except FileNotFoundError:
+            pass
+        os.remove(taken)
+        return True
+
+    def release(self,job,worker):
+        ''' Put a claimed job back in pending, e.g. when its worker is stopped. '''
+        taken = self.take(job['id'],worker)
+        if taken is None:
+            return False
+        job = dict(job,claims=job['claims']-1)
+        job.pop('worker',None)
+        _write_json(self.path('claimed',job['id']),job)
+        os.rename(self.path('claimed',job['id']),self.path('pending',job['id']))
+        os.remove(taken)
+        return True
+
+    def requeue_stale(self):
+        '''
+        Goal: Put the jobs of workers that stopped sending heartbeats back in pending, or fail them if they were
+        claimed max_claims times. Safe to call from any number of workers at once.
+        Returns the names of the requeued jobs.
+        '''
+        now = self.now()
+        requeued = []
+        for file in os.listdir(os.path.join(self.folder,'locks')):
+            if not file.endswith('.lock'):
+                self._restore(file,now)
+                continue
+            lock = os.path.join(self.folder,'locks',file)
+            try:
+                if now - os.path.getmtime(lock) < self.stale:
+                    continue
+                #Only one worker can move the lock away, and it then handles the job alone.
+                taken = f'{lock}.{uuid.uuid4().hex}.stale'
+                os.rename(lock,taken)
+            except FileNotFoundError:
+                continue
+            owner = (_read_json(taken) or {}).get('worker')
+            job_id = file[:-5]
+            job = _read_json(self.path('claimed',job_id))
+            if job is not None:
+                job.pop('worker',None)
+                reason = f'worker {owner} stopped sending heartbeats'
+                if job['claims'] >= self.max_claims:
+                    _write_json(self.path('failed',job_id),dict(job,status='failed',reason=f'{reason} ({job["claims"]} claims)'))
+                    os.remove(self.path('claimed',job_id))
+                else:
+                    _write_json(self.path('claimed',job_id),dict(job,requeued=reason))
+                    os.rename(self.path('claimed',job_id),self.path('pending',job_id))
+                    requeued.append(job_id)
+                tools.logprint(f'Job {job_id}: {reason}. ' + ('Requeued.' if job_id in requeued else 'Failed.'))
+            os.remove(taken)
+
+        #Status files of workers that died
+        for file in os.listdir(os.path.join(self.folder,'workers')):
+            path = os.path.join(self.folder,'workers',file)
+            try:
+                if file.endswith('.json') and now - os.path.getmtime(path) > self.stale:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+        return requeued
+
+    def _restore(self,file,now):
+        '''
+        A lock that was moved by take() or requeue_stale() and is still there after 'stale' seconds belongs to a
+        worker that died halfway. If the job is still claimed, the lock is put back, so that the job is
+        requeued; otherwise it is removed.
+        '''
+        if not file.endswith(('.taken','.stale')):
+            return
+        path = os.path.join(self.folder,'locks',file)
+        job_id = file.split('.lock.')[0]
+        try:
+            if now - os.path.getmtime(path) < self.stale:
+                return
+            if os.path.exists(self.path('claimed',job_id)):
+                os.rename(path,self.lock(job_id))
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def retry_failed(self):
+        ''' Put all failed jobs back in pending. Returns their names. '''
+        jobs = self.jobs('failed')
+        for job_id in jobs:
+            record = _read_json(self.path('failed',job_id))
+            job = {key: record[key] for key in ('id','script','timeout','retries','plan','submitted') if key in record}
+            _write_json(self.path('pending',job_id),dict(job,claims=0))
+            os.remove(self.path('failed',job_id))
+        return jobs
+
+    def status(self):
+        '''
+        Returns a dictionary with the number of jobs per state, the running jobs with their worker and seconds
+        since its last heartbeat, and the workers with the seconds since their last heartbeat.
+        '''
+        now = self.now()
+        result = {state: len(self.jobs(state)) for state in states}
+        result['running'] = []
+        for job_id in self.jobs('claimed'):
+            try: age = now - os.path.getmtime(self.lock(job_id))
+            except FileNotFoundError: age = None
+            result['running'].append({'id': job_id, 'worker': self.owner(job_id), 'heartbeat (s)': age})
+        result['workers'] = []
+        for file in sorted(os.listdir(os.path.join(self.folder,'workers'))):
+            if file.endswith('.json'):
+                path = os.path.join(self.folder,'workers',file)
+                worker = _read_json(path)
+                if worker:
+                    worker['heartbeat (s)'] = now - os.path.getmtime(path)
+                    result['workers'].append(worker)
+        return result
+
+class Worker:
+    '''
+    Claims jobs from a WorkQueue and runs them with a JobRunner, at most 'concurrency' at a time, until it is
+    stopped or the queue stays empty for idle_exit seconds.
+    '''
+    def __init__(self,queue,concurrency=1,mumax=None,args=(),gpus=None,heartbeat=30.0,poll=5.0,idle_exit=None,
+        max_jobs=None,cache=None,monitor=False,verbose=True):
+        '''
+        Inputs:
+            -queue(str,WorkQueue): queue folder.
+            -concurrency(int): largest number of simulations that run at the same time on this machine.
+            -mumax(str): mumax3 executable. Default is $MUMAX3 or 'mumax3'.
+            -args([str]): extra command line arguments for mumax3.
+            -gpus([int]): GPUs to divide the simulations over, see JobRunner.
+            -heartbeat(float): seconds between heartbeats. Must be well below the stale time of the queue.
+            -poll(float): seconds between looks at an empty queue.
+            -idle_exit(float): stop after the queue was empty for this many seconds. None runs forever.
+            -max_jobs(int): stop after claiming this many jobs.
+            -cache(ResultCache): cache of finished simulations, see JobRunner.
+            -monitor(bool,dict): follow the table of running simulations, see JobRunner.
+            -verbose(bool): print log messages.
+        '''
+        self.queue = queue if isinstance(queue,WorkQueue) else WorkQueue(queue)
+        self.id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self.concurrency = concurrency
+        self.runner_options = {'mumax': mumax, 'args': args, 'cache': cache, 'monitor': monitor, 'verbose': verbose}
+        self.gpus = gpus or [None]
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.idle_exit = idle_exit
+        self.max_jobs = max_jobs
+        self.verbose = verbose
+        self.claimed = 0
+        self.finished = {'done': 0, 'failed': 0}
+        self.running = {}   #job name: asyncio task
+        self.lost = set()   #jobs that were requeued to another worker while they ran here
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    def logprint(self,string):
+        if self.verbose: tools.logprint(string)
+
+    def write_status(self):
+        _write_json(os.path.join(self.queue.folder,'workers',self.id+'.json'),{'worker': self.id,
+            'host': socket.gethostname(), 'pid': os.getpid(), 'started': self.started,
+            'running': sorted(self.running), **self.finished})
+
+    async def _run(self,job,gpu):
+        ''' Run one claimed job and write its record back to the queue. '''
+        runner = JobRunner(concurrency=1,gpus=[gpu] if gpu is not None else None,timeout=job['timeout'],
+                           retries=job['retries'],**self.runner_options)
+        plan = [tuple(stage) for stage in job['plan']] if job.get('plan') else None
+        simulation = runner.submit(job['script'],plan=plan)
+        self.logprint(f'Worker {self.id} claimed {job["id"]}.')
+        try:
+            await runner.run_async()
+        except asyncio.CancelledError:
+            #Stopped: give the job back, unless it was already given to another worker.
+            if self.queue.release(job,self.id):
+                self.logprint(f'Job {job["id"]} put back in the queue.')
+            raise
+        record = dict(job,status=simulation.status,returncode=simulation.returncode,reason=simulation.reason,
+                      attempts=simulation.attempts,elapsed=simulation.elapsed,output=simulation.output,
+                      log=simulation.log,metrics=simulation.metrics,host=socket.gethostname(),
+                      finished=time.strftime('%Y-%m-%d %H:%M:%S'))
+        if self.queue.finish(job,record,self.id):
+            self.finished['done' if simulation.status == 'done' else 'failed'] += 1
+            self.logprint(f'Job {job["id"]} {simulation.status}.')
+        else:
+            self.logprint(f'Job {job["id"]} was requeued while it ran here. Its result is not recorded.')
+
+    async def _slot(self,gpu):
+        ''' Claim and run jobs one after the other. '''
+        idle_since = time.time()
+        while self.max_jobs is None or self.claimed < self.max_jobs:
+            job = self.queue.claim(self.id)
+            if job is None:
+                if self.idle_exit is not None and not self.running and time.time() - idle_since > self.idle_exit:
+                    return
+                await asyncio.sleep(self.poll)
+                continue
+            self.claimed += 1
+            task = asyncio.ensure_future(self._run(job,gpu))
+            self.running[job['id']] = task
+            self.write_status()
+            try:
+                await task
+            except asyncio.CancelledError:
+                #Only a job lost to another worker is cancelled on its own; otherwise the worker is stopped.
+                if job['id'] not in self.lost:
+                    raise
+            finally:
+                self.running.pop(job['id'],None)
+                self.write_status()
+            idle_since = time.time()
+
+    async def _heartbeats(self):
+        ''' Renew the locks of the running jobs and requeue the jobs of dead workers. '''
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            for job_id,task in list(self.running.items()):
+                if not self.queue.heartbeat(job_id,self.id):
+                    self.logprint(f'Lost job {job_id} to another worker. Stopping it here.')
+                    self.lost.add(job_id)
+                    task.cancel()
+            self.write_status()
+            self.queue.requeue_stale()
+
+    async def run_async(self):
+        ''' Run jobs until the queue stays empty (idle_exit) or max_jobs were claimed. '''
+        self.logprint(f'Worker {self.id} started on queue {self.queue.folder} with {self.concurrency} slots.')
+        self.queue.requeue_stale()
+        self.write_status()
+        heartbeats = asyncio.ensure_future(self._heartbeats())
+        slots = [asyncio.ensure_future(self._slot(self.gpus[i % len(self.gpus)])) for i in range(self.concurrency)]
+        try:
+            await asyncio.gather(*slots)
+        finally:
+            #Wait until every slot has put its job back before the worker is gone
+            for task in slots + [heartbeats]:
+                task.cancel()
+            await asyncio.gather(*slots,heartbeats,return_exceptions=True)
+            os.remove(os.path.join(self.queue.folder,'workers',self.id+'.json'))
+            self.logprint(f'Worker {self.id} stopped: {self.finished["done"]} done, {self.finished["failed"]} failed.')
+
+    def run(self):
+        ''' Run the worker in this process until it stops. Ctrl+C puts the running jobs back in the queue. '''
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            pass
+        return self.finished
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Queue of mumax3 scripts in a shared folder.')
+    commands = parser.add_subparsers(dest='command',required=True)
+    submit = commands.add_parser('submit',help='add scripts to the queue')
+    submit.add_argument('queue')
+    submit.add_argument('scripts',nargs='+')
+    submit.add_argument('--timeout',type=float,default=None)
+    submit.add_argument('--retries',type=int,default=0)
+    worker = commands.add_parser('worker',help='run jobs from the queue')
+    worker.add_argument('queue')
+    worker.add_argument('--concurrency',type=int,default=1)
+    worker.add_argument('--gpus',type=int,nargs='+',default=None)
+    worker.add_argument('--mumax',default=None)
+    worker.add_argument('--heartbeat',type=float,default=30.0)
+    worker.add_argument('--poll',type=float,default=5.0)
+    worker.add_argument('--idle-exit',type=float,default=None)
+    worker.add_argument('--max-jobs',type=int,default=None)
+    worker.add_argument('--monitor',action='store_true')
+    status = commands.add_parser('status',help='show the jobs and workers')
+    status.add_argument('queue')
+    requeue = commands.add_parser('requeue',help='requeue the jobs of dead workers')
+    requeue.add_argument('queue')
+    requeue.add_argument('--failed',action='store_true',help='also put failed jobs back in the queue')
+    args = parser.parse_args(argv)
+
+    queue = WorkQueue(args.queue)
+    if args.command == 'submit':
+        for script in args.scripts:
+            print(queue.submit(script,timeout=args.timeout,retries=args.retries))
+    elif args.command == 'worker':
+        Worker(queue,concurrency=args.concurrency,mumax=args.mumax,gpus=args.gpus,heartbeat=args.heartbeat,
+               poll=args.poll,idle_exit=args.idle_exit,max_jobs=args.max_jobs,monitor=args.monitor).run()
+    elif args.command == 'status':
+        print(json.dumps(queue.status(),indent=1))
+    elif args.command == 'requeue':
+        jobs = queue.requeue_stale() + (queue.retry_failed() if args.failed else [])
+        print(f'{len(jobs)} jobs requeued.')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""Shared helpers of the tests, which run mumax3 scripts with a stub (stub_mumax3.py) instead of mumax3."""
+import pytest
+import sys
+import os
+
+main_folder = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+stub = os.path.join(main_folder,'Tests','stub_mumax3.py')
+if main_folder not in sys.path:
+    sys.path.insert(0,main_folder)
+
+def alive(pid):
+    ''' True if a process runs. Killed processes that were not waited for yet (zombies) do not count. '''
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return False
+    if not os.path.exists(f'/proc/{pid}/stat'):
+        return True
+    with open(f'/proc/{pid}/stat') as file:
+        return file.read().split(')')[-1].split()[0] != 'Z'
+
+@pytest.fixture
+def write_script(tmp_path):
+    ''' Write a script with stub instructions (see stub_mumax3.py). Returns a function (name, *lines) -> path. '''
+    def write(name,*lines):
+        path = tmp_path / f'{name}.mx3'
+        path.write_text('\n'.join(['m = RandomMag()',*lines,'relax()']) + '\n')
+        return str(path)
+    return write
+
+@pytest.fixture
+def stub_options():
+    ''' JobRunner options that start the stub instead of mumax3. '''
+    return {'mumax': sys.executable, 'args': [stub], 'verbose': False}
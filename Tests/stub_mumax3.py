@@ -0,0 +1,53 @@
+"""
+Stand-in for the mumax3 executable in the tests, started as: python stub_mumax3.py [-gpu n] script.mx3
+It reads instructions from comments in the script:
+    //stub sleep <s>        run for s seconds before finishing
+    //stub fail             print a panic and exit with code 1
+    //stub marker           print an error but exit with code 0, which mumax3 does for some errors
+    //stub flaky <file>     fail unless <file> exists and create it, so only the first attempt fails
+    //stub pid <file>       write the process id to <file> at the start
+    //stub lines <n>        print n lines of progress
+Like mumax3 it writes log.txt and table.txt to <name>.out next to the script.
+"""
+import time
+import sys
+import os
+
+def main(argv):
+    script = os.path.abspath(argv[-1])
+    with open(script) as file:
+        text = file.read()
+    commands = [line.split()[1:] for line in text.splitlines() if line.startswith('//stub ')]
+    output = script[:-4] + '.out'
+    os.makedirs(output,exist_ok=True)
+    print(f'//output directory: {output}',flush=True)
+    with open(os.path.join(output,'log.txt'),'w') as file:
+        file.write(text)
+
+    for command in commands:
+        if command[0] == 'pid':
+            with open(command[1],'w') as file:
+                file.write(str(os.getpid()))
+        elif command[0] == 'sleep':
+            time.sleep(float(command[1]))
+        elif command[0] == 'fail':
+            print('panic: stub failure',file=sys.stderr,flush=True)
+            return 1
+        elif command[0] == 'lines':
+            for i in range(int(command[1])):
+                print(f'//step {i}')
+            sys.stdout.flush()
+        elif command[0] == 'marker':
+            print('error: stub error without exit code',flush=True)
+        elif command[0] == 'flaky' and not os.path.exists(command[1]):
+            open(command[1],'w').close()
+            print('panic: first attempt fails',file=sys.stderr,flush=True)
+            return 1
+
+    with open(os.path.join(output,'table.txt'),'w') as file:
+        file.write('# t (s)\tmx ()\tmy ()\tmz ()\n0\t1\t0\t0\n')
+    print('//stub finished',flush=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,8 @@
+from Modules.MumaxScripter import MumaxScripter
+import os
+
+def test_too_coarse_for_height(tmp_path):
+    simulation = MumaxScripter(project_folder=str(tmp_path),change_dir=False,verbose=False,h=5,cell_size=5,contacts=False,smooth_grid=False)
+    assert simulation.Nz == 1
+    assert simulation.coarse_start(factor=2,mumax='false') is False
+    assert not os.path.exists(os.path.join(str(tmp_path),simulation.name+'_coarse.mx3'))
@@ -0,0 +1,23 @@
+from Modules.Plotting.magplot import quiver_arrows
+import Modules.pyramid as pyr
+import numpy as np
+import pytest
+
+def frame(tmp_path,Nx,Ny):
+    m = np.zeros((Nx,Ny,1,3),dtype='float32')
+    m[...,0] = 1
+    file = str(tmp_path/'m_full000000.npy')
+    np.save(file,m)
+    pyr.make_pyramid([file],levels=3)
+    return file,m[:,:,0]
+
+@pytest.mark.parametrize('Nx,skip',[(200,6),(240,8),(210,7)])
+def test_arrows_evenly_spaced(tmp_path,Nx,skip):
+    file,data = frame(tmp_path,Nx,100)
+    assert max(int(Nx/30),1) == skip
+    xx,yy,arrows,arrow_mask = quiver_arrows(file,data,np.zeros(data.shape[:2],dtype='bool'),skip)
+    assert np.all(np.diff(xx[:,0]) == skip)
+    assert np.all(np.diff(yy[0,:]) == skip)
+    assert len(xx) == len(range(0,Nx,skip))
+    assert not arrow_mask.any()
+    assert np.allclose(arrows[...,0],1)
@@ -0,0 +1,18 @@
+import Modules.mx3script as mx3
+
+def optimized(*nodes):
+    script = mx3.Script()
+    script.add_stage('Test',list(nodes))
+    report = script.optimize()
+    return [line for stage in script.stages for line in stage.lines() if line], report
+
+def test_overwritten_field_is_removed():
+    lines,report = optimized(mx3.SetField([0,0,10]),mx3.SetField([0,0,20]),mx3.Relax())
+    assert 'B_ext = vector(0/1000,0/1000,10/1000)' not in lines
+    assert 'B_ext = vector(0/1000,0/1000,20/1000)' in lines
+    assert len(report) == 1
+
+def test_saved_field_is_kept():
+    lines,report = optimized(mx3.SetField([0,0,10]),mx3.Save('table'),mx3.SetField([0,0,20]),mx3.Relax())
+    assert [line for line in lines if not line.startswith('/*')][:3] == ['B_ext = vector(0/1000,0/1000,10/1000)','tablesave()','B_ext = vector(0/1000,0/1000,20/1000)']
+    assert report == []
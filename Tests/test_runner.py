@@ -0,0 +1,75 @@
+import Modules.runner as runner
+from conftest import alive
+import threading
+import json
+import time
+import os
+
+def test_success(write_script,stub_options):
+    script = write_script('ok')
+    job, = runner.run_scripts([script],**stub_options)
+    assert (job.status,job.returncode,job.attempts) == ('done',0,1)
+    assert os.path.exists(os.path.join(job.output,'table.txt'))
+    with open(job.record) as file:
+        assert json.load(file)['status'] == 'done'
+    with open(job.log) as file:
+        assert 'stub finished' in file.read()
+
+def test_exit_code(write_script,stub_options):
+    job, = runner.run_scripts([write_script('fail','//stub fail')],**stub_options)
+    assert job.status == 'failed'
+    assert job.reason == 'exit code 1'
+
+def test_failure_marker(write_script,stub_options):
+    job, = runner.run_scripts([write_script('marker','//stub marker')],**stub_options)
+    assert (job.status,job.returncode) == ('failed',0)
+    assert job.reason.startswith('error in output')
+
+def test_long_output(write_script,stub_options):
+    jobs = runner.JobRunner(monitor={'interval': 0.05,'report': 0},**stub_options)
+    job = jobs.submit(write_script('long','//stub lines 20000','//stub marker','//stub lines 10','//stub marker'))
+    jobs.run()
+    assert job.reason == 'error in output: error: stub error without exit code'
+    with open(job.log) as file:
+        assert sum(line.startswith('//step') for line in file) == 20010
+    assert job.metrics is not None
+
+def test_timeout(write_script,stub_options):
+    start = time.time()
+    job, = runner.run_scripts([write_script('slow','//stub sleep 30')],timeout=1,**stub_options)
+    assert job.status == 'timeout'
+    assert time.time() - start < 15
+
+def test_retry(write_script,stub_options,tmp_path):
+    flag = tmp_path / 'attempted'
+    job, = runner.run_scripts([write_script('flaky',f'//stub flaky {flag}')],retries=2,**stub_options)
+    assert (job.status,job.attempts) == ('done',2)
+
+def test_retries_run_out(write_script,stub_options):
+    job, = runner.run_scripts([write_script('fail','//stub fail')],retries=1,**stub_options)
+    assert (job.status,job.attempts) == ('failed',2)
+
+def test_concurrency(write_script,stub_options):
+    scripts = [write_script(f'job{i}','//stub sleep 1') for i in range(4)]
+    start = time.time()
+    jobs = runner.run_scripts(scripts,concurrency=4,**stub_options)
+    assert all(job.status == 'done' for job in jobs)
+    assert time.time() - start < 3.5
+
+def test_cancel_from_other_thread(write_script,stub_options,tmp_path):
+    pid = tmp_path / 'pid'
+    jobs = runner.JobRunner(concurrency=1,**stub_options)
+    running = jobs.submit(write_script('long',f'//stub pid {pid}','//stub sleep 60'))
+    queued = jobs.submit(write_script('next'))
+    #Cancel from another thread once the simulation runs
+    def cancel():
+        while not pid.exists() or not pid.read_text():
+            time.sleep(0.05)
+        jobs.cancel()
+    threading.Thread(target=cancel,daemon=True).start()
+    start = time.time()
+    jobs.run()
+    assert time.time() - start < 30
+    assert running.status == 'cancelled'
+    assert queued.status == 'cancelled'
+    assert not alive(int(pid.read_text()))
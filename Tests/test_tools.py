@@ -0,0 +1,51 @@
+import Modules.tools as tools
+import multiprocessing
+import pytest
+import json
+import time
+import os
+
+def add(path,n):
+    for i in range(n):
+        with tools.file_lock(path):
+            with open(path) as file:
+                count = json.load(file)
+            with open(path,'w') as file:
+                json.dump(count + 1,file)
+
+def test_file_lock_excludes(tmp_path):
+    path = str(tmp_path/'count.json')
+    with open(path,'w') as file:
+        json.dump(0,file)
+    with multiprocessing.get_context('spawn').Pool(6) as pool:
+        pool.starmap(add,[(path,30)]*6)
+    with open(path) as file:
+        assert json.load(file) == 180
+    assert sorted(os.listdir(tmp_path)) in (['count.json'],['.clock','count.json'])
+
+def test_stale_lock_is_broken(tmp_path):
+    path = str(tmp_path/'index.json')
+    open(path+'.lock','w').close()
+    os.utime(path+'.lock',(0,0))
+    with tools.file_lock(path,timeout=1):
+        assert os.path.exists(path+'.lock')
+    assert not os.path.exists(path+'.lock')
+
+def test_fresh_lock_is_not_broken_twice(tmp_path):
+    lock = str(tmp_path/'index.json.lock')
+    open(lock,'w').close()
+    os.utime(lock,(0,0))
+    tools._break_lock(lock,stale=10)
+    #A new holder takes the lock; a second waiter still acts on the old stale lock
+    open(lock,'w').close()
+    tools._break_lock(lock,stale=10)
+    assert os.path.exists(lock)
+    assert [file for file in os.listdir(tmp_path) if file.endswith('.stale')] == []
+
+def test_lock_from_machine_with_clock_ahead(tmp_path):
+    path = str(tmp_path/'index.json')
+    open(path+'.lock','w').close()
+    os.utime(path+'.lock',(time.time()+1000,)*2)
+    with pytest.raises(TimeoutError):
+        with tools.file_lock(path,timeout=0.3,stale=10):
+            pass
@@ -0,0 +1,112 @@
+from Modules.workqueue import WorkQueue
+from conftest import main_folder, stub, alive
+import multiprocessing
+import subprocess
+import signal
+import json
+import time
+import sys
+import os
+
+def start_worker(folder,heartbeat=0.3,idle_exit=3.0):
+    ''' Start a worker in its own process that runs the stub instead of mumax3. '''
+    code = ('import sys; from Modules.workqueue import Worker; '
+            f'Worker({folder!r},mumax=sys.executable,args=[{stub!r}],heartbeat={heartbeat},poll=0.1,'
+            f'idle_exit={idle_exit},verbose=False).run()')
+    return subprocess.Popen([sys.executable,'-c',code],cwd=main_folder)
+
+def wait_for(condition,timeout=30.0):
+    start = time.time()
+    while not condition():
+        assert time.time() - start < timeout, 'condition not reached in time'
+        time.sleep(0.05)
+
+def claim_all(folder,worker):
+    queue = WorkQueue(folder)
+    claimed = []
+    while (job := queue.claim(worker)) is not None:
+        claimed.append(job['id'])
+    return claimed
+
+def test_claims_are_exclusive(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue')
+    jobs = [queue.submit(write_script(f'job{i}')) for i in range(40)]
+    with multiprocessing.get_context('spawn').Pool(8) as pool:
+        claimed = pool.starmap(claim_all,[(str(tmp_path/'queue'),f'worker{i}') for i in range(8)])
+    claimed = [job for worker in claimed for job in worker]
+    assert sorted(claimed) == sorted(jobs)
+    assert queue.jobs('pending') == []
+
+def test_finish_after_requeue(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue',stale=1)
+    queue.submit(write_script('job'))
+    job = queue.claim('a')
+    #The worker stops sending heartbeats and the job is requeued before it finishes
+    os.utime(queue.lock(job['id']),(0,0))
+    assert queue.requeue_stale() == [job['id']]
+    assert not queue.finish(job,dict(job,status='done'),'a')
+    assert queue.jobs('pending') == [job['id']] and queue.jobs('done') == []
+
+def test_requeue_after_finish(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue',stale=1)
+    queue.submit(write_script('job'))
+    job = queue.claim('a')
+    os.utime(queue.lock(job['id']),(0,0))
+    assert queue.finish(job,dict(job,status='done'),'a')
+    assert queue.requeue_stale() == []
+    assert queue.jobs('done') == [job['id']] and queue.jobs('pending') == queue.jobs('claimed') == []
+
+def test_dead_worker_halfway(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue',stale=1)
+    queue.submit(write_script('job'))
+    job = queue.claim('a')
+    #A worker that died after taking the lock in finish()
+    taken = f'{queue.lock(job["id"])}.0.taken'
+    os.rename(queue.lock(job['id']),taken)
+    os.utime(taken,(0,0))
+    queue.requeue_stale()
+    assert queue.requeue_stale() == [job['id']]
+    assert os.listdir(tmp_path/'queue'/'locks') == []
+
+def test_workers(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue',stale=2)
+    good = [queue.submit(write_script(f'good{i}','//stub sleep 0.2')) for i in range(6)]
+    bad = queue.submit(write_script('bad','//stub fail'))
+    workers = [start_worker(queue.folder) for i in range(3)]
+    for worker in workers:
+        assert worker.wait(60) == 0
+    assert sorted(queue.jobs('done')) == sorted(good)
+    assert queue.jobs('failed') == [bad]
+    assert os.listdir(tmp_path/'queue'/'workers') == []
+
+def test_killed_worker(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue',stale=2)
+    pid = tmp_path/'pid'
+    job = queue.submit(write_script('job',f'//stub pid {pid}','//stub sleep 4'))
+    first = start_worker(queue.folder)
+    wait_for(lambda: pid.exists() and pid.read_text())
+    first.send_signal(signal.SIGKILL)
+    first.wait()
+    #The simulation dies with its worker and another worker takes the job over
+    if sys.platform.startswith('linux'):
+        wait_for(lambda: not alive(int(pid.read_text())),timeout=1.5)
+    second = start_worker(queue.folder,idle_exit=8.0)
+    assert second.wait(60) == 0
+    assert queue.jobs('done') == [job]
+    with open(queue.path('done',job)) as file:
+        record = json.load(file)
+    assert record['claims'] == 2 and 'stopped sending heartbeats' in record['requeued']
+
+def test_lost_job(tmp_path,write_script):
+    queue = WorkQueue(tmp_path/'queue',stale=60)
+    pid = tmp_path/'pid'
+    job = queue.submit(write_script('job',f'//stub pid {pid}','//stub sleep 30'))
+    worker = start_worker(queue.folder,idle_exit=1.0)
+    wait_for(lambda: pid.exists() and pid.read_text())
+    #Another worker took the job over, e.g. after a network outage
+    with open(queue.lock(job),'w') as file:
+        json.dump({'worker': 'other'},file)
+    assert worker.wait(30) == 0
+    assert not alive(int(pid.read_text()))
+    assert queue.jobs('done') == [] and queue.jobs('claimed') == [job]
+    assert queue.owner(job) == 'other'